@@ -0,0 +1,286 @@
+"""End-to-end load test against the local fake Bot API server (no real users are contacted).
+
+Builds a synthetic database of --users registered users, starts fake_bot_api.py in a
+child process and drives the real Application (main.build_application) with
+synthetic updates through the same update processor the bot uses:
+
+1. registration: --signups new users go through /start, contact, lang_, country_
+   and one main-menu text, --signup-concurrency users at a time. The fake server's
+   429 injection is off in this phase, so every signup is expected to register;
+2. broadcast: the admin picks "Send to all", sends a photo and confirms, then the
+   harness waits for the background job to finish (with 429 injection on).
+
+It reports per-update and per-send API latency (p50/p99), broadcast msgs/s, the
+delivery outcomes from both sides, and the bot process's RSS after each phase.
+The run exits with an error when signups did not register or the broadcast did not
+reach every user, so a broken run cannot pass for a fast one.
+
+Usage:
+    python benchmarks/broadcast_load.py --users 10000
+    python benchmarks/broadcast_load.py --users 1000000 --rate 2000 --concurrency 200 --flood-rate 0
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main  # noqa: E402
+import httpx  # noqa: E402
+from telegram import Update  # noqa: E402
+
+import fake_bot_api  # noqa: E402
+
+UPDATE_IDS = itertools.count(1)
+MESSAGE_IDS = itertools.count(1)
+
+
+class TimedRequest(main.InstrumentedRequest):
+    """Keeps every API call's latency so the report can show exact percentiles"""
+
+    latencies = defaultdict(list)
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            self.latencies[url.rsplit('/', 1)[-1]].append(time.perf_counter() - started)
+
+
+def build_database(path: str, users: int):
+    main.db = main.Database(path)
+    main.init_db()
+    countries = list(main.COUNTRIES)
+    languages = list(main.LANGUAGES)
+    with main.db.transaction() as cursor:
+        cursor.executemany(
+            'INSERT INTO users (user_id, name, phone, language, country) VALUES (?, ?, ?, ?, ?)',
+            ((uid, f'User {uid}', f'+100{uid}', random.choice(languages), random.choice(countries))
+             for uid in range(1, users + 1))
+        )
+    main.rebuild_user_stats()
+
+
+def rss_mb() -> float:
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+# ---------- synthetic updates ----------
+def user(uid: int) -> dict:
+    return {'id': uid, 'is_bot': False, 'first_name': f'User {uid}'}
+
+
+def message_update(uid: int, **fields) -> dict:
+    return {'update_id': next(UPDATE_IDS), 'message': {
+        'message_id': next(MESSAGE_IDS), 'date': int(time.time()),
+        'chat': {'id': uid, 'type': 'private'}, 'from': user(uid), **fields
+    }}
+
+
+def command_update(uid: int, command: str) -> dict:
+    return message_update(uid, text=command, entities=[{'type': 'bot_command', 'offset': 0, 'length': len(command)}])
+
+
+def callback_update(uid: int, data: str) -> dict:
+    return {'update_id': next(UPDATE_IDS), 'callback_query': {
+        'id': str(next(MESSAGE_IDS)), 'from': user(uid), 'chat_instance': str(uid), 'data': data,
+        'message': {'message_id': next(MESSAGE_IDS), 'date': int(time.time()),
+                    'chat': {'id': uid, 'type': 'private'}, 'from': fake_bot_api.BOT_USER, 'text': '...'}
+    }}
+
+
+def signup_updates(uid: int) -> list:
+    return [
+        ('start', command_update(uid, '/start')),
+        ('contact', message_update(uid, contact={'phone_number': f'+100{uid}', 'first_name': f'User {uid}', 'user_id': uid})),
+        ('language', callback_update(uid, f'lang_{random.choice(list(main.LANGUAGES))}')),
+        ('country', callback_update(uid, f'country_{random.choice(list(main.COUNTRIES))}')),
+        ('menu', message_update(uid, text='ℹ️ About Program')),
+    ]
+
+
+async def feed(application, payload: dict):
+    """Process one update the way Application does for fetched updates"""
+    update = Update.de_json(payload, application.bot)
+    await application.update_processor.process_update(update, application.process_update(update))
+
+
+# ---------- scenarios ----------
+async def run_signups(application, first_uid: int, signups: int, concurrency: int):
+    latencies = defaultdict(list)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def sign_up(uid: int):
+        async with slots:
+            for step, payload in signup_updates(uid):
+                started = time.perf_counter()
+                await feed(application, payload)
+                latencies[step].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(sign_up(uid) for uid in range(first_uid, first_uid + signups)))
+    return latencies, time.perf_counter() - started
+
+
+async def run_broadcast(application):
+    admin_id = main.ADMIN_IDS[0]
+    await feed(application, callback_update(admin_id, 'broadcast_all'))
+    await feed(application, message_update(admin_id, caption='Load test', photo=[
+        {'file_id': 'load-test-photo', 'file_unique_id': 'load-test', 'width': 640, 'height': 480}
+    ]))
+
+    TimedRequest.latencies.clear()
+    started = time.perf_counter()
+    await feed(application, callback_update(admin_id, 'confirm_send'))
+    if not main.BROADCAST_MANAGER.active:
+        raise SystemExit('The broadcast job did not start')
+    job_id = next(iter(main.BROADCAST_MANAGER.active))
+    while main.BROADCAST_MANAGER.active:
+        await asyncio.sleep(0.2)
+    return await main.run_db(main.get_broadcast_job, job_id), time.perf_counter() - started
+
+
+async def set_flood(client: httpx.AsyncClient, server_url: str, enabled: bool):
+    await client.post(f'{server_url}/flood', content=b'on' if enabled else b'off')
+
+
+def handler_errors() -> float:
+    return sum(main.HANDLER_ERRORS.values.values())
+
+
+async def run(args, server_url: str):
+    main.TELEGRAM_API_URL = f'{server_url}/bot'
+    main.METRICS_PORT = args.metrics_port
+    application = main.build_application(TimedRequest(connection_pool_size=256))
+    client = httpx.AsyncClient()
+
+    # Handlers print per update; keep that work but not the output
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        await application.initialize()
+        await application.post_init(application)
+        await application.start()
+
+        await set_flood(client, server_url, False)
+        errors_before = handler_errors()
+        signup_latencies, signup_wall = await run_signups(application, args.users + 1, args.signups, args.signup_concurrency)
+        signup_errors = handler_errors() - errors_before
+        registered = main.db.fetchone(
+            'SELECT COUNT(*) FROM users WHERE user_id > ?', (args.users,)
+        )[0]
+        rss_after_signups = rss_mb()
+
+        await set_flood(client, server_url, True)
+        job, broadcast_wall = await run_broadcast(application)
+        rss_after_broadcast = rss_mb()
+
+        await application.stop()
+        await application.post_stop(application)
+        await application.shutdown()
+        await application.post_shutdown(application)
+
+    server_stats = (await client.get(f'{server_url}/stats')).json()
+    await client.aclose()
+
+    print(f"\nRegistration: {registered}/{args.signups} signups registered in {signup_wall:.2f}s "
+          f"({registered / signup_wall:.1f} signups/s, {args.signups * 5 / signup_wall:.1f} updates/s), "
+          f"{signup_errors:g} handler errors")
+    print(f"{'update':<12}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for step, values in signup_latencies.items():
+        print(f"{step:<12}{len(values):>8}{statistics.median(values) * 1000:>10.1f}{percentile(values, 99) * 1000:>10.1f}")
+
+    processed = job['sent_count'] + job['failed_count']
+    print(f"\nBroadcast #{job['id']}: {processed}/{job['total_count']} recipients in {broadcast_wall:.2f}s "
+          f"({processed / broadcast_wall:.1f} msgs/s), status {job['status']}")
+    print(f"  sent {job['sent_count']} · failed {job['failed_count']} · "
+          f"flood waits {sum(main.BROADCAST_FLOOD_WAITS.values.values()):g}")
+    print(f"{'api method':<20}{'calls':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for api_method, values in sorted(TimedRequest.latencies.items()):
+        print(f"{api_method:<20}{len(values):>8}{statistics.median(values) * 1000:>10.1f}{percentile(values, 99) * 1000:>10.1f}")
+
+    print("\nFake server outcomes: " + json.dumps(server_stats))
+    print(f"\nMemory (bot process): {rss_after_signups:.0f} MB after signups, "
+          f"{rss_after_broadcast:.0f} MB after broadcast, peak {peak_rss_mb():.0f} MB")
+
+    problems = []
+    if registered != args.signups or signup_errors:
+        problems.append(f"{args.signups - registered} signups did not register ({signup_errors:g} handler errors)")
+    if job['total_count'] != args.users + registered:
+        problems.append(f"broadcast total {job['total_count']}, expected {args.users + registered}")
+    if processed != job['total_count']:
+        problems.append(f"broadcast processed {processed} of {job['total_count']} recipients")
+    if problems:
+        raise SystemExit('Run invalid: ' + '; '.join(problems))
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10000, help='registered users in the synthetic database')
+    parser.add_argument('--signups', type=int, default=1000)
+    parser.add_argument('--signup-concurrency', type=int, default=50, help='users registering at the same time')
+    parser.add_argument('--rate', type=float, help='override BROADCAST_RATE')
+    parser.add_argument('--concurrency', type=int, help='override BROADCAST_CONCURRENCY')
+    parser.add_argument('--port', type=int, default=8081, help='fake Bot API port')
+    parser.add_argument('--metrics-port', type=int, default=0, help='serve the bot /metrics during the run')
+    fake_bot_api.add_arguments(parser)
+    args = parser.parse_args()
+    # Users signing up during the run have not blocked the bot
+    args.forbidden_max_id = args.forbidden_max_id or args.users
+
+    if args.rate:
+        main.BROADCAST_SETTINGS['rate'] = args.rate
+        main.BROADCAST_LIMITER.set_rate(args.rate)
+    if args.concurrency:
+        main.BROADCAST_SETTINGS['concurrency'] = args.concurrency
+    # Per-request httpx and per-recipient broadcast logging would swamp the report
+    logging.getLogger().setLevel(logging.ERROR)
+    random.seed(1)
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(
+        target=fake_bot_api.serve_forever,
+        args=('127.0.0.1', args.port, fake_bot_api.server_options(args), ready),
+        daemon=True
+    )
+    server.start()
+    try:
+        if not ready.wait(10):
+            raise SystemExit('The fake Bot API server did not start')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            started = time.perf_counter()
+            build_database(os.path.join(tmp, 'bench.db'), args.users)
+            print(f"Built {args.users} users in {time.perf_counter() - started:.1f}s (RSS {rss_mb():.0f} MB)")
+            asyncio.run(run(args, f'http://127.0.0.1:{args.port}'))
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,220 @@
+"""Local stand-in for the Telegram Bot API, for load tests that must not reach real users.
+
+Answers every /bot<token>/<method> call with a plausible result after a simulated
+network latency (log-normal around --latency). It can also inject failures:
+- Forbidden ("bot was blocked by the user") for a fixed, deterministic share of chat ids
+- 429 retry_after once more than --flood-rate sends arrive within one second
+- 429 retry_after at random, for a --flood-share of sends
+
+Multipart uploads are accepted too. --upload-bandwidth models the bot's uplink: request
+bodies queue for one shared link of that speed, so concurrent uploads slow each other. Forwarded messages come back as photos, so
+scripts that read a file_id from a forward (media_broadcast.py) work unchanged.
+
+GET /stats returns per-method outcome counts and request bytes as JSON. POST /flood with
+body 'on' or 'off' switches the 429 injection at runtime (broadcast_load.py keeps it off
+while users register). broadcast_load.py starts this
+server itself; run it standalone to point a real bot process at it:
+
+Usage:
+    python benchmarks/fake_bot_api.py --port 8081 --latency 0.05 --forbidden-share 0.05
+    TELEGRAM_API_URL=http://127.0.0.1:8081/bot python main.py
+"""
+import argparse
+import asyncio
+import email.parser
+import email.policy
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter, deque
+from urllib.parse import parse_qsl
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main  # noqa: E402
+
+BOT_USER = {'id': 1000000001, 'is_bot': True, 'first_name': 'Load Test Bot', 'username': 'load_test_bot'}
+
+# Methods that count as deliveries: only these are rate limited or refused
+SEND_METHODS = {'sendMessage', 'copyMessage', 'forwardMessage', 'sendPhoto', 'sendVideo', 'sendDocument'}
+
+
+class FakeBotApi:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.5, forbidden_share: float = 0.0,
+                 flood_rate: float = 0.0, flood_share: float = 0.0, retry_after: int = 1,
+                 forbidden_max_id: int = 0, upload_bandwidth: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.forbidden_share = forbidden_share
+        self.forbidden_max_id = forbidden_max_id  # only chats up to this id can have blocked the bot (0 = any)
+        self.flood_rate = flood_rate
+        self.flood_share = flood_share
+        self.retry_after = retry_after
+        self.flood_enabled = True
+        self.upload_bandwidth = upload_bandwidth  # request body bytes/s (0 = unlimited)
+        self.link_free_at = 0.0
+        self.recent_sends: deque = deque()
+        self.message_id = 0
+        self.stats = Counter()
+
+    def is_blocked(self, chat_id: int) -> bool:
+        if self.forbidden_max_id and chat_id > self.forbidden_max_id:
+            return False
+        # Multiplicative hash, so the same users are "blocked" on every run and in every process
+        return (chat_id * 2654435761) % 10000 < self.forbidden_share * 10000
+
+    def flooded(self) -> bool:
+        if not self.flood_enabled:
+            return False
+        now = time.monotonic()
+        while self.recent_sends and self.recent_sends[0] <= now - 1:
+            self.recent_sends.popleft()
+        if self.flood_rate and len(self.recent_sends) >= self.flood_rate:
+            return True
+        if random.random() < self.flood_share:
+            return True
+        self.recent_sends.append(now)
+        return False
+
+    def message(self, params: dict) -> dict:
+        self.message_id += 1
+        message = {
+            'message_id': int(params.get('message_id') or self.message_id),
+            'date': int(time.time()),
+            'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+            'from': BOT_USER
+        }
+        if 'text' in params:
+            message['text'] = params['text']
+        if 'caption' in params:
+            message['caption'] = params['caption']
+        if 'photo' in params:
+            message['photo'] = [{'file_id': params['photo'], 'file_unique_id': 'fake', 'width': 1, 'height': 1}]
+        elif 'from_chat_id' in params:
+            # A forward of the "source" message: always a photo with a stable file_id
+            message['photo'] = [{'file_id': f"fake-photo-{params.get('message_id')}", 'file_unique_id': 'fake',
+                                 'width': 1280, 'height': 720}]
+        if 'inline_keyboard' in params.get('reply_markup', ''):
+            message['reply_markup'] = json.loads(params['reply_markup'])  # messages only carry inline keyboards
+        return message
+
+    def result(self, api_method: str, params: dict):
+        if api_method == 'getMe':
+            return BOT_USER
+        if api_method == 'copyMessage':
+            self.message_id += 1
+            return {'message_id': self.message_id}
+        if api_method in SEND_METHODS or api_method.startswith('edit'):
+            return self.message(params)
+        return True  # answerCallbackQuery, deleteMessage, setWebhook, ...
+
+    async def handle(self, request: 'main.HTTPRequest'):
+        if request.path == '/stats':
+            stats = {f'{method} {outcome}': count for (method, outcome), count in sorted(self.stats.items())}
+            stats['cpu_seconds'] = round(time.process_time(), 2)
+            return 200, 'application/json', json.dumps(stats).encode()
+        if request.path == '/flood':
+            self.flood_enabled = request.body.strip() == b'on'
+            return 200, 'text/plain', b'on' if self.flood_enabled else b'off'
+
+        api_method = request.path.rsplit('/', 1)[-1]
+        params = parse_params(request)
+        self.stats[api_method, 'bytes'] += len(request.body)
+        delay = self.latency * random.lognormvariate(0, self.jitter)
+        if self.upload_bandwidth:
+            # The body goes out once the bodies ahead of it have
+            now = time.monotonic()
+            self.link_free_at = max(self.link_free_at, now) + len(request.body) / self.upload_bandwidth
+            delay += self.link_free_at - now
+        await asyncio.sleep(delay)
+
+        if api_method in SEND_METHODS:
+            if self.flooded():
+                self.stats[api_method, 'flood_wait'] += 1
+                return self.error(429, f'Too Many Requests: retry after {self.retry_after}',
+                                  {'retry_after': self.retry_after})
+            if self.is_blocked(int(params.get('chat_id', 0))):
+                self.stats[api_method, 'forbidden'] += 1
+                return self.error(403, 'Forbidden: bot was blocked by the user')
+
+        self.stats[api_method, 'ok'] += 1
+        return 200, 'application/json', json.dumps({'ok': True, 'result': self.result(api_method, params)}).encode()
+
+    def error(self, code: int, description: str, parameters: dict = None):
+        payload = {'ok': False, 'error_code': code, 'description': description}
+        if parameters:
+            payload['parameters'] = parameters
+        return code, 'application/json', json.dumps(payload).encode()
+
+
+def parse_params(request: 'main.HTTPRequest') -> dict:
+    """Form fields of a urlencoded or multipart request; an uploaded file becomes 'upload:<bytes>'"""
+    if not request.body:
+        return {}
+    content_type = request.headers.get('content-type', '')
+    if not content_type.startswith('multipart/form-data'):
+        return dict(parse_qsl(request.body.decode()))
+
+    form = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f'Content-Type: {content_type}\r\n\r\n'.encode() + request.body
+    )
+    params = {}
+    for part in form.iter_parts():
+        payload = part.get_payload(decode=True) or b''
+        if part.get_filename():
+            params[part.get_param('name', header='content-disposition')] = f'upload:{len(payload)}'
+        else:
+            params[part.get_param('name', header='content-disposition')] = payload.decode()
+    return params
+
+
+async def serve(host: str, port: int, api: FakeBotApi, ready=None):
+    server = await main.serve_http(host, port, api.handle)
+    if ready is not None:
+        ready.set()
+    async with server:
+        await server.serve_forever()
+
+
+def serve_forever(host: str, port: int, options: dict, ready=None):
+    """Process entry point (see broadcast_load.py)"""
+    try:
+        asyncio.run(serve(host, port, FakeBotApi(**options), ready))
+    except KeyboardInterrupt:
+        pass
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--latency', type=float, default=0.05, help='median API latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.5, help='log-normal sigma of the latency')
+    parser.add_argument('--forbidden-share', type=float, default=0.05, help='share of chats that blocked the bot')
+    parser.add_argument('--flood-rate', type=float, default=30, help='sends/s before 429s (0 = unlimited)')
+    parser.add_argument('--flood-share', type=float, default=0.001, help='share of sends refused with a random 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--forbidden-max-id', type=int, default=0, help='only chat ids up to this can be blocked (0 = any)')
+    parser.add_argument('--upload-bandwidth', type=float, default=0, help='simulated upload speed in MB/s (0 = unlimited)')
+
+
+def server_options(args) -> dict:
+    return {
+        'latency': args.latency, 'jitter': args.jitter, 'forbidden_share': args.forbidden_share,
+        'flood_rate': args.flood_rate, 'flood_share': args.flood_share, 'retry_after': args.retry_after,
+        'forbidden_max_id': args.forbidden_max_id, 'upload_bandwidth': args.upload_bandwidth * 1e6
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    print(f"Fake Bot API on http://{args.host}:{args.port}/bot<token>/ (stats: /stats)")
+    serve_forever(args.host, args.port, server_options(args))
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,126 @@
+"""Handler latency under concurrent load: blocking DB calls vs. the run_db() facade.
+
+Simulates the bot's update mix against a synthetic database: mostly main-menu
+messages (a last_active write + get_user + one API reply) with an occasional
+heavy admin request that reads the whole users table. Updates arrive at a
+fixed rate (open loop), so anything that blocks the event loop shows up as
+queueing delay for every other update.
+
+Usage:
+    python benchmarks/handler_latency.py --users 50000 --rate 400 --seconds 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main  # noqa: E402
+
+API_LATENCY = 0.03  # simulated Telegram round trip for the reply
+
+
+def build_database(path: str, users: int):
+    main.db = main.Database(path)
+    main.init_db()
+    countries = list(main.COUNTRIES)
+    with main.db.transaction() as cursor:
+        cursor.executemany(
+            'INSERT INTO users (user_id, name, phone, language, country) VALUES (?, ?, ?, ?, ?)',
+            ((uid, f'User {uid}', f'+100{uid}', 'ENG', random.choice(countries)) for uid in range(1, users + 1))
+        )
+
+
+async def call(mode: str, func, *args):
+    if mode == 'async':
+        return await main.run_db(func, *args)
+    return func(*args)
+
+
+def update_user_activity(user_id: int):
+    # One write per message, as handlers did before ACTIVITY_BUFFER batched them
+    with main.db.transaction() as cursor:
+        cursor.execute('UPDATE users SET last_active = CURRENT_TIMESTAMP WHERE user_id = ?', (user_id,))
+
+
+async def menu_update(mode: str, user_id: int):
+    await call(mode, update_user_activity, user_id)
+    await call(mode, main.get_user, user_id)
+    await asyncio.sleep(API_LATENCY)
+
+
+@main.read_only
+def read_all_users():
+    # Stand-in for a heavy admin query: reads and materializes the whole users table
+    return main.db.fetch_dicts('SELECT * FROM users ORDER BY registered_at DESC')
+
+
+async def stats_update(mode: str):
+    await call(mode, read_all_users)
+    await asyncio.sleep(API_LATENCY)
+
+
+async def run(mode: str, users: int, rate: float, seconds: float, admin_share: float):
+    latencies = []
+    tasks = []
+
+    interval = 1 / rate
+    deadline = time.perf_counter() + seconds
+    next_at = time.perf_counter()
+    while next_at < deadline:
+        if random.random() < admin_share:
+            coro = stats_update(mode)
+        else:
+            coro = menu_update(mode, random.randint(1, users))
+        # Latency is measured from the scheduled arrival, so event-loop stalls count
+        arrival = next_at
+        tasks.append(asyncio.create_task(timed_from(arrival, coro, latencies)))
+        next_at += interval
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+async def timed_from(arrival: float, coro, latencies: list):
+    await coro
+    latencies.append(time.perf_counter() - arrival)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--rate', type=float, default=400, help='updates per second')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--admin-share', type=float, default=0.005, help='fraction of updates that are admin stats')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        build_database(os.path.join(tmp, 'bench.db'), args.users)
+
+        print(f"{'mode':<10}{'updates':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for mode in ('blocking', 'async'):
+            random.seed(1)
+            latencies = asyncio.run(run(mode, args.users, args.rate, args.seconds, args.admin_share))
+            print(
+                f"{mode:<10}{len(latencies):>10}"
+                f"{statistics.median(latencies) * 1000:>10.1f}"
+                f"{percentile(latencies, 99) * 1000:>10.1f}"
+                f"{max(latencies) * 1000:>10.1f}"
+            )
+
+        main.db.close()
+
+
+if __name__ == '__main__':
+    main_cli()
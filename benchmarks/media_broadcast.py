@@ -0,0 +1,198 @@
+"""Media broadcasts: copy_message vs. native send_* with a reused file_id vs. re-uploading.
+
+Sends one photo/video/document message to a list of chats through each path:
+- copy_message: copy_message_sender (what broadcasts used to do)
+- file_id: media_message_sender (file_id reuse, what broadcasts do now)
+- upload: the file's bytes sent with every message (only with --upload or --fake)
+All paths use the same BroadcastEngine settings as the bot. Reports wall time, msgs/s,
+per-call latency, this process's CPU per message and, against the fake server,
+request bytes per message.
+With only a few target chats the 1s per-chat interval dominates wall time, so
+compare the latency columns (or pass more chats).
+
+--fake starts fake_bot_api.py in a child process and sends to --chats synthetic
+chat ids. No token or real chats are needed, and uploads are a generated file of
+--upload-size KB. Add --upload-bandwidth to price the upload path for a given
+link speed (on localhost it is almost free). Without --fake this talks to a real
+Bot API server, so it needs a bot token, a chat holding the source message, and
+target chats that have started the bot.
+
+Usage:
+    python benchmarks/media_broadcast.py --fake --chats 500 --rate 1000 --concurrency 50
+    python benchmarks/media_broadcast.py --fake --chats 500 --upload-bandwidth 10
+    TELEGRAM_BOT_TOKEN=... python benchmarks/media_broadcast.py \\
+        --from-chat 123 --message-id 456 --chat 111 --chat 222 --rounds 5 --upload photo.jpg
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main  # noqa: E402
+import httpx  # noqa: E402
+from telegram import Bot  # noqa: E402
+from telegram.request import HTTPXRequest  # noqa: E402
+
+import fake_bot_api  # noqa: E402
+
+
+def timed_sender(send, latencies: list):
+    async def wrapper(chat_id: int):
+        started = time.perf_counter()
+        try:
+            return await send(chat_id)
+        finally:
+            latencies.append(time.perf_counter() - started)
+    return wrapper
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def source_media(bot: Bot, from_chat: int, message_id: int) -> dict:
+    # copy_message only returns a MessageId; forwarding returns the full message with its file_ids
+    forwarded = await bot.forward_message(chat_id=from_chat, from_chat_id=from_chat, message_id=message_id)
+    try:
+        media = main.extract_broadcast_media(forwarded)
+    finally:
+        await bot.delete_message(chat_id=from_chat, message_id=forwarded.message_id)
+    if media is None:
+        raise SystemExit('The source message is not a photo, video or document')
+    return media
+
+
+def upload_sender(bot: Bot, media: dict, content: bytes):
+    """Send the file itself with every message, as a bot without file_id reuse would"""
+    method = getattr(bot, f"send_{media['type']}")
+
+    async def send(chat_id: int):
+        return await method(chat_id=chat_id, caption=media['caption'], **{media['type']: content})
+    return send
+
+
+async def server_bytes(stats_url: str) -> dict:
+    async with httpx.AsyncClient() as client:
+        stats = (await client.get(stats_url)).json()
+    return {key.rsplit(' ', 1)[0]: value for key, value in stats.items() if key.endswith(' bytes')}
+
+
+async def run(args, stats_url: str = None):
+    # Bot's default request has a single connection, which would serialize the workers
+    request = HTTPXRequest(connection_pool_size=main.BROADCAST_SETTINGS['concurrency'])
+    bot = Bot(args.token, base_url=args.base_url, request=request)
+    async with bot:
+        media = await source_media(bot, args.from_chat, args.message_id)
+        print(f"Source: {media['type']} {media['file_id'][:24]}... -> {len(args.chat)} chats x {args.rounds} rounds\n")
+
+        senders = {
+            'copy_message': (main.copy_message_sender(bot, args.from_chat, args.message_id), 'copyMessage'),
+            'file_id': (main.media_message_sender(bot, media, args.from_chat, args.message_id), f"send{media['type'].title()}"),
+        }
+        if args.upload_content:
+            senders['upload'] = (upload_sender(bot, media, args.upload_content), f"send{media['type'].title()}")
+
+        # Open the connection pool first, so the first path does not pay for it
+        warmup = args.chat[:main.BROADCAST_SETTINGS['concurrency']]
+        await main.BroadcastEngine().run(warmup, senders['copy_message'][0], total=len(warmup))
+        await asyncio.sleep(main.BROADCAST_SETTINGS['per_chat_interval'])
+
+        print(f"{'path':<14}{'msgs':>7}{'failed':>8}{'wall s':>9}{'msgs/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'cpu ms':>9}"
+              + (f"{'B/msg':>10}" if stats_url else ''))
+        for name, (send, api_method) in senders.items():
+            latencies = []
+            bytes_before = (await server_bytes(stats_url)).get(api_method, 0) if stats_url else 0
+            cpu_before = time.process_time()
+            started = time.perf_counter()
+            result = await main.BroadcastEngine().run(
+                [chat for _ in range(args.rounds) for chat in args.chat],
+                timed_sender(send, latencies),
+                total=len(args.chat) * args.rounds
+            )
+            wall = time.perf_counter() - started
+            cpu = time.process_time() - cpu_before
+            line = (
+                f"{name:<14}{result.processed:>7}{result.failed:>8}{wall:>9.2f}"
+                f"{result.processed / wall:>9.1f}"
+                f"{statistics.median(latencies) * 1000:>9.1f}"
+                f"{percentile(latencies, 99) * 1000:>9.1f}"
+                f"{cpu / result.processed * 1000:>9.2f}"
+            )
+            if stats_url:
+                sent_bytes = (await server_bytes(stats_url)).get(api_method, 0) - bytes_before
+                line += f"{sent_bytes / result.processed:>10.0f}"
+            print(line)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--token', default=os.environ.get('TELEGRAM_BOT_TOKEN'))
+    parser.add_argument('--base-url', default='https://api.telegram.org/bot')
+    parser.add_argument('--from-chat', type=int, help='chat holding the source media message')
+    parser.add_argument('--message-id', type=int)
+    parser.add_argument('--chat', type=int, action='append', default=[], help='target chat id (repeatable)')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--rate', type=float, help='override BROADCAST_RATE')
+    parser.add_argument('--concurrency', type=int, help='override BROADCAST_CONCURRENCY')
+    parser.add_argument('--upload', help='also time re-uploading this file with every message')
+    parser.add_argument('--fake', action='store_true', help='run against a local fake_bot_api.py server')
+    parser.add_argument('--chats', type=int, default=200, help='synthetic target chats with --fake')
+    parser.add_argument('--upload-size', type=int, default=200, help='generated upload size in KB with --fake')
+    parser.add_argument('--port', type=int, default=8082, help='fake Bot API port')
+    parser.add_argument('--upload-bandwidth', type=float, default=0, help='fake upload speed in MB/s (0 = unlimited)')
+    parser.add_argument('--latency', type=float, default=0.05, help='fake median API latency in seconds')
+    args = parser.parse_args()
+
+    args.upload_content = None
+    if args.upload:
+        with open(args.upload, 'rb') as upload:
+            args.upload_content = upload.read()
+    if args.fake:
+        args.token = args.token or '123:fake'
+        args.base_url = f'http://127.0.0.1:{args.port}/bot'
+        args.from_chat = args.from_chat or 1
+        args.message_id = args.message_id or 1
+        args.chat = args.chat or list(range(1000, 1000 + args.chats))
+        args.rounds = 1
+        args.upload_content = args.upload_content or os.urandom(args.upload_size * 1024)
+    elif not args.token:
+        parser.error('--token or TELEGRAM_BOT_TOKEN is required')
+    elif args.from_chat is None or args.message_id is None or not args.chat:
+        parser.error('--from-chat, --message-id and at least one --chat are required')
+    if args.rate:
+        main.BROADCAST_SETTINGS['rate'] = args.rate
+        main.BROADCAST_LIMITER.set_rate(args.rate)
+    if args.concurrency:
+        main.BROADCAST_SETTINGS['concurrency'] = args.concurrency
+
+    if not args.fake:
+        asyncio.run(run(args))
+        return
+
+    # Per-request httpx logging would swamp the report
+    logging.getLogger().setLevel(logging.ERROR)
+    options = {'latency': args.latency, 'upload_bandwidth': args.upload_bandwidth * 1e6}
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(
+        target=fake_bot_api.serve_forever, args=('127.0.0.1', args.port, options, ready), daemon=True
+    )
+    server.start()
+    try:
+        if not ready.wait(10):
+            raise SystemExit('The fake Bot API server did not start')
+        asyncio.run(run(args, f'http://127.0.0.1:{args.port}/stats'))
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == '__main__':
+    main_cli()
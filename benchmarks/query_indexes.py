@@ -0,0 +1,106 @@
+"""Query times on the users table before and after the index migrations.
+
+Builds a synthetic database at schema version 1 (the original, index-free
+schema), times the bot's hot users-table queries, applies the remaining
+migrations and times them again.
+
+Usage:
+    python benchmarks/query_indexes.py --users 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main  # noqa: E402
+
+REGISTERED_FROM = datetime(2024, 1, 1)
+
+
+def build_database(path: str, users: int) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    main.apply_migrations(conn, target=1)
+    countries = list(main.COUNTRIES)
+    languages = list(main.LANGUAGES)
+    span = int((datetime(2026, 10, 1) - REGISTERED_FROM).total_seconds())
+
+    def rows():
+        for uid in range(1, users + 1):
+            registered = REGISTERED_FROM + timedelta(seconds=random.randrange(span))
+            active = registered + timedelta(seconds=random.randrange(90 * 86400))
+            yield (
+                uid, f'User {uid}', f'+100{uid}', random.choice(languages), random.choice(countries),
+                registered.strftime('%Y-%m-%d %H:%M:%S'), active.strftime('%Y-%m-%d %H:%M:%S')
+            )
+
+    conn.executemany('INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?)', rows())
+    conn.commit()
+    conn.execute('ANALYZE')
+    return conn
+
+
+def queries():
+    middle = (REGISTERED_FROM + timedelta(days=400)).strftime('%Y-%m-%d %H:%M:%S')
+    recent = (REGISTERED_FROM + timedelta(days=900)).strftime('%Y-%m-%d %H:%M:%S')
+    return [
+        ('country listing, newest 50',
+         'SELECT * FROM users WHERE country = ? ORDER BY registered_at DESC LIMIT 50', ('BD',)),
+        ('user list first page',
+         'SELECT user_id, name, country, phone, registered_at FROM users '
+         'ORDER BY registered_at DESC, user_id DESC LIMIT 11', ()),
+        ('user list keyset page',
+         'SELECT user_id, name, country, phone, registered_at FROM users WHERE (registered_at, user_id) < (?, ?) '
+         'ORDER BY registered_at DESC, user_id DESC LIMIT 11', (middle, 1 << 62)),
+        ('country audience ids',
+         'SELECT user_id FROM users WHERE country = ?', ('IN',)),
+        ('users per country',
+         'SELECT country, COUNT(*) FROM users GROUP BY country', ()),
+        ('active since date (count)',
+         'SELECT COUNT(*) FROM users WHERE last_active >= ?', (recent,)),
+    ]
+
+
+def time_query(conn, sql, params, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Building {args.users} users...")
+        conn = build_database(os.path.join(tmp, 'bench.db'), args.users)
+
+        before = [time_query(conn, sql, params, args.repeat) for _, sql, params in queries()]
+
+        started = time.perf_counter()
+        main.apply_migrations(conn)
+        conn.execute('ANALYZE')
+        print(f"Migrations applied in {time.perf_counter() - started:.1f}s\n")
+
+        after = [time_query(conn, sql, params, args.repeat) for _, sql, params in queries()]
+        conn.close()
+
+    print(f"{'query':<30}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for (name, _, _), b, a in zip(queries(), before, after):
+        print(f"{name:<30}{b:>12.2f}{a:>12.2f}{b / a if a else float('inf'):>9.1f}x")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,61 @@
+"""Per-reply cost of building static keyboards and per-country texts vs. the precomputed ones.
+
+For each static keyboard, times the get_*_keyboard() builder (what every reply
+used to do) against reading the module-level constant. The render_*_text()
+f-strings are compared against the per-country lookups the same way. The last
+column is the to_dict() that PTB still runs when it serializes a reply_markup,
+which is the part of the work precomputing cannot remove.
+
+Usage:
+    python benchmarks/static_replies.py --number 20000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main  # noqa: E402
+
+KEYBOARDS = [
+    ('phone', main.get_phone_keyboard, 'PHONE_KEYBOARD'),
+    ('language', main.get_language_keyboard, 'LANGUAGE_KEYBOARD'),
+    ('country', main.get_country_keyboard, 'COUNTRY_KEYBOARD'),
+    ('main menu', main.get_main_menu_keyboard, 'MAIN_MENU_KEYBOARD'),
+    ('admin', main.get_admin_keyboard, 'ADMIN_KEYBOARD'),
+    ('country selection', main.get_country_selection_keyboard, 'COUNTRY_SELECTION_KEYBOARD'),
+]
+
+TEXTS = [
+    ('manager contact', main.render_manager_contact_text, main.manager_contact_text),
+    ('program details', main.render_program_details_text, main.program_details_text),
+]
+
+
+def per_call_ns(func, number: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e9
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=20000, help='calls per timing')
+    args = parser.parse_args()
+
+    print(f"{'keyboard':<20}{'build ns':>12}{'cached ns':>12}{'speedup':>10}{'to_dict ns':>12}")
+    for name, build, constant in KEYBOARDS:
+        markup = getattr(main, constant)
+        built = per_call_ns(build, args.number)
+        cached = per_call_ns(lambda: getattr(main, constant), args.number)
+        serialized = per_call_ns(markup.to_dict, args.number)
+        print(f"{name:<20}{built:>12.0f}{cached:>12.0f}{built / cached:>9.0f}x{serialized:>12.0f}")
+
+    print(f"\n{'text':<20}{'render ns':>12}{'cached ns':>12}{'speedup':>10}")
+    for name, render, lookup in TEXTS:
+        rendered = per_call_ns(lambda: render('BD'), args.number)
+        cached = per_call_ns(lambda: lookup('BD'), args.number)
+        print(f"{name:<20}{rendered:>12.0f}{cached:>12.0f}{rendered / cached:>9.0f}x")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,221 @@
+"""Replay a stream of updates through the real handler graph with the network stubbed out.
+
+The Application comes from main.build_application() with an in-process request
+object, so every Bot API call returns immediately with a plausible result and
+only the bot's own work is measured: handler dispatch, (de)serialization,
+keyboards and the DB. Updates are replayed one at a time. Each one is attributed
+to the handler that takes it, and the script reports per handler:
+- event-loop CPU time (time.thread_time)
+- DB execution time, taken from the bot's own DB_QUERY_SECONDS metric
+- with --allocations, the peak traced memory per update (tracemalloc slows
+  everything down, so CPU numbers from that run are not comparable)
+
+The bottom line is updates/s per core: recorded updates divided by
+loop CPU + DB time.
+
+The default trace is synthetic: interleaved signups (/start, contact, lang_,
+country_), main-menu texts from registered users and admin user-list page flips.
+--save writes it as JSONL (one Update per line). --trace replays such a file
+instead, for example webhook request bodies captured from production.
+
+Usage:
+    python benchmarks/update_replay.py --users 10000 --updates 20000
+    python benchmarks/update_replay.py --trace updates.jsonl --allocations
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import ConversationHandler  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+import fake_bot_api  # noqa: E402
+from broadcast_load import build_database, callback_update, command_update, message_update, percentile, signup_updates  # noqa: E402
+
+MENU_TEXTS = ['📞 Contact Local Manager', 'ℹ️ About Program', '🔄 Restart']
+
+
+class StubRequest(BaseRequest):
+    """Answers Bot API calls in-process with fake_bot_api's results (no socket, no latency)"""
+
+    def __init__(self):
+        self.api = fake_bot_api.FakeBotApi()
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs):
+        params = request_data.json_parameters if request_data else {}
+        result = self.api.result(url.rsplit('/', 1)[-1], params)
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+def synthetic_trace(users: int, updates: int, page_cursors: list) -> list:
+    """Interleave signups, main-menu texts and admin page flips into one update stream"""
+    admin_id = main.ADMIN_IDS[0]
+    signups = []
+    next_uid = users + 1
+    trace = []
+    while len(trace) < updates:
+        roll = random.random()
+        if roll < 0.3:
+            if len(signups) < 20:
+                signups.append(iter(signup_updates(next_uid)[:4]))
+                next_uid += 1
+            sequence = random.choice(signups)
+            step = next(sequence, None)
+            if step is None:
+                signups.remove(sequence)
+                continue
+            trace.append(step[1])
+        elif roll < 0.9:
+            trace.append(message_update(random.randint(1, users), text=random.choice(MENU_TEXTS)))
+        elif roll < 0.92:
+            trace.append(command_update(admin_id, '/admin'))
+        else:
+            registered_at, user_id = random.choice(page_cursors)
+            page = random.randint(2, 50)
+            trace.append(callback_update(admin_id, f'user_page_{page}_{random.choice("np")}_{registered_at}_{user_id}'))
+    return trace
+
+
+def handler_name(application, update: Update) -> str:
+    """Name of the callback that will take `update` (resolved before the state changes)"""
+    for group in sorted(application.handlers):
+        for handler in application.handlers[group]:
+            check = handler.check_update(update)
+            if check is None or check is False:
+                continue
+            if isinstance(handler, ConversationHandler):
+                handler = check[2]
+            return handler.callback.__name__
+    return 'unhandled'
+
+
+def db_seconds() -> float:
+    return sum(series[-2] for series in main.DB_QUERY_SECONDS.series.values())
+
+
+async def replay(trace: list, warmup: int, allocations: bool):
+    main.METRICS_PORT = 0
+    application = main.build_application(StubRequest())
+    stats = defaultdict(lambda: defaultdict(list))
+
+    # Handlers print per update; keep that work but not the output
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        await application.initialize()
+        await application.post_init(application)
+
+        if allocations:
+            tracemalloc.start()
+        for position, payload in enumerate(trace):
+            update = Update.de_json(payload, application.bot)
+            name = handler_name(application, update)
+            if allocations:
+                tracemalloc.reset_peak()
+                allocated_before = tracemalloc.get_traced_memory()[0]
+            db_before = db_seconds()
+            cpu_before = time.thread_time()
+            started = time.perf_counter()
+
+            await application.process_update(update)
+
+            wall = time.perf_counter() - started
+            cpu = time.thread_time() - cpu_before
+            if position < warmup:
+                continue
+            handler_stats = stats[name]
+            handler_stats['wall'].append(wall)
+            handler_stats['cpu'].append(cpu)
+            handler_stats['db'].append(db_seconds() - db_before)
+            if allocations:
+                handler_stats['alloc'].append(tracemalloc.get_traced_memory()[1] - allocated_before)
+        if allocations:
+            tracemalloc.stop()
+
+        await application.post_stop(application)
+        await application.shutdown()
+        await application.post_shutdown(application)
+    return stats
+
+
+def report(stats, allocations: bool):
+    header = f"{'handler':<28}{'updates':>8}{'wall p50 µs':>13}{'wall p99 µs':>13}{'cpu µs':>9}{'db µs':>9}"
+    if allocations:
+        header += f"{'peak KiB':>10}"
+    print(header)
+
+    total_updates = total_cpu = total_db = total_wall = 0.0
+    for name, handler_stats in sorted(stats.items(), key=lambda item: -sum(item[1]['cpu'])):
+        count = len(handler_stats['wall'])
+        line = (
+            f"{name:<28}{count:>8}"
+            f"{statistics.median(handler_stats['wall']) * 1e6:>13.0f}"
+            f"{percentile(handler_stats['wall'], 99) * 1e6:>13.0f}"
+            f"{statistics.mean(handler_stats['cpu']) * 1e6:>9.0f}"
+            f"{statistics.mean(handler_stats['db']) * 1e6:>9.0f}"
+        )
+        if allocations:
+            line += f"{statistics.mean(handler_stats['alloc']) / 1024:>10.1f}"
+        print(line)
+        total_updates += count
+        total_cpu += sum(handler_stats['cpu'])
+        total_db += sum(handler_stats['db'])
+        total_wall += sum(handler_stats['wall'])
+
+    print(f"\n{total_updates:.0f} updates: {total_updates / total_wall:.0f} updates/s sequential wall, "
+          f"{total_updates / (total_cpu + total_db):.0f} updates/s per core (loop CPU + DB)")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10000, help='registered users in the synthetic database')
+    parser.add_argument('--updates', type=int, default=20000, help='length of the synthetic trace')
+    parser.add_argument('--trace', help='replay this JSONL file of updates instead of a synthetic trace')
+    parser.add_argument('--save', help='write the trace that is replayed to this JSONL file')
+    parser.add_argument('--warmup', type=int, default=500, help='leading updates left out of the statistics')
+    parser.add_argument('--allocations', action='store_true', help='trace allocations (slows the run down)')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    random.seed(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        build_database(os.path.join(tmp, 'bench.db'), args.users)
+        if args.trace:
+            with open(args.trace) as trace_file:
+                trace = [json.loads(line) for line in trace_file if line.strip()]
+        else:
+            page_cursors = main.db.fetchall('SELECT registered_at, user_id FROM users ORDER BY RANDOM() LIMIT 200')
+            trace = synthetic_trace(args.users, args.updates, page_cursors)
+        if args.save:
+            with open(args.save, 'w') as trace_file:
+                trace_file.writelines(json.dumps(payload) + '\n' for payload in trace)
+
+        stats = asyncio.run(replay(trace, args.warmup, args.allocations))
+    report(stats, args.allocations)
+
+
+if __name__ == '__main__':
+    main_cli()
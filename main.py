@@ -1,23 +1,43 @@
 import os
 import sys
+import asyncio
+import heapq
+import hmac
+import json
 import logging
+import math
 import sqlite3
 import re
+import signal
+import time
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
+from zoneinfo import ZoneInfo
+from typing import Dict, Any, List, Optional, Iterable, AsyncIterable, Callable, Awaitable, Union
 
 from telegram import (
     Update,
+    Chat,
+    ChatMember,
     ReplyKeyboardMarkup,
     KeyboardButton,
     InlineKeyboardMarkup,
-    InlineKeyboardButton
+    InlineKeyboardButton,
+    MessageEntity
 )
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+from telegram.request import BaseRequest, HTTPXRequest
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    ChatMemberHandler,
     ConversationHandler,
     filters,
     ContextTypes
@@ -25,9 +45,78 @@ from telegram.ext import (
 
 # ========== CONFIGURATION ==========
 TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '7858094896:AAHabzaULaYJvh5tlsdgFAiVLmmSy15X7jg')
+# Bot API endpoint; point it at a local Bot API server (or benchmarks/fake_bot_api.py for load tests)
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
 ADMIN_IDS = [8477793739]  # Your admin ID
 DB_PATH = 'bot.db'
 
+# Broadcast tuning (can be changed at runtime with /broadcast_settings)
+BROADCAST_SETTINGS = {
+    'concurrency': int(os.environ.get('BROADCAST_CONCURRENCY', '20')),  # parallel send workers
+    'rate': float(os.environ.get('BROADCAST_RATE', '25')),              # global msgs/sec (Telegram allows ~30)
+    'per_chat_interval': 1.0,                                           # min seconds between msgs to one chat
+    'max_retries': 3,                                                   # RetryAfter retries per recipient
+    'progress_interval': float(os.environ.get('BROADCAST_PROGRESS_INTERVAL', '3'))  # min seconds between progress edits
+}
+
+# last_active write-behind: timestamps are buffered in memory and written in batches.
+# A crash loses the buffered users' latest activity: normally up to ACTIVITY_FLUSH_INTERVAL
+# seconds or about ACTIVITY_FLUSH_SIZE users, but failed flushes stay buffered for a retry,
+# so it can grow to ACTIVITY_BUFFER_MAX users. Past that, new users' activity is dropped
+# (bot_activity_dropped_total). Only last_active is affected, never registrations.
+ACTIVITY_FLUSH_INTERVAL = float(os.environ.get('ACTIVITY_FLUSH_INTERVAL', '10'))  # seconds
+ACTIVITY_FLUSH_SIZE = int(os.environ.get('ACTIVITY_FLUSH_SIZE', '500'))            # users per forced flush
+ACTIVITY_BUFFER_MAX = int(os.environ.get('ACTIVITY_BUFFER_MAX', str(ACTIVITY_FLUSH_SIZE * 20)))  # users held at most
+
+# User profile cache (LRU with TTL) in front of get_user
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))    # profiles kept in memory
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '300'))      # seconds before a profile is re-read
+
+USERS_PER_PAGE = 10  # admin user list page size
+
+# Registration progress (phone -> language -> country) lives in memory and expires after
+# STATE_TTL seconds. STATE_BACKEND=sqlite also snapshots it to user_states every
+# STATE_SNAPSHOT_INTERVAL seconds so it survives a restart.
+STATE_BACKEND = os.environ.get('STATE_BACKEND', 'memory').lower()
+STATE_TTL = float(os.environ.get('STATE_TTL', '86400'))
+STATE_SNAPSHOT_INTERVAL = float(os.environ.get('STATE_SNAPSHOT_INTERVAL', '5'))
+
+# Update delivery: 'polling' (default) or 'webhook' (embedded HTTP server)
+BOT_MODE = os.environ.get('BOT_MODE', 'polling').lower()
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('PORT', '8443'))                   # Heroku provides PORT
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')                      # public base URL; setWebhook is skipped if empty
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')                # checked against X-Telegram-Bot-Api-Secret-Token
+# Updates from different users are processed in parallel up to this limit; one user's
+# updates always run one at a time, in arrival order (see PerUserUpdateProcessor)
+MAX_CONCURRENT_UPDATES = int(os.environ.get('MAX_CONCURRENT_UPDATES', '32'))
+# Updates admitted at once, running or queued behind the same user's earlier updates;
+# the rest wait (in arrival order) before a per-user lock is even created
+MAX_PENDING_UPDATES = int(os.environ.get('MAX_PENDING_UPDATES', str(MAX_CONCURRENT_UPDATES * 8)))
+
+# Timezone in which admins enter and read scheduled broadcast times (stored as UTC)
+SCHEDULER_TIMEZONE = ZoneInfo(os.environ.get('SCHEDULER_TIMEZONE', 'UTC'))
+
+# Local-daytime delivery: each country's recipients are spread over DELIVERY_SPREAD_MINUTES
+# inside its next local DELIVERY_WINDOW (hours, start-end; see COUNTRY_TIMEZONES)
+def parse_delivery_window(value: str) -> tuple:
+    """'9-21' -> (9, 21); raises ValueError unless 0 <= start < end <= 24, so a bad value stops startup"""
+    try:
+        start, end = (int(hour) for hour in value.split('-'))
+    except ValueError:
+        raise ValueError(f"DELIVERY_WINDOW must look like '9-21', got {value!r}") from None
+    if not 0 <= start < end <= 24:
+        raise ValueError(f"DELIVERY_WINDOW needs 0 <= start < end <= 24 (hours), got {value!r}")
+    return start, end
+
+DELIVERY_WINDOW = parse_delivery_window(os.environ.get('DELIVERY_WINDOW', '9-21'))
+DELIVERY_SPREAD_MINUTES = int(os.environ.get('DELIVERY_SPREAD_MINUTES', '120'))
+
+# Prometheus-style /metrics endpoint, off unless METRICS_PORT is set (e.g. 9090); keep it on a private interface
+METRICS_LISTEN = os.environ.get('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('METRICS_PORT') or '0')
+
 # Enable logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -51,11 +140,342 @@ COUNTRY_MANAGERS = {
     'KE': '@KE_Manager_Username'     # Replace with actual Kenya manager username
 }
 
-# ========== DATABASE SETUP ==========
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+# ========== METRICS ==========
+# Counters, gauges and histograms in the Prometheus text format. Everything is updated
+# from the event loop (DB timings are taken around run_db, not inside the DB threads),
+# so no locking is needed.
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.values: Dict[tuple, float] = {}
+        METRICS.append(self)
+    
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{format_labels(key)} {value:g}" for key, value in self.values.items()]
+        return lines
+
+class Gauge:
+    """A value read from `source` at scrape time (kind='counter' for totals kept elsewhere)"""
+    
+    def __init__(self, name: str, help_text: str, source: Callable[[], float], kind: str = 'gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.source = source
+        self.kind = kind
+        METRICS.append(self)
+    
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}", f"{self.name} {self.source():g}"]
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    
+    def __init__(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series: Dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+        METRICS.append(self)
+    
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in self.series.items():
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', f'{bound:g}'),))} {count}")
+            lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {series[-2]:g}")
+            lines.append(f"{self.name}_count{format_labels(key)} {series[-1]}")
+        return lines
+
+METRICS: List[Any] = []
+
+HANDLER_SECONDS = Histogram('bot_handler_seconds', 'Update handler latency')
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Update handlers that raised')
+DB_WAIT_SECONDS = Histogram('bot_db_wait_seconds', 'Time a DB call waited for a free DB thread')
+DB_QUERY_SECONDS = Histogram('bot_db_query_seconds', 'DB helper execution time')
+API_SECONDS = Histogram('bot_telegram_api_seconds', 'Telegram Bot API request latency', (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+API_REQUESTS = Counter('bot_telegram_api_requests_total', 'Telegram Bot API requests by method and outcome')
+BROADCAST_MESSAGES = Counter('bot_broadcast_messages_total', 'Broadcast deliveries by outcome')
+BROADCAST_FLOOD_WAITS = Counter('bot_broadcast_flood_waits_total', 'RetryAfter responses during broadcasts')
+
+# Sampled at scrape time; the objects are defined further down
+Gauge('bot_broadcast_active_jobs', 'Broadcast jobs running or paused in this process', lambda: len(BROADCAST_MANAGER.active))
+Gauge('bot_scheduled_broadcasts_pending', 'Scheduler heap entries', lambda: len(BROADCAST_SCHEDULER.heap))
+Gauge('bot_activity_buffer_pending', 'last_active updates waiting to be flushed', lambda: len(ACTIVITY_BUFFER.pending))
+Gauge('bot_activity_dropped_total', 'last_active updates dropped by a full activity buffer', lambda: ACTIVITY_BUFFER.dropped, kind='counter')
+Gauge('bot_admin_notifications_pending', 'Admin notifications waiting to be sent', lambda: ADMIN_NOTIFIER.queue.qsize())
+Gauge('bot_conversation_states', 'Registrations in progress', lambda: len(STATE_STORE.entries))
+Gauge('bot_user_cache_entries', 'Cached user profiles', lambda: len(USER_CACHE.entries))
+Gauge('bot_user_cache_hits_total', 'User cache hits', lambda: USER_CACHE.hits, kind='counter')
+Gauge('bot_user_cache_misses_total', 'User cache misses', lambda: USER_CACHE.misses, kind='counter')
+
+API_OUTCOMES = {200: 'ok', 400: 'bad_request', 403: 'forbidden', 404: 'not_found', 429: 'flood_wait'}
+
+def render_metrics() -> bytes:
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    return ('\n'.join(lines) + '\n').encode()
+
+def instrumented(handler: Callable) -> Callable:
+    """Record the latency (and failures) of an update handler under its function name"""
+    name = handler.__name__
+    
+    @wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        started = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+    return wrapper
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records Bot API latency and outcome per method"""
+    
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            API_REQUESTS.inc(method=api_method, outcome=type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method=api_method)
+        API_REQUESTS.inc(method=api_method, outcome=API_OUTCOMES.get(code, f'http_{code}'))
+        return code, payload
+
+async def metrics_request_handler(request: 'HTTPRequest'):
+    if request.path == '/metrics' and request.method == 'GET':
+        return 200, 'text/plain; version=0.0.4', render_metrics()
+    return 404, 'text/plain', b'Not Found'
+
+# ========== DATABASE CONNECTION ==========
+class Database:
+    """Shared SQLite access layer.
+    
+    Each thread gets one long-lived connection in WAL mode, so readers never block the
+    writer and a commit costs a WAL append instead of a full journal fsync. Statements are
+    reused from the connection's prepared statement cache as long as the SQL text is constant.
+    """
+    
+    PRAGMAS = (
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',   # durable at checkpoints; safe against corruption in WAL mode
+        'PRAGMA cache_size=-16000',    # 16 MB page cache
+        'PRAGMA temp_store=MEMORY',
+        'PRAGMA busy_timeout=5000'
+    )
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        self.connections: List[sqlite3.Connection] = []
+        self.lock = threading.Lock()
+    
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # Only the owning thread uses a connection; close() may run from another thread at shutdown
+            conn = sqlite3.connect(self.path, cached_statements=256, check_same_thread=False)
+            for pragma in self.PRAGMAS:
+                conn.execute(pragma)
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+    
+    def execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        return self.connection().execute(sql, params)
+    
+    def fetchone(self, sql: str, params: tuple = ()):
+        return self.execute(sql, params).fetchone()
+    
+    def fetchall(self, sql: str, params: tuple = ()):
+        return self.execute(sql, params).fetchall()
+    
+    def fetch_dict(self, sql: str, params: tuple = ()):
+        cursor = self.execute(sql, params)
+        columns = [description[0] for description in cursor.description]
+        result = cursor.fetchone()
+        return dict(zip(columns, result)) if result else None
+    
+    def fetch_dicts(self, sql: str, params: tuple = ()):
+        cursor = self.execute(sql, params)
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    
+    @contextmanager
+    def transaction(self):
+        """Run several statements as one atomic commit"""
+        conn = self.connection()
+        try:
+            yield conn.cursor()
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections.clear()
+        self.local = threading.local()
+
+db = Database(DB_PATH)
+
+# ========== ASYNC DATABASE ACCESS ==========
+# Handlers never call SQLite directly. Writes go to one dedicated writer thread, so they
+# are serialized without waiting on SQLite's busy lock; read-only helpers run on a small
+# reader pool, which WAL lets proceed alongside the writer.
+DB_WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+DB_READERS = ThreadPoolExecutor(max_workers=int(os.environ.get('DB_READER_THREADS', '4')), thread_name_prefix='db-reader')
+
+def read_only(func: Callable) -> Callable:
+    """Mark a database helper as safe to run on the reader pool"""
+    func.db_read_only = True
+    return func
+
+async def run_db(func: Callable, *args, **kwargs):
+    """Run a blocking database helper off the event loop and await its result"""
+    is_read_only = getattr(func, 'db_read_only', False)
+    executor = DB_READERS if is_read_only else DB_WRITER
+    loop = asyncio.get_running_loop()
+    
+    timings = []
+    def call():
+        timings.append(time.perf_counter())
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings.append(time.perf_counter())
+    
+    submitted = time.perf_counter()
+    try:
+        return await loop.run_in_executor(executor, call)
+    finally:
+        if len(timings) == 2:
+            pool = 'reader' if is_read_only else 'writer'
+            DB_WAIT_SECONDS.observe(timings[0] - submitted, pool=pool)
+            DB_QUERY_SECONDS.observe(timings[1] - timings[0], query=func.__name__, pool=pool)
+
+# ========== USER CACHE ==========
+class UserCache:
+    """Bounded LRU cache of user profiles with a per-entry TTL.
+    
+    Only registered users are cached. save_user writes through, so a cached profile is
+    never older than the last registration; last_active may lag until the entry expires.
+    Shared between the event loop and the DB reader threads, hence the lock.
+    
+    Reads fill the cache through begin_read()/fill(): a row read before a write-through
+    or invalidation of the same user is dropped instead of overwriting the newer state.
+    """
+    
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: 'OrderedDict[int, tuple]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.sequence = 0                   # bumped by every write-through and invalidation
+        self.written: Dict[int, int] = {}   # user_id -> sequence of its last write
+        self.floor = 0                      # reads begun before this may have lost their write record
+    
+    def get(self, user_id: int) -> Optional[dict]:
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return dict(entry[1])
+            if entry is not None:
+                del self.entries[user_id]
+            self.misses += 1
+            return None
+    
+    def begin_read(self) -> int:
+        """Token to pass to fill() with the row read after this call"""
+        with self.lock:
+            return self.sequence
+    
+    def fill(self, user_id: int, user: dict, token: int) -> bool:
+        """Cache a database read unless the user was written since begin_read()"""
+        with self.lock:
+            if token < self.floor or self.written.get(user_id, 0) > token:
+                return False
+            self.store(user_id, user)
+            return True
+    
+    def put(self, user_id: int, user: dict):
+        """Write-through of a committed row"""
+        with self.lock:
+            self.record_write(user_id)
+            self.store(user_id, user)
     
+    def invalidate(self, user_id: int):
+        with self.lock:
+            self.record_write(user_id)
+            self.entries.pop(user_id, None)
+    
+    def store(self, user_id: int, user: dict):
+        self.entries[user_id] = (time.monotonic() + self.ttl, dict(user))
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+    
+    def record_write(self, user_id: int):
+        self.sequence += 1
+        self.written[user_id] = self.sequence
+        if len(self.written) > self.max_size:
+            # Forget the write records; reads already in flight are no longer cached
+            self.written.clear()
+            self.floor = self.sequence
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self.entries),
+                'hit_rate': (self.hits / lookups * 100) if lookups else 0.0
+            }
+
+USER_CACHE = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+# ========== SCHEMA MIGRATIONS ==========
+# Each migration runs once, in order, inside its own transaction; the schema version is
+# stored in PRAGMA user_version. Migrations must also be safe on databases that already
+# have some of their objects (bot.db files created before versioning existed).
+def migration_initial_schema(cursor):
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
             user_id INTEGER PRIMARY KEY,
@@ -89,95 +509,1028 @@ def init_db():
             sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+
+def migration_broadcast_jobs(cursor):
+    add_column_if_missing(cursor, 'broadcasts', 'status', "TEXT DEFAULT 'completed'")
+    add_column_if_missing(cursor, 'broadcasts', 'from_chat_id', 'INTEGER')
+    add_column_if_missing(cursor, 'broadcasts', 'message_id', 'INTEGER')
+    add_column_if_missing(cursor, 'broadcasts', 'total_count', 'INTEGER DEFAULT 0')
+    add_column_if_missing(cursor, 'broadcasts', 'cursor_user_id', 'INTEGER DEFAULT 0')
+    add_column_if_missing(cursor, 'broadcasts', 'completed_at', 'TIMESTAMP')
     
-    conn.commit()
-    conn.close()
-
-def save_user_state(user_id: int, state: str, data: str = ''):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('INSERT OR REPLACE INTO user_states VALUES (?, ?, ?)', (user_id, state, data))
-    conn.commit()
-    conn.close()
-
-def get_user_state(user_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT state, data FROM user_states WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return {'state': result[0], 'data': result[1]} if result else None
-
-def clear_user_state(user_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM user_states WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
+    # One row per recipient of a broadcast job: pending -> sending -> sent/failed
+    # ('unknown' if the process died while the message was in flight)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id INTEGER,
+            user_id INTEGER,
+            status TEXT DEFAULT 'pending',
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID
+    ''')
 
-def save_user(user_id: int, name: str, phone: str, language: str, country: str):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def migration_user_stats(cursor):
+    # Per-country user counters kept up to date by save_user, so statistics never scan users
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            country TEXT PRIMARY KEY,
+            user_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+def migration_user_indexes(cursor):
+    # Keyset pagination of the admin user list (newest first)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_registered ON users (registered_at DESC, user_id DESC)')
+    # Country audiences and per-country listings: covers WHERE country = ? [ORDER BY registered_at]
+    # and the user_id lookups of broadcast enqueueing without touching the table
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_country_registered ON users (country, registered_at DESC, user_id)')
+    # Recency filters on last_active
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_last_active ON users (last_active)')
+    # Superseded by idx_users_country_registered (same leading column)
+    cursor.execute('DROP INDEX IF EXISTS idx_users_country')
+
+def migration_broadcast_media(cursor):
+    # Photo/video/document broadcasts: file_id, caption and caption entities of the admin's
+    # message as JSON, so recipients get a native send instead of copy_message
+    add_column_if_missing(cursor, 'broadcasts', 'media', 'TEXT')
+
+def migration_delivery_status(cursor):
+    # 'ok' until a send fails for good: 'blocked' (Forbidden) or 'not_found' (chat not found).
+    # Reset to 'ok' when the user comes back with /start or unblocks the bot.
+    add_column_if_missing(cursor, 'users', 'delivery_status', "TEXT NOT NULL DEFAULT 'ok'")
+    add_column_if_missing(cursor, 'users', 'undeliverable_since', 'TIMESTAMP')
+    # Broadcast audiences only read reachable users; partial and covering, so dead
+    # recipients are skipped without being read at all
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_deliverable ON users (country, user_id) WHERE delivery_status = 'ok'")
+    # The (small) dead-recipient set, for statistics
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_undeliverable ON users (delivery_status) WHERE delivery_status != 'ok'")
+
+def migration_segment_indexes(cursor):
+    # Language filters of audience segments (country, registration and recency filters
+    # already have indexes)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_language ON users (language, user_id) WHERE delivery_status = 'ok'")
+
+def migration_scheduled_broadcasts(cursor):
+    # One-off (schedule IS NULL) or recurring (cron expression) broadcasts. Each run
+    # creates a normal broadcast job; next_run_at is UTC.
     cursor.execute('''
-        INSERT OR REPLACE INTO users (user_id, name, phone, language, country, last_active)
-        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-    ''', (user_id, name, phone, language, country))
-    conn.commit()
-    conn.close()
+        CREATE TABLE IF NOT EXISTS scheduled_broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER,
+            target_type TEXT,
+            target_id TEXT,
+            message_type TEXT,
+            content TEXT,
+            from_chat_id INTEGER,
+            message_id INTEGER,
+            media TEXT,
+            schedule TEXT,
+            next_run_at TIMESTAMP,
+            status TEXT DEFAULT 'active',
+            run_count INTEGER DEFAULT 0,
+            last_job_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_scheduled_due ON scheduled_broadcasts (status, next_run_at)')
+
+def migration_staggered_delivery(cursor):
+    # Local-daytime broadcasts: recipients are not claimed before their not_before (UTC).
+    # Regular jobs leave it NULL and keep using the user_id cursor; staggered jobs set it
+    # on every recipient so claims always go through the partial index.
+    add_column_if_missing(cursor, 'broadcast_recipients', 'not_before', 'TIMESTAMP')
+    add_column_if_missing(cursor, 'broadcasts', 'staggered', 'INTEGER DEFAULT 0')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_recipients_due ON broadcast_recipients (broadcast_id, status, not_before)
+        WHERE not_before IS NOT NULL
+    ''')
+
+def migration_state_expiry(cursor):
+    # user_states is now only a snapshot of the in-memory state store. Rows written before
+    # have no expiry and belong to conversations that ended with the process that started
+    # them, so they are dropped rather than carried over.
+    add_column_if_missing(cursor, 'user_states', 'expires_at', 'REAL')
+    cursor.execute('DELETE FROM user_states')
+
+MIGRATIONS = [
+    (1, 'initial schema', migration_initial_schema),
+    (2, 'broadcast jobs and recipients', migration_broadcast_jobs),
+    (3, 'user_stats counters', migration_user_stats),
+    (4, 'users indexes', migration_user_indexes),
+    (5, 'broadcast media file_ids', migration_broadcast_media),
+    (6, 'user delivery status', migration_delivery_status),
+    (7, 'segment indexes', migration_segment_indexes),
+    (8, 'scheduled broadcasts', migration_scheduled_broadcasts),
+    (9, 'staggered delivery', migration_staggered_delivery),
+    (10, 'conversation state expiry', migration_state_expiry),
+]
+
+def apply_migrations(conn: sqlite3.Connection, target: Optional[int] = None):
+    """Bring the database up to `target` (default: latest) schema version"""
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    for version, description, migrate in MIGRATIONS:
+        if version <= current or (target is not None and version > target):
+            continue
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN')
+            migrate(cursor)
+            cursor.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        print(f"🗄️ Applied migration {version}: {description}")
+
+def add_column_if_missing(cursor, table: str, column: str, definition: str):
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+# ========== DATABASE SETUP ==========
+def init_db():
+    apply_migrations(db.connection())
+    rebuild_user_stats()
+
+def rebuild_user_stats():
+    """Recount user_stats from users (one pass over idx_users_country_registered).
+    Run at startup so the counters heal from any write that bypassed save_user."""
+    with db.transaction() as cursor:
+        cursor.execute('DELETE FROM user_stats')
+        cursor.execute('''
+            INSERT INTO user_stats (country, user_count)
+            SELECT COALESCE(country, ''), COUNT(*) FROM users GROUP BY country
+        ''')
+
+def load_user_states(now: float):
+    """Drop expired snapshot rows and return the rest as (user_id, state, data, expires_at)"""
+    with db.transaction() as cursor:
+        cursor.execute('DELETE FROM user_states WHERE expires_at IS NULL OR expires_at <= ?', (now,))
+        cursor.execute('SELECT user_id, state, data, expires_at FROM user_states')
+        return cursor.fetchall()
+
+def write_user_states(upserts: List[tuple], deletes: List[int]):
+    with db.transaction() as cursor:
+        cursor.executemany(
+            'INSERT OR REPLACE INTO user_states (user_id, state, data, expires_at) VALUES (?, ?, ?, ?)',
+            upserts
+        )
+        cursor.executemany('DELETE FROM user_states WHERE user_id = ?', ((uid,) for uid in deletes))
+
+def save_user(user_id: int, name: str, phone: str, language: str, country: str):
+    """Finish a registration in one transaction: the user row, the per-country counter and
+    the snapshot of the conversation state (STATE_BACKEND=sqlite) change together"""
+    with db.transaction() as cursor:
+        cursor.execute('SELECT country FROM users WHERE user_id = ?', (user_id,))
+        previous = cursor.fetchone()
+        if previous is None:
+            bump_country_count(cursor, country, 1)
+        elif previous[0] != country:
+            bump_country_count(cursor, previous[0], -1)
+            bump_country_count(cursor, country, 1)
+        
+        cursor.execute('''
+            INSERT OR REPLACE INTO users (user_id, name, phone, language, country, last_active)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            RETURNING *
+        ''', (user_id, name, phone, language, country))
+        columns = [description[0] for description in cursor.description]
+        user = dict(zip(columns, cursor.fetchone()))
+        cursor.execute('DELETE FROM user_states WHERE user_id = ?', (user_id,))
+    
+    USER_CACHE.put(user_id, user)
     
     print(f"✅ User registered: {name} ({user_id}) from {country}")
 
+def bump_country_count(cursor, country: Optional[str], delta: int):
+    cursor.execute('''
+        INSERT INTO user_stats (country, user_count) VALUES (?, ?)
+        ON CONFLICT(country) DO UPDATE SET user_count = user_count + excluded.user_count
+    ''', (country or '', delta))
+
+@read_only
+def read_user(user_id: int):
+    """Read a profile from the database (bypassing the cache lookup) and cache it,
+    unless save_user or an invalidation got to the same user in the meantime"""
+    token = USER_CACHE.begin_read()
+    user = db.fetch_dict('SELECT * FROM users WHERE user_id = ?', (user_id,))
+    if user:
+        USER_CACHE.fill(user_id, user, token)
+    return user
+
+@read_only
 def get_user(user_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-    columns = [description[0] for description in cursor.description]
-    result = cursor.fetchone()
-    conn.close()
-    return dict(zip(columns, result)) if result else None
-
-def get_users_by_country(country_code: str):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE country = ? ORDER BY registered_at DESC', (country_code,))
-    columns = [description[0] for description in cursor.description]
-    results = cursor.fetchall()
-    conn.close()
-    return [dict(zip(columns, row)) for row in results]
-
-def get_all_users():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users ORDER BY registered_at DESC')
-    columns = [description[0] for description in cursor.description]
-    results = cursor.fetchall()
-    conn.close()
-    return [dict(zip(columns, row)) for row in results]
+    user = USER_CACHE.get(user_id)
+    return user if user is not None else read_user(user_id)
 
+async def load_user(user_id: int):
+    """Async get_user: cache hits are answered on the event loop without a thread hop"""
+    user = USER_CACHE.get(user_id)
+    return user if user is not None else await run_db(read_user, user_id)
+
+@read_only
+def get_users_page(limit: int, cursor: Optional[tuple] = None, direction: str = 'n'):
+    """Keyset pagination over users, newest first.
+    
+    `cursor` is the (registered_at, user_id) of the last user on the previous page
+    (direction 'n') or of the first user on the following page (direction 'p').
+    Returns (users, has_more) where has_more refers to the direction of travel.
+    Costs O(limit) via idx_users_registered regardless of table size.
+    """
+    columns = 'user_id, name, country, phone, registered_at'
+    if cursor is None:
+        rows = db.fetch_dicts(
+            f'SELECT {columns} FROM users ORDER BY registered_at DESC, user_id DESC LIMIT ?',
+            (limit + 1,)
+        )
+    elif direction == 'p':
+        rows = db.fetch_dicts(
+            f'''SELECT {columns} FROM users WHERE (registered_at, user_id) > (?, ?)
+                ORDER BY registered_at ASC, user_id ASC LIMIT ?''',
+            (cursor[0], cursor[1], limit + 1)
+        )
+    else:
+        rows = db.fetch_dicts(
+            f'''SELECT {columns} FROM users WHERE (registered_at, user_id) < (?, ?)
+                ORDER BY registered_at DESC, user_id DESC LIMIT ?''',
+            (cursor[0], cursor[1], limit + 1)
+        )
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == 'p' and cursor is not None:
+        rows.reverse()
+    return rows, has_more
+
+@read_only
 def get_total_users():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) FROM users')
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
-
-def update_user_activity(user_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET last_active = CURRENT_TIMESTAMP WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
+    return db.fetchone('SELECT COALESCE(SUM(user_count), 0) FROM user_stats')[0]
+
+@read_only
+def get_country_stats():
+    """[(country, user_count)] from the counters table, largest first"""
+    return db.fetchall('SELECT country, user_count FROM user_stats WHERE user_count > 0 ORDER BY user_count DESC')
+
+def flush_user_activity(activity: List[tuple]):
+    """Write buffered (last_active, user_id) pairs in one transaction"""
+    with db.transaction() as cursor:
+        cursor.executemany('UPDATE users SET last_active = ? WHERE user_id = ?', activity)
+
+UNDELIVERABLE_STATUSES = ('blocked', 'not_found')
+
+def classify_delivery_error(error: Exception) -> Optional[str]:
+    """'blocked' / 'not_found' for errors that will repeat on every send, None for transient ones"""
+    if isinstance(error, Forbidden):
+        return 'blocked'
+    if isinstance(error, BadRequest) and 'chat not found' in str(error).lower():
+        return 'not_found'
+    return None
+
+def is_transport_error(error: Optional[Exception]) -> bool:
+    """Connection-level failure (BadRequest subclasses NetworkError but is a real API answer)"""
+    return isinstance(error, NetworkError) and not isinstance(error, BadRequest)
+
+def mark_users_undeliverable(cursor, statuses: List[tuple]):
+    """Store (delivery_status, user_id) pairs inside the caller's transaction.
+    The caller invalidates USER_CACHE once the transaction has committed."""
+    cursor.executemany(
+        "UPDATE users SET delivery_status = ?, undeliverable_since = CURRENT_TIMESTAMP WHERE user_id = ? AND delivery_status = 'ok'",
+        statuses
+    )
+
+def set_user_undeliverable(user_id: int, status: str):
+    with db.transaction() as cursor:
+        mark_users_undeliverable(cursor, [(status, user_id)])
+    USER_CACHE.invalidate(user_id)
+
+def reactivate_user(user_id: int):
+    """Make a previously unreachable user a broadcast recipient again. Returns True if they were unreachable."""
+    with db.transaction() as cursor:
+        cursor.execute(
+            "UPDATE users SET delivery_status = 'ok', undeliverable_since = NULL WHERE user_id = ? AND delivery_status != 'ok'",
+            (user_id,)
+        )
+        reactivated = cursor.rowcount > 0
+    if reactivated:
+        USER_CACHE.invalidate(user_id)
+        print(f"♻️ User {user_id} is reachable again")
+    return reactivated
+
+@read_only
+def get_undeliverable_counts():
+    """{delivery_status: user_count} for unreachable users"""
+    return dict(db.fetchall(
+        "SELECT delivery_status, COUNT(*) FROM users WHERE delivery_status != 'ok' GROUP BY delivery_status"
+    ))
 
 def save_broadcast(admin_id: int, target_type: str, target_id: str, message_type: str, content: str, sent_count: int, failed_count: int):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    with db.transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO broadcasts (admin_id, target_type, target_id, message_type, content, sent_count, failed_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (admin_id, target_type, target_id, message_type, content, sent_count, failed_count))
+
+# ========== AUDIENCE SEGMENTS ==========
+# A segment is a dict of optional filters, all of which must match:
+#   countries: [code, ...]        languages: [code, ...]
+#   registered_from / registered_to: 'YYYY-MM-DD' (inclusive)
+#   registered_days: registered within the last N days (instead of from/to)
+#   active_days: last_active within the last N days
+# It is compiled into a single WHERE clause; unreachable users are always excluded.
+# Relative filters are resolved at compile time, so every run of a recurring schedule
+# gets a fresh cutoff.
+def compile_segment(segment: dict) -> tuple:
+    """(where_sql, params) selecting the reachable users of a segment"""
+    clauses, params = ["delivery_status = 'ok'"], []
+    
+    for column, key in (('country', 'countries'), ('language', 'languages')):
+        values = segment.get(key)
+        if values:
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+    
+    if segment.get('registered_days'):
+        start = datetime.utcnow() - timedelta(days=segment['registered_days'])
+        clauses.append('registered_at >= ?')
+        params.append(f"{start:%Y-%m-%d} 00:00:00")
+    elif segment.get('registered_from'):
+        clauses.append('registered_at >= ?')
+        params.append(f"{segment['registered_from']} 00:00:00")
+    if segment.get('registered_to'):
+        end = datetime.strptime(segment['registered_to'], '%Y-%m-%d') + timedelta(days=1)
+        clauses.append('registered_at < ?')
+        params.append(end.strftime('%Y-%m-%d %H:%M:%S'))
+    if segment.get('active_days'):
+        # Timestamps are stored in UTC (CURRENT_TIMESTAMP)
+        cutoff = datetime.utcnow() - timedelta(days=segment['active_days'])
+        clauses.append('last_active >= ?')
+        params.append(cutoff.strftime('%Y-%m-%d %H:%M:%S'))
+    
+    return ' AND '.join(clauses), params
+
+@read_only
+def count_segment(segment: dict) -> int:
+    """Audience size of a segment, counted in SQLite"""
+    where, params = compile_segment(segment)
+    return db.fetchone(f'SELECT COUNT(*) FROM users WHERE {where}', params)[0]
+
+def describe_segment(segment: dict) -> str:
+    parts = []
+    if segment.get('countries'):
+        parts.append('🌍 ' + ', '.join(COUNTRIES.get(code, code) for code in segment['countries']))
+    if segment.get('languages'):
+        parts.append('🗣 ' + ', '.join(LANGUAGES.get(code, code) for code in segment['languages']))
+    if segment.get('registered_days'):
+        parts.append(f"📅 registered in last {segment['registered_days']}d")
+    elif segment.get('registered_from') or segment.get('registered_to'):
+        parts.append(f"📅 {segment.get('registered_from') or '…'} → {segment.get('registered_to') or '…'}")
+    if segment.get('active_days'):
+        parts.append(f"⏱ active in last {segment['active_days']}d")
+    return ' · '.join(parts) if parts else 'All users'
+
+# ========== BROADCAST JOBS ==========
+def create_broadcast_job(admin_id: int, target_type: str, target_id: str, message_type: str, content: str, from_chat_id: int, message_id: int, media: Optional[dict] = None, staggered: bool = False):
+    """Create a broadcast job and enqueue its recipients. Returns (job_id, total_recipients)."""
+    with db.transaction() as cursor:
+        return enqueue_broadcast_job(
+            cursor, admin_id, target_type, target_id, message_type, content, from_chat_id, message_id,
+            json.dumps(media) if media else None, staggered
+        )
+
+def audience_filter(target_type: str, target_id: str) -> tuple:
+    """(where_sql, params) selecting the reachable users of a broadcast target"""
+    if target_type == 'country':
+        return "delivery_status = 'ok' AND country = ?", [target_id]
+    if target_type == 'segment':
+        return compile_segment(json.loads(target_id))
+    return "delivery_status = 'ok'", []
+
+@read_only
+def count_audience(target_type: str, target_id: str = 'all') -> int:
+    """Recipients a broadcast to this target would get now (user_stats also counts unreachable users)"""
+    where, params = audience_filter(target_type, target_id)
+    return db.fetchone(f'SELECT COUNT(*) FROM users WHERE {where}', params)[0]
+
+def enqueue_broadcast_job(cursor, admin_id: int, target_type: str, target_id: str, message_type: str, content: str,
+                          from_chat_id: int, message_id: int, media_json: Optional[str] = None, staggered: bool = False):
+    """Insert a job and its recipients inside the caller's transaction"""
+    where, params = audience_filter(target_type, target_id)
+    
     cursor.execute('''
-        INSERT INTO broadcasts (admin_id, target_type, target_id, message_type, content, sent_count, failed_count)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (admin_id, target_type, target_id, message_type, content, sent_count, failed_count))
-    conn.commit()
-    conn.close()
+        INSERT INTO broadcasts (admin_id, target_type, target_id, message_type, content, sent_count, failed_count,
+                                status, from_chat_id, message_id, media, staggered)
+        VALUES (?, ?, ?, ?, ?, 0, 0, 'running', ?, ?, ?, ?)
+    ''', (admin_id, target_type, target_id, message_type, content, from_chat_id, message_id, media_json, int(staggered)))
+    job_id = cursor.lastrowid
+    
+    # Recipients are copied inside SQLite, never materialized in Python
+    if staggered:
+        total = enqueue_staggered_recipients(cursor, job_id, where, params)
+    else:
+        cursor.execute(
+            f'INSERT INTO broadcast_recipients (broadcast_id, user_id) SELECT ?, user_id FROM users WHERE {where}',
+            [job_id] + params
+        )
+        total = cursor.rowcount
+    cursor.execute('UPDATE broadcasts SET total_count = ? WHERE id = ?', (total, job_id))
+    return job_id, total
+
+def next_delivery_window(timezone: ZoneInfo, now: datetime) -> tuple:
+    """(start, end) as naive UTC of the open or next local DELIVERY_WINDOW in `timezone`"""
+    local_now = now.replace(tzinfo=ZoneInfo('UTC')).astimezone(timezone)
+    start_hour, end_hour = DELIVERY_WINDOW
+    for days in range(2):
+        day = local_now + timedelta(days=days)
+        start = datetime(day.year, day.month, day.day, start_hour, tzinfo=timezone)
+        end = start + timedelta(hours=end_hour - start_hour)
+        if end > local_now:
+            start = max(start, local_now)
+            return (
+                start.astimezone(ZoneInfo('UTC')).replace(tzinfo=None),
+                end.astimezone(ZoneInfo('UTC')).replace(tzinfo=None)
+            )
+    raise ValueError(f"empty delivery window {DELIVERY_WINDOW}")
+
+def enqueue_staggered_recipients(cursor, job_id: int, where: str, params: list, now: Optional[datetime] = None):
+    """Enqueue an audience with per-country send times: each country's recipients are spaced
+    evenly over DELIVERY_SPREAD_MINUTES from the start of its local delivery window
+    (or until the window closes, if sooner). Users without a known timezone are due at once."""
+    now = now or datetime.utcnow()
+    cursor.execute(f'SELECT country, COUNT(*) FROM users WHERE {where} GROUP BY country', params)
+    total = 0
+    for country, count in cursor.fetchall():
+        if country not in COUNTRY_TIMEZONES:
+            continue
+        start, end = next_delivery_window(COUNTRY_TIMEZONES[country], now)
+        spread = min(DELIVERY_SPREAD_MINUTES * 60, (end - start).total_seconds())
+        cursor.execute(f'''
+            INSERT INTO broadcast_recipients (broadcast_id, user_id, not_before)
+            SELECT ?, user_id, datetime(?, '+' || CAST((ROW_NUMBER() OVER (ORDER BY user_id) - 1) * ? AS INTEGER) || ' seconds')
+            FROM users WHERE {where} AND country = ?
+        ''', [job_id, start.strftime('%Y-%m-%d %H:%M:%S'), spread / count] + params + [country])
+        total += cursor.rowcount
+    
+    known = list(COUNTRY_TIMEZONES)
+    cursor.execute(f'''
+        INSERT INTO broadcast_recipients (broadcast_id, user_id, not_before)
+        SELECT ?, user_id, ? FROM users WHERE {where} AND (country IS NULL OR country NOT IN ({', '.join('?' * len(known))}))
+    ''', [job_id, now.strftime('%Y-%m-%d %H:%M:%S')] + params + known)
+    return total + cursor.rowcount
+
+@read_only
+def get_broadcast_job(job_id: int):
+    return db.fetch_dict('SELECT * FROM broadcasts WHERE id = ?', (job_id,))
+
+@read_only
+def get_unfinished_broadcast_jobs():
+    """[(job_id, status)] for jobs that were running or paused"""
+    return db.fetchall("SELECT id, status FROM broadcasts WHERE status IN ('running', 'paused') ORDER BY id")
+
+@read_only
+def get_recent_broadcast_jobs(limit: int = 10):
+    return db.fetch_dicts(
+        'SELECT * FROM broadcasts WHERE from_chat_id IS NOT NULL ORDER BY id DESC LIMIT ?', (limit,)
+    )
+
+def set_broadcast_job_status(job_id: int, status: str):
+    with db.transaction() as cursor:
+        cursor.execute('UPDATE broadcasts SET status = ? WHERE id = ?', (status, job_id))
+
+def recover_broadcast_job(job_id: int):
+    """After a restart, recipients that were in flight may or may not have received the
+    message. They are marked 'unknown' (and counted as failed) rather than sent twice."""
+    with db.transaction() as cursor:
+        cursor.execute(
+            "UPDATE broadcast_recipients SET status = 'unknown' WHERE broadcast_id = ? AND status = 'sending'",
+            (job_id,)
+        )
+        cursor.execute('UPDATE broadcasts SET failed_count = failed_count + ? WHERE id = ?', (cursor.rowcount, job_id))
+        # Rescan from the start once: recipients released on shutdown sit below the cursor
+        cursor.execute('UPDATE broadcasts SET cursor_user_id = 0 WHERE id = ?', (job_id,))
+
+def release_broadcast_recipients(job_id: int, user_ids: List[int]):
+    """Return claimed recipients that were never attempted to the pending pool"""
+    with db.transaction() as cursor:
+        cursor.executemany(
+            "UPDATE broadcast_recipients SET status = 'pending' WHERE broadcast_id = ? AND user_id = ? AND status = 'sending'",
+            [(job_id, uid) for uid in user_ids]
+        )
+
+def claim_broadcast_recipients(job_id: int, limit: int):
+    """Take the next `limit` pending recipients after the job cursor and mark them in flight.
+    
+    This is how broadcasts stream their audience: only user ids are read, one chunk at a
+    time, and the job runner pulls the next chunk only when its send queue has room.
+    """
+    with db.transaction() as cursor:
+        cursor.execute('SELECT cursor_user_id, staggered FROM broadcasts WHERE id = ?', (job_id,))
+        after, staggered = cursor.fetchone()
+        if staggered:
+            return claim_due_recipients(cursor, job_id, limit)
+        after = after or 0
+        cursor.execute('''
+            SELECT user_id FROM broadcast_recipients
+            WHERE broadcast_id = ? AND user_id > ? AND status = 'pending'
+            ORDER BY user_id LIMIT ?
+        ''', (job_id, after, limit))
+        user_ids = [row[0] for row in cursor.fetchall()]
+        
+        if user_ids:
+            # The claimed ids are exactly the pending rows in (after, last], so one range update marks them
+            cursor.execute('''
+                UPDATE broadcast_recipients SET status = 'sending'
+                WHERE broadcast_id = ? AND user_id > ? AND user_id <= ? AND status = 'pending'
+            ''', (job_id, after, user_ids[-1]))
+            cursor.execute('UPDATE broadcasts SET cursor_user_id = ? WHERE id = ?', (user_ids[-1], job_id))
+    return user_ids
+
+def claim_due_recipients(cursor, job_id: int, limit: int):
+    """Claim recipients of a staggered job whose send time has come, earliest first"""
+    cursor.execute('''
+        SELECT user_id FROM broadcast_recipients
+        WHERE broadcast_id = ? AND status = 'pending' AND not_before IS NOT NULL AND not_before <= ?
+        ORDER BY not_before, user_id LIMIT ?
+    ''', (job_id, datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'), limit))
+    user_ids = [row[0] for row in cursor.fetchall()]
+    if user_ids:
+        cursor.execute(
+            f"UPDATE broadcast_recipients SET status = 'sending' WHERE broadcast_id = ? AND user_id IN ({', '.join('?' * len(user_ids))})",
+            [job_id] + user_ids
+        )
+    return user_ids
+
+@read_only
+def get_next_due_recipient(job_id: int):
+    """Send time (UTC) of the next pending recipient of a staggered job, or None when none are left"""
+    return db.fetchone(
+        "SELECT MIN(not_before) FROM broadcast_recipients WHERE broadcast_id = ? AND status = 'pending' AND not_before IS NOT NULL",
+        (job_id,)
+    )[0]
+
+@read_only
+def get_last_due_recipient(job_id: int):
+    """Send time (UTC) of the last pending recipient of a staggered job, or None"""
+    return db.fetchone(
+        "SELECT MAX(not_before) FROM broadcast_recipients WHERE broadcast_id = ? AND status = 'pending'",
+        (job_id,)
+    )[0]
+
+def ack_broadcast_recipients(job_id: int, results: List[tuple]):
+    """Record delivery results as (user_id, 'sent' | 'failed' | 'blocked' | 'not_found') pairs"""
+    if not results:
+        return
+    sent = sum(1 for _, status in results if status == 'sent')
+    dead = [(status, uid) for uid, status in results if status in UNDELIVERABLE_STATUSES]
+    with db.transaction() as cursor:
+        cursor.executemany(
+            'UPDATE broadcast_recipients SET status = ? WHERE broadcast_id = ? AND user_id = ?',
+            [(status, job_id, uid) for uid, status in results]
+        )
+        if dead:
+            mark_users_undeliverable(cursor, dead)
+        cursor.execute(
+            'UPDATE broadcasts SET sent_count = sent_count + ?, failed_count = failed_count + ? WHERE id = ?',
+            (sent, len(results) - sent, job_id)
+        )
+    for _, uid in dead:
+        USER_CACHE.invalidate(uid)
+
+def finish_broadcast_job(job_id: int, status: str = 'completed'):
+    with db.transaction() as cursor:
+        cursor.execute('UPDATE broadcasts SET status = ?, completed_at = CURRENT_TIMESTAMP WHERE id = ?', (status, job_id))
+        if status == 'cancelled':
+            cursor.execute(
+                "UPDATE broadcast_recipients SET status = 'cancelled' WHERE broadcast_id = ? AND status IN ('pending', 'sending')",
+                (job_id,)
+            )
+
+# ========== SCHEDULED BROADCASTS ==========
+class CronSchedule:
+    """Five-field cron expression: minute hour day-of-month month day-of-week (0/7 = Sunday).
+    
+    Supports '*', numbers, ranges 'a-b', steps '*/n' / 'a-b/n' and comma lists.
+    """
+    
+    FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+    
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError("a cron schedule has 5 fields: minute hour day month weekday")
+        self.expression = ' '.join(fields)
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self.parse_field(field, low, high) for field, (low, high) in zip(fields, self.FIELDS)
+        )
+        if 7 in self.weekdays:
+            self.weekdays = (self.weekdays - {7}) | {0}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+        self.next_after(datetime(2000, 1, 1))  # rejects expressions that never fire (e.g. 30 Feb)
+    
+    @staticmethod
+    def parse_field(field: str, low: int, high: int) -> set:
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step = part.split('/')
+                step = int(step)
+                if step < 1:
+                    raise ValueError(f"bad step in '{field}'")
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = (int(v) for v in part.split('-'))
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+            if not low <= start <= end <= high:
+                raise ValueError(f"'{field}' is outside {low}-{high}")
+            values.update(range(start, end + 1, step))
+        return values
+    
+    def matches_day(self, day: datetime) -> bool:
+        in_month = day.day in self.days
+        in_week = day.isoweekday() % 7 in self.weekdays
+        # Standard cron: if both fields are restricted, either may match
+        if self.any_day or self.any_weekday:
+            return in_month and in_week
+        return in_month or in_week
+    
+    def next_after(self, moment: datetime) -> datetime:
+        """First matching minute strictly after `moment` (naive, in the schedule's timezone)"""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self.matches_day(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f"'{self.expression}' never fires")
+
+def local_to_utc(moment: datetime) -> datetime:
+    return moment.replace(tzinfo=SCHEDULER_TIMEZONE).astimezone(ZoneInfo('UTC')).replace(tzinfo=None)
+
+def utc_to_local(moment: datetime) -> datetime:
+    return moment.replace(tzinfo=ZoneInfo('UTC')).astimezone(SCHEDULER_TIMEZONE).replace(tzinfo=None)
+
+def next_cron_run(expression: str, after_utc: datetime) -> datetime:
+    """Next UTC run time of a cron expression evaluated in SCHEDULER_TIMEZONE"""
+    return local_to_utc(CronSchedule(expression).next_after(utc_to_local(after_utc)))
+
+# No cron field has four digits, so input starting like a date is always meant as a one-off run
+ONE_OFF_PATTERN = re.compile(r'\d{4}-\d{1,2}-\d{1,2}\b')
+
+def parse_schedule_input(text: str) -> tuple:
+    """'YYYY-MM-DD HH:MM' (one-off) or a cron expression -> (first_run_utc, cron or None); raises ValueError"""
+    text = text.strip()
+    now = datetime.utcnow()
+    if not ONE_OFF_PATTERN.match(text):
+        return next_cron_run(text, now), CronSchedule(text).expression
+    try:
+        run_at = local_to_utc(datetime.strptime(text, '%Y-%m-%d %H:%M'))
+    except ValueError as e:
+        raise ValueError(f"not a valid date and time: {e}") from None
+    if run_at <= now:
+        raise ValueError("that time is in the past")
+    return run_at, None
+
+def create_scheduled_broadcast(admin_id: int, target_type: str, target_id: str, message_type: str, content: str,
+                               from_chat_id: int, message_id: int, media: Optional[dict], schedule: Optional[str],
+                               next_run_at: datetime):
+    with db.transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO scheduled_broadcasts (admin_id, target_type, target_id, message_type, content, from_chat_id,
+                                              message_id, media, schedule, next_run_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (admin_id, target_type, target_id, message_type, content, from_chat_id, message_id,
+              json.dumps(media) if media else None, schedule, next_run_at.strftime('%Y-%m-%d %H:%M:%S')))
+        return cursor.lastrowid
+
+@read_only
+def get_active_schedules():
+    """[(schedule_id, next_run_at)] of schedules that still have runs ahead"""
+    return db.fetchall("SELECT id, next_run_at FROM scheduled_broadcasts WHERE status = 'active' ORDER BY next_run_at")
+
+@read_only
+def get_scheduled_broadcasts(limit: int = 10):
+    return db.fetch_dicts(
+        "SELECT * FROM scheduled_broadcasts WHERE status = 'active' ORDER BY next_run_at LIMIT ?", (limit,)
+    )
+
+@read_only
+def get_scheduled_broadcast(schedule_id: int):
+    return db.fetch_dict('SELECT * FROM scheduled_broadcasts WHERE id = ?', (schedule_id,))
+
+def cancel_scheduled_broadcast(schedule_id: int):
+    with db.transaction() as cursor:
+        cursor.execute("UPDATE scheduled_broadcasts SET status = 'cancelled' WHERE id = ? AND status = 'active'", (schedule_id,))
+        return cursor.rowcount > 0
+
+def fire_scheduled_broadcast(schedule_id: int, due_at: str):
+    """Create the broadcast job of a due schedule and advance it, in one transaction.
+    
+    Returns (schedule, job_id, total, next_run_at) or None if the schedule was cancelled or
+    already fired for `due_at`, so a run is never created twice.
+    """
+    with db.transaction() as cursor:
+        cursor.execute(
+            "SELECT * FROM scheduled_broadcasts WHERE id = ? AND status = 'active' AND next_run_at = ?",
+            (schedule_id, due_at)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        schedule = dict(zip([column[0] for column in cursor.description], row))
+        
+        job_id, total = enqueue_broadcast_job(
+            cursor, schedule['admin_id'], schedule['target_type'], schedule['target_id'], schedule['message_type'],
+            schedule['content'], schedule['from_chat_id'], schedule['message_id'], schedule['media']
+        )
+        
+        next_run_at = None
+        if schedule['schedule']:
+            # Runs missed while the bot was down are not replayed; the next one is computed from now
+            next_run_at = next_cron_run(schedule['schedule'], datetime.utcnow())
+            cursor.execute(
+                'UPDATE scheduled_broadcasts SET next_run_at = ?, run_count = run_count + 1, last_job_id = ? WHERE id = ?',
+                (next_run_at.strftime('%Y-%m-%d %H:%M:%S'), job_id, schedule_id)
+            )
+        else:
+            cursor.execute(
+                "UPDATE scheduled_broadcasts SET status = 'done', run_count = run_count + 1, last_job_id = ? WHERE id = ?",
+                (job_id, schedule_id)
+            )
+    return schedule, job_id, total, next_run_at
+
+# ========== ACTIVITY TRACKING ==========
+class ActivityBuffer:
+    """Collects last_active timestamps in memory and writes them in batches.
+    
+    A user who sends many messages between flushes costs one row update. Flushes happen
+    every `flush_interval` seconds, as soon as `flush_size` users are pending, and once
+    more on shutdown. A failed flush is merged back for the next attempt; the buffer never
+    holds more than `max_pending` users, and activity that does not fit is dropped and
+    counted in `dropped`.
+    """
+    
+    def __init__(self, flush_interval: float, flush_size: int, max_pending: int):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_pending = max(max_pending, flush_size)
+        self.pending: Dict[int, str] = {}
+        self.dropped = 0
+        self.task: Optional[asyncio.Task] = None
+        self.wakeup = asyncio.Event()
+    
+    def touch(self, user_id: int):
+        if user_id not in self.pending and len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        # Same format and timezone (UTC) as SQLite's CURRENT_TIMESTAMP
+        self.pending[user_id] = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        if len(self.pending) >= self.flush_size:
+            self.wakeup.set()
+    
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        try:
+            await run_db(flush_user_activity, [(ts, uid) for uid, ts in batch.items()])
+        except sqlite3.Error as e:
+            logger.error(f"Failed to flush activity for {len(batch)} users: {e}")
+            # Keep the data for the next attempt unless newer timestamps arrived meanwhile
+            for uid, ts in batch.items():
+                if uid in self.pending:
+                    continue
+                if len(self.pending) >= self.max_pending:
+                    self.dropped += 1
+                else:
+                    self.pending[uid] = ts
+    
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+    
+    def start(self):
+        if self.task is None:
+            self.wakeup = asyncio.Event()  # bind to the running loop
+            self.task = asyncio.create_task(self.run())
+    
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+ACTIVITY_BUFFER = ActivityBuffer(ACTIVITY_FLUSH_INTERVAL, ACTIVITY_FLUSH_SIZE, ACTIVITY_BUFFER_MAX)
+
+# ========== CONVERSATION STATE STORE ==========
+class MemoryStateStore:
+    """Registration state per user, kept in memory with a TTL.
+    
+    Entries expire `ttl` seconds after their last write, so abandoned signups disappear
+    on their own; a sweep every `sweep_interval` seconds frees their memory. Only used
+    from the event loop.
+    """
+    
+    def __init__(self, ttl: float, sweep_interval: float = 60):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.entries: Dict[int, tuple] = {}  # user_id -> (state, data, expires_at)
+        self.task: Optional[asyncio.Task] = None
+    
+    def get(self, user_id: int) -> Optional[dict]:
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        if entry[2] <= time.time():
+            self.clear(user_id)
+            return None
+        return {'state': entry[0], 'data': entry[1]}
+    
+    def save(self, user_id: int, state: str, data: str = ''):
+        self.entries[user_id] = (state, data, time.time() + self.ttl)
+    
+    def clear(self, user_id: int):
+        self.entries.pop(user_id, None)
+    
+    def discard(self, user_id: int):
+        """Forget a state whose snapshot row was already deleted (see save_user)"""
+        self.entries.pop(user_id, None)
+    
+    def expire(self) -> int:
+        now = time.time()
+        expired = [uid for uid, entry in self.entries.items() if entry[2] <= now]
+        for uid in expired:
+            self.clear(uid)
+        return len(expired)
+    
+    async def tick(self):
+        self.expire()
+    
+    async def run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.tick()
+    
+    async def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run(self.sweep_interval))
+    
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+class SnapshotStateStore(MemoryStateStore):
+    """MemoryStateStore that also persists to user_states in batched snapshots.
+    
+    Changed users are written in one transaction every `snapshot_interval` seconds and on
+    shutdown, so a crash loses at most that much progress. Expired rows are dropped when
+    the snapshot is loaded at startup.
+    """
+    
+    def __init__(self, ttl: float, snapshot_interval: float, sweep_interval: float = 60):
+        super().__init__(ttl, sweep_interval)
+        self.snapshot_interval = snapshot_interval
+        self.dirty: set = set()
+        self.discarded: set = set()  # rows someone else deletes; flushes leave them alone
+        self.last_sweep = time.monotonic()
+    
+    def save(self, user_id: int, state: str, data: str = ''):
+        super().save(user_id, state, data)
+        self.dirty.add(user_id)
+        self.discarded.discard(user_id)
+    
+    def clear(self, user_id: int):
+        super().clear(user_id)
+        self.dirty.add(user_id)
+    
+    def discard(self, user_id: int):
+        super().discard(user_id)
+        self.dirty.discard(user_id)
+        self.discarded.add(user_id)
+    
+    async def flush(self):
+        # The writer thread runs writes in submission order, so a snapshot submitted before
+        # a discard lands before save_user's delete, and none submitted after includes it
+        if not self.dirty:
+            self.discarded.clear()
+            return
+        batch, self.dirty = self.dirty - self.discarded, set()
+        self.discarded.clear()
+        upserts = [(uid, *self.entries[uid]) for uid in batch if uid in self.entries]
+        deletes = [uid for uid in batch if uid not in self.entries]
+        try:
+            await run_db(write_user_states, upserts, deletes)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to snapshot {len(batch)} conversation states: {e}")
+            self.dirty |= batch - self.discarded
+    
+    async def tick(self):
+        if time.monotonic() - self.last_sweep >= self.sweep_interval:
+            self.last_sweep = time.monotonic()
+            self.expire()
+        await self.flush()
+    
+    async def start(self):
+        if self.task is None:
+            rows = await run_db(load_user_states, time.time())
+            self.entries.update({uid: (state, data, expires_at) for uid, state, data, expires_at in rows})
+            self.task = asyncio.create_task(self.run(self.snapshot_interval))
+    
+    async def stop(self):
+        await super().stop()
+        await self.flush()
+
+def create_state_store():
+    if STATE_BACKEND == 'sqlite':
+        return SnapshotStateStore(STATE_TTL, STATE_SNAPSHOT_INTERVAL)
+    return MemoryStateStore(STATE_TTL)
+
+STATE_STORE = create_state_store()
+
+# ========== ADMIN NOTIFICATIONS ==========
+class AdminNotifier:
+    """Sends admin notifications from a background queue, so handlers never wait on them.
+    
+    Notifications still queued at shutdown get `drain_timeout` seconds to go out, so stop()
+    belongs in post_stop, while the bot's HTTP client is still open.
+    """
+    
+    def __init__(self, drain_timeout: float = 10):
+        self.drain_timeout = drain_timeout
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+    
+    def submit(self, text: str, parse_mode: Optional[str] = None):
+        self.queue.put_nowait((text, parse_mode))
+    
+    async def send(self, bot, text: str, parse_mode: Optional[str]):
+        for admin_id in ADMIN_IDS:
+            try:
+                await bot.send_message(chat_id=admin_id, text=text, parse_mode=parse_mode)
+                print(f"✅ Notified admin {admin_id}")
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                try:
+                    await bot.send_message(chat_id=admin_id, text=text, parse_mode=parse_mode)
+                except TelegramError as e:
+                    print(f"❌ Failed to notify admin {admin_id}: {e}")
+            except TelegramError as e:
+                print(f"❌ Failed to notify admin {admin_id}: {e}")
+    
+    async def run(self, bot):
+        while True:
+            text, parse_mode = await self.queue.get()
+            try:
+                await self.send(bot, text, parse_mode)
+            except Exception as e:
+                logger.error(f"Admin notification failed: {e}")
+            finally:
+                self.queue.task_done()
+    
+    def start(self, bot):
+        if self.task is None:
+            self.queue = asyncio.Queue()  # bind to the running loop
+            self.task = asyncio.create_task(self.run(bot))
+    
+    async def stop(self):
+        if self.task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropped {self.queue.qsize()} admin notifications at shutdown")
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+ADMIN_NOTIFIER = AdminNotifier()
 
 # ========== CONVERSATION STATES ==========
 PHONE, LANGUAGE, COUNTRY = range(3)
@@ -198,6 +1551,21 @@ COUNTRIES = {
     'KE': '🇰🇪 KEN'
 }
 
+COUNTRY_TIMEZONES = {
+    'ENG': ZoneInfo('Europe/London'),
+    'RU': ZoneInfo('Europe/Moscow'),
+    'BD': ZoneInfo('Asia/Dhaka'),
+    'IN': ZoneInfo('Asia/Kolkata'),
+    'PK': ZoneInfo('Asia/Karachi'),
+    'PH': ZoneInfo('Asia/Manila'),
+    'LK': ZoneInfo('Asia/Colombo'),
+    'MY': ZoneInfo('Asia/Kuala_Lumpur'),
+    'TH': ZoneInfo('Asia/Bangkok'),
+    'NG': ZoneInfo('Africa/Lagos'),
+    'TR': ZoneInfo('Europe/Istanbul'),
+    'KE': ZoneInfo('Africa/Nairobi')
+}
+
 LANGUAGES = {
     'ENG': '🇬🇧 English',
     'RU': '🇷🇺 Русский',
@@ -280,8 +1648,11 @@ def get_admin_keyboard():
         [InlineKeyboardButton("👤 Send Message to Specific User", callback_data="send_specific")],
         [InlineKeyboardButton("📋 View User List (Select by Name)", callback_data="view_users_select")],
         [InlineKeyboardButton("🌍 Send Message by Country", callback_data="broadcast_country")],
+        [InlineKeyboardButton("🎯 Send Message to a Segment", callback_data="seg_menu")],
         [InlineKeyboardButton("📊 View Statistics", callback_data="view_stats")],
         [InlineKeyboardButton("👥 View User List", callback_data="view_users")],
+        [InlineKeyboardButton("📦 Broadcast Jobs", callback_data="bcast_jobs")],
+        [InlineKeyboardButton("⏰ Scheduled Broadcasts", callback_data="sched_list")],
         [InlineKeyboardButton("❌ Close Admin Panel", callback_data="close_admin")]
     ])
 
@@ -300,16 +1671,12 @@ def get_country_selection_keyboard():
     
     return InlineKeyboardMarkup(buttons)
 
-def get_user_list_keyboard(page: int = 0, users_per_page: int = 10):
-    """Create keyboard with user list (paginated)"""
-    users = get_all_users()
-    total_users = len(users)
-    
-    # Calculate pagination
-    start_idx = page * users_per_page
-    end_idx = start_idx + users_per_page
-    page_users = users[start_idx:end_idx]
+def get_user_list_keyboard(page: int, page_users: List[dict], has_next: bool, total_users: int, users_per_page: int = USERS_PER_PAGE):
+    """Create keyboard with user list (paginated).
     
+    Navigation buttons carry a keyset cursor (registered_at + user_id of the first/last
+    user on this page), so the next page is read straight from the index.
+    """
     buttons = []
     
     # Add user buttons (2 per row)
@@ -326,13 +1693,19 @@ def get_user_list_keyboard(page: int = 0, users_per_page: int = 10):
     # Add pagination buttons if needed
     pagination_buttons = []
     
-    if page > 0:
-        pagination_buttons.append(InlineKeyboardButton("◀️ Previous", callback_data=f"user_page_{page-1}"))
+    if page > 0 and page_users:
+        first = page_users[0]
+        pagination_buttons.append(InlineKeyboardButton(
+            "◀️ Previous", callback_data=f"user_page_{page-1}_p_{first['registered_at']}_{first['user_id']}"
+        ))
     
-    pagination_buttons.append(InlineKeyboardButton(f"📄 {page+1}/{(total_users-1)//users_per_page + 1}", callback_data="noop"))
+    pagination_buttons.append(InlineKeyboardButton(f"📄 {page+1}/{max(1, (total_users-1)//users_per_page + 1)}", callback_data="noop"))
     
-    if end_idx < total_users:
-        pagination_buttons.append(InlineKeyboardButton("Next ▶️", callback_data=f"user_page_{page+1}"))
+    if has_next and page_users:
+        last = page_users[-1]
+        pagination_buttons.append(InlineKeyboardButton(
+            "Next ▶️", callback_data=f"user_page_{page+1}_n_{last['registered_at']}_{last['user_id']}"
+        ))
     
     if pagination_buttons:
         buttons.append(pagination_buttons)
@@ -342,13 +1715,20 @@ def get_user_list_keyboard(page: int = 0, users_per_page: int = 10):
     
     return InlineKeyboardMarkup(buttons)
 
+def parse_user_page_callback(data: str):
+    """Split 'user_page_<page>_<n|p>_<registered_at>_<user_id>' into (page, direction, cursor)"""
+    _, _, page, direction, registered_at, user_id = data.split('_', 5)
+    return int(page), direction, (registered_at, int(user_id))
+
 def get_broadcast_confirm_keyboard():
     """Broadcast confirmation keyboard"""
     return InlineKeyboardMarkup([
         [
             InlineKeyboardButton("✅ Yes, Send Now", callback_data="confirm_send"),
             InlineKeyboardButton("❌ Cancel", callback_data="cancel_send")
-        ]
+        ],
+        [InlineKeyboardButton("🌙 Send in Local Daytime", callback_data="confirm_staggered")],
+        [InlineKeyboardButton("⏰ Schedule Instead", callback_data="schedule_broadcast")]
     ])
 
 def get_specific_user_confirm_keyboard():
@@ -360,13 +1740,70 @@ def get_specific_user_confirm_keyboard():
         ]
     ])
 
+SEGMENT_REGISTERED_PRESETS = [('Last 7 days', 7), ('Last 30 days', 30), ('Last 90 days', 90)]
+SEGMENT_ACTIVE_PRESETS = [1, 7, 30, 90]
+
+def get_segment_keyboard(audience_size: int):
+    """Segment builder: one button per filter, plus the audience preview"""
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("🌍 Countries", callback_data="seg_countries"),
+            InlineKeyboardButton("🗣 Languages", callback_data="seg_languages")
+        ],
+        [
+            InlineKeyboardButton("📅 Registered", callback_data="seg_registered"),
+            InlineKeyboardButton("⏱ Last Active", callback_data="seg_active")
+        ],
+        [InlineKeyboardButton(f"✅ Continue with {audience_size} users", callback_data="seg_next")],
+        [
+            InlineKeyboardButton("🧹 Reset", callback_data="seg_reset"),
+            InlineKeyboardButton("🔙 Back", callback_data="back_to_admin")
+        ]
+    ])
+
+def get_segment_toggle_keyboard(prefix: str, options: dict, selected: List[str]):
+    """Multi-select grid for countries or languages"""
+    buttons = []
+    items = list(options.items())
+    for i in range(0, len(items), 3):
+        buttons.append([
+            InlineKeyboardButton(f"{'✅ ' if code in selected else ''}{label}", callback_data=f"{prefix}{code}")
+            for code, label in items[i:i+3]
+        ])
+    buttons.append([InlineKeyboardButton("✔️ Done", callback_data="seg_menu")])
+    return InlineKeyboardMarkup(buttons)
+
+def get_segment_registered_keyboard():
+    buttons = [[InlineKeyboardButton(label, callback_data=f"seg_reg_{days}")] for label, days in SEGMENT_REGISTERED_PRESETS]
+    buttons.append([InlineKeyboardButton("✏️ Custom date range", callback_data="seg_reg_custom")])
+    buttons.append([InlineKeyboardButton("♾ Any time", callback_data="seg_reg_any")])
+    return InlineKeyboardMarkup(buttons)
+
+def get_segment_active_keyboard():
+    buttons = [[InlineKeyboardButton(f"Active in the last {days}d", callback_data=f"seg_act_{days}")] for days in SEGMENT_ACTIVE_PRESETS]
+    buttons.append([InlineKeyboardButton("♾ Any time", callback_data="seg_act_any")])
+    return InlineKeyboardMarkup(buttons)
+
+def get_segment_broadcast_confirm_keyboard():
+    """Segment broadcast confirmation keyboard"""
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("✅ Yes, Send to This Segment", callback_data="confirm_segment"),
+            InlineKeyboardButton("❌ Cancel", callback_data="cancel_segment")
+        ],
+        [InlineKeyboardButton("🌙 Send in Local Daytime", callback_data="confirm_staggered")],
+        [InlineKeyboardButton("⏰ Schedule Instead", callback_data="schedule_broadcast")]
+    ])
+
 def get_country_broadcast_confirm_keyboard():
     """Country broadcast confirmation keyboard"""
     return InlineKeyboardMarkup([
         [
             InlineKeyboardButton("✅ Yes, Send to This Country", callback_data="confirm_country"),
             InlineKeyboardButton("❌ Cancel", callback_data="cancel_country")
-        ]
+        ],
+        [InlineKeyboardButton("🌙 Send in Local Daytime", callback_data="confirm_staggered")],
+        [InlineKeyboardButton("⏰ Schedule Instead", callback_data="schedule_broadcast")]
     ])
 
 def get_selected_user_confirm_keyboard(user_id: int):
@@ -378,7 +1815,827 @@ def get_selected_user_confirm_keyboard(user_id: int):
         ]
     ])
 
+# ========== PRECOMPUTED REPLIES ==========
+# Static keyboards and per-country texts are built once at import. PTB objects are frozen
+# after construction, so a single instance can be shared by every reply.
+PHONE_KEYBOARD = get_phone_keyboard()
+LANGUAGE_KEYBOARD = get_language_keyboard()
+COUNTRY_KEYBOARD = get_country_keyboard()
+MAIN_MENU_KEYBOARD = get_main_menu_keyboard()
+MAIN_MENU_TEXTS = frozenset(button.text for row in MAIN_MENU_KEYBOARD.keyboard for button in row)
+ADMIN_KEYBOARD = get_admin_keyboard()
+COUNTRY_SELECTION_KEYBOARD = get_country_selection_keyboard()
+
+def render_manager_contact_text(country: Optional[str]) -> str:
+    manager_username = COUNTRY_MANAGERS.get(country, '@Default_Manager')
+    return (
+        f"📞 **Contact Local Manager**\n\n"
+        f"📍 Region: {COUNTRIES.get(country, 'Your Country')}\n"
+        f"👤 Manager: {manager_username}\n\n"
+        f"Please contact our local manager directly on Telegram:\n"
+        f"👉 {manager_username}\n\n"
+        f"*Note: Click the username above to start chatting*"
+    )
+
+def render_program_details_text(country: Optional[str]) -> str:
+    return (
+        f"📊 **AFFILIATE PROGRAM DETAILS**\n\n"
+        f"{COUNTRY_OFFERS.get(country, COUNTRY_OFFERS['ENG'])}\n\n"
+        f"💡 **General Features:**\n"
+        f"• Real-time tracking dashboard\n"
+        f"• Marketing materials provided\n"
+        f"• Dedicated support team\n"
+        f"• Weekly training sessions\n"
+        f"• Performance bonuses\n\n"
+        f"📞 **Contact your local manager:**\n"
+        f"{COUNTRY_MANAGERS.get(country, '@Default_Manager')}"
+    )
+
+MANAGER_CONTACT_TEXTS = {country: render_manager_contact_text(country) for country in COUNTRIES}
+PROGRAM_DETAILS_TEXTS = {country: render_program_details_text(country) for country in COUNTRIES}
+
+GUEST_PROGRAM_TEXT = (
+    "📊 **AFFILIATE PROGRAM**\n\n"
+    "Join our global affiliate network!\n\n"
+    "• Commission: upto 50%\n"
+    "• Weekly payments\n"
+    "• Marketing tools provided\n"
+    "• 24/7 support\n\n"
+    "Register with /start to see country-specific offers!"
+)
+
+def manager_contact_text(country: Optional[str]) -> str:
+    # Codes outside COUNTRIES (older rows) are rendered on demand
+    return MANAGER_CONTACT_TEXTS.get(country) or render_manager_contact_text(country)
+
+def program_details_text(country: Optional[str]) -> str:
+    return PROGRAM_DETAILS_TEXTS.get(country) or render_program_details_text(country)
+
+# ========== BROADCAST ENGINE ==========
+class TokenBucket:
+    """Async token bucket: allows `rate` acquisitions per second with bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock: Optional[asyncio.Lock] = None
+        self.lock_loop = None
+
+    def set_rate(self, rate: float):
+        """Change the rate from now on (tokens earned so far are kept)"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for `seconds` (used after a RetryAfter flood wait)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    async def acquire(self):
+        # Shared process-wide, so bind the lock to whichever loop is running
+        loop = asyncio.get_running_loop()
+        if self.lock_loop is not loop:
+            self.lock, self.lock_loop = asyncio.Lock(), loop
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class RateLimiter:
+    """Global token bucket plus a minimum interval between messages to the same chat"""
+
+    def __init__(self, rate: float, per_chat_interval: float):
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.chat_next_send: Dict[int, float] = {}
+
+    async def acquire(self, chat_id: int):
+        now = time.monotonic()
+        next_send = self.chat_next_send.get(chat_id, 0.0)
+        self.chat_next_send[chat_id] = max(now, next_send) + self.per_chat_interval
+
+        if next_send > now:
+            await asyncio.sleep(next_send - now)
+
+        await self.bucket.acquire()
+
+        # Forget chats whose interval has passed so the dict does not grow with the audience
+        if len(self.chat_next_send) > 10000:
+            now = time.monotonic()
+            self.chat_next_send = {cid: t for cid, t in self.chat_next_send.items() if t > now}
+
+    def flood_wait(self, seconds: float):
+        self.bucket.pause(seconds)
+
+    def set_rate(self, rate: float):
+        self.bucket.set_rate(rate)
+
+# One limiter for the whole process: every broadcast job (interactive, scheduled, staggered,
+# resumed) draws from the same BROADCAST_SETTINGS['rate'] budget, and a RetryAfter seen by
+# any of them pauses all of them
+BROADCAST_LIMITER = RateLimiter(BROADCAST_SETTINGS['rate'], BROADCAST_SETTINGS['per_chat_interval'])
+
+class BroadcastResult:
+    def __init__(self):
+        self.total = 0
+        self.successful = 0
+        self.failed = 0
+
+    @property
+    def processed(self):
+        return self.successful + self.failed
+
+class BroadcastControl:
+    """Pause/resume/cancel switch shared between a running broadcast and the admin panel"""
+
+    def __init__(self, paused: bool = False):
+        self.running = asyncio.Event()
+        if not paused:
+            self.running.set()
+        self.cancelled = False
+        self.stopping = False   # process shutdown: stop sending but leave the job resumable
+        self.result: Optional[BroadcastResult] = None
+
+    @property
+    def paused(self):
+        return not self.running.is_set()
+
+    @property
+    def halted(self):
+        return self.cancelled or self.stopping
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def cancel(self):
+        self.cancelled = True
+        self.running.set()
+
+    def stop(self):
+        self.stopping = True
+        self.running.set()
+
+class BroadcastEngine:
+    """Fan a send function out over a bounded pool of workers, respecting Telegram rate limits"""
+
+    def __init__(self, concurrency: Optional[int] = None, limiter: Optional[RateLimiter] = None):
+        self.concurrency = concurrency or BROADCAST_SETTINGS['concurrency']
+        self.limiter = limiter or BROADCAST_LIMITER
+        self.max_retries = BROADCAST_SETTINGS['max_retries']
+
+    async def send_one(self, chat_id: int, send: Callable[[int], Awaitable[Any]],
+                       control: Optional[BroadcastControl] = None) -> Optional[Exception]:
+        """Send to one chat, retrying after flood waits and connection errors. Returns None on
+        success, else the error (a transport error as soon as the broadcast is halted).
+        
+        Never raises: an unexpected exception counts as a failed send, so one bad recipient
+        cannot take a worker down and leave the producer blocked on a full queue.
+        """
+        error = None
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(chat_id)
+            try:
+                await send(chat_id)
+                return None
+            except RetryAfter as e:
+                logger.warning(f"Flood limit hit sending to {chat_id}, retrying in {e.retry_after}s")
+                BROADCAST_FLOOD_WAITS.inc()
+                self.limiter.flood_wait(e.retry_after)
+                error = e
+                if attempt == self.max_retries:
+                    logger.error(f"Failed to send to user {chat_id}: retries exhausted")
+            except TelegramError as e:
+                if is_transport_error(e) and attempt < self.max_retries and not (control and control.halted):
+                    # No answer from the API; back off, then retry unless we are shutting down
+                    error = e
+                    await asyncio.sleep(attempt + 1)
+                    if not (control and control.halted):
+                        continue
+                    return e
+                if classify_delivery_error(e):
+                    logger.info(f"User {chat_id} is unreachable: {e}")
+                else:
+                    logger.error(f"Failed to send to user {chat_id}: {e}")
+                return e
+            except Exception as e:
+                logger.exception(f"Unexpected error sending to user {chat_id}")
+                return e
+        return error
+
+    async def run(
+        self,
+        chat_ids: Union[Iterable[int], AsyncIterable[int]],
+        send: Callable[[int], Awaitable[Any]],
+        total: int = 0,
+        on_result: Optional[Callable[[int, Optional[Exception]], Any]] = None,
+        result: Optional[BroadcastResult] = None,
+        control: Optional[BroadcastControl] = None,
+        on_skip: Optional[Callable[[int], Any]] = None
+    ) -> BroadcastResult:
+        if result is None:
+            result = BroadcastResult()
+            result.total = total
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def worker():
+            while True:
+                chat_id = await queue.get()
+                try:
+                    if chat_id is None:
+                        return
+
+                    if control:
+                        await control.running.wait()
+                        if control.halted:
+                            # Taken from the source but never attempted
+                            if on_skip:
+                                on_skip(chat_id)
+                            continue
+
+                    error = await self.send_one(chat_id, send, control)
+                    if control and control.stopping and is_transport_error(error):
+                        # Cut off by the shutdown, not refused by the recipient: leave it pending
+                        if on_skip:
+                            on_skip(chat_id)
+                        continue
+                    if error is None:
+                        result.successful += 1
+                    else:
+                        result.failed += 1
+                    if on_result:
+                        on_result(chat_id, error)
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            if hasattr(chat_ids, '__aiter__'):
+                async for chat_id in chat_ids:
+                    await queue.put(chat_id)
+                    if control and control.halted:
+                        break
+                if hasattr(chat_ids, 'aclose'):
+                    await chat_ids.aclose()
+            else:
+                for chat_id in chat_ids:
+                    await queue.put(chat_id)
+                    if control and control.halted:
+                        break
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+        return result
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
+class ProgressReporter:
+    """Keep a progress message up to date without spending the broadcast's rate budget.
+    
+    The counters are sampled on a timer instead of after every send, so edits are
+    coalesced to at most one per interval and skipped while nothing has changed.
+    """
+    
+    def __init__(
+        self,
+        message,
+        render: Callable[[BroadcastResult, float, Optional[float]], tuple],
+        control: Optional[BroadcastControl] = None,
+        interval: Optional[float] = None,
+        window: float = 30.0
+    ):
+        self.message = message
+        self.render = render    # (result, msgs_per_sec, eta_seconds) -> (text, reply_markup)
+        self.control = control
+        self.interval = interval or BROADCAST_SETTINGS['progress_interval']
+        self.window = window    # seconds of history used for the throughput figure
+        self.samples: deque = deque()
+        self.last_key = None
+        self.not_before = 0.0
+        self.edits = 0
+        self.task: Optional[asyncio.Task] = None
+    
+    def throughput(self, processed: int) -> float:
+        now = time.monotonic()
+        self.samples.append((now, processed))
+        while len(self.samples) > 2 and now - self.samples[0][0] > self.window:
+            self.samples.popleft()
+        started, done = self.samples[0]
+        return (processed - done) / (now - started) if now > started else 0.0
+    
+    async def update(self, result: BroadcastResult):
+        rate = self.throughput(result.processed)
+        key = (result.processed, self.control.paused if self.control else False)
+        if key == self.last_key or time.monotonic() < self.not_before:
+            return
+        
+        eta = (result.total - result.processed) / rate if rate > 0 else None
+        text, reply_markup = self.render(result, rate, eta)
+        try:
+            await self.message.edit_text(text, reply_markup=reply_markup)
+            self.edits += 1
+        except RetryAfter as e:
+            # Try again with fresh counters once the flood wait is over
+            self.not_before = time.monotonic() + e.retry_after
+            return
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                logger.warning(f"Progress update failed: {e}")
+        except TelegramError as e:
+            logger.warning(f"Progress update failed: {e}")
+        self.last_key = key
+    
+    async def run(self, result: BroadcastResult):
+        self.throughput(result.processed)
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.update(result)
+    
+    def start(self, result: BroadcastResult):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run(result))
+    
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+def extract_broadcast_media(message) -> Optional[dict]:
+    """file_id and caption of a photo, video or document message (None for anything else)"""
+    if message.photo:
+        media_type, media = 'photo', message.photo[-1]
+    elif message.video:
+        media_type, media = 'video', message.video
+    elif message.document:
+        media_type, media = 'document', message.document
+    else:
+        return None
+    
+    return {
+        'type': media_type,
+        'file_id': media.file_id,
+        'file_unique_id': media.file_unique_id,
+        'caption': message.caption,
+        'caption_entities': [entity.to_dict() for entity in message.caption_entities],
+        'has_spoiler': bool(message.has_media_spoiler)
+    }
+
+def media_message_sender(bot, media: dict, from_chat_id: int, message_id: int) -> Callable[[int], Awaitable[Any]]:
+    """Build a send function that re-sends an already uploaded file by its file_id.
+    
+    The request arguments are prepared once per broadcast. If Telegram rejects the
+    file_id, the rest of the broadcast falls back to copying the original message.
+    """
+    method = getattr(bot, f"send_{media['type']}")  # send_photo / send_video / send_document
+    kwargs = {
+        media['type']: media['file_id'],
+        'caption': media['caption'],
+        'caption_entities': MessageEntity.de_list(media['caption_entities'], bot) or None
+    }
+    if media['has_spoiler'] and media['type'] != 'document':
+        kwargs['has_spoiler'] = True
+    
+    copy = copy_message_sender(bot, from_chat_id, message_id)
+    use_copy = False
+    
+    async def send(chat_id: int):
+        nonlocal use_copy
+        if use_copy:
+            return await copy(chat_id)
+        try:
+            return await method(chat_id=chat_id, **kwargs)
+        except BadRequest as e:
+            if 'file' not in str(e).lower():
+                raise
+            logger.warning(f"file_id rejected ({e}), falling back to copy_message")
+            use_copy = True
+            return await copy(chat_id)
+    return send
+
+def copy_message_sender(bot, from_chat_id: int, message_id: int) -> Callable[[int], Awaitable[Any]]:
+    """Build a send function that copies a message to a chat"""
+    async def send(chat_id: int):
+        return await bot.copy_message(
+            chat_id=chat_id,
+            from_chat_id=from_chat_id,
+            message_id=message_id
+        )
+    return send
+
+def broadcast_sender(bot, job: dict) -> Callable[[int], Awaitable[Any]]:
+    """Native file_id send for media broadcasts, copy_message for everything else"""
+    if job['media']:
+        return media_message_sender(bot, json.loads(job['media']), job['from_chat_id'], job['message_id'])
+    return copy_message_sender(bot, job['from_chat_id'], job['message_id'])
+
+async def run_broadcast_job(
+    bot,
+    job_id: int,
+    reporter: Optional[ProgressReporter] = None,
+    control: Optional[BroadcastControl] = None
+) -> BroadcastResult:
+    """Deliver a persisted broadcast job, claiming recipients from the database in chunks.
+    
+    Results are acknowledged in batches, so after a restart the job continues from its
+    cursor and only the recipients that were in flight at the time are uncertain.
+    """
+    job = await run_db(get_broadcast_job, job_id)
+    chunk_size = BROADCAST_SETTINGS['concurrency'] * 2
+    control = control or BroadcastControl()
+    
+    result = BroadcastResult()
+    result.total = job['total_count']
+    result.successful = job['sent_count']
+    result.failed = job['failed_count']
+    control.result = result
+    
+    acks: List[tuple] = []
+    ack_writes: List[asyncio.Future] = []
+    skipped: List[int] = []
+    
+    async def recipients():
+        while True:
+            user_ids = await run_db(claim_broadcast_recipients, job_id, chunk_size)
+            if not user_ids:
+                next_due = await run_db(get_next_due_recipient, job_id) if job['staggered'] else None
+                if next_due is None:
+                    return
+                # Staggered job between send slots: wait in short steps so pause/cancel/shutdown stay responsive
+                delay = (datetime.strptime(next_due, '%Y-%m-%d %H:%M:%S') - datetime.utcnow()).total_seconds()
+                await asyncio.sleep(min(max(delay, 0.2), 5))
+                if control.halted:
+                    return
+                continue
+            position = 0
+            try:
+                for position, user_id in enumerate(user_ids, 1):
+                    yield user_id
+            finally:
+                # Closed early (pause/cancel/shutdown): the rest of the chunk was never queued
+                skipped.extend(user_ids[position:])
+    
+    def record(chat_id: int, error: Optional[Exception]):
+        outcome = 'sent' if error is None else classify_delivery_error(error) or 'failed'
+        BROADCAST_MESSAGES.inc(outcome=outcome)
+        acks.append((chat_id, outcome))
+        if len(acks) >= chunk_size:
+            # The DB thread runs writes in submission order, so acks never overtake claims
+            ack_writes.append(asyncio.ensure_future(run_db(ack_broadcast_recipients, job_id, acks[:])))
+            acks.clear()
+    
+    if reporter:
+        reporter.start(result)
+    try:
+        await BroadcastEngine().run(
+            recipients(),
+            broadcast_sender(bot, job),
+            on_result=record,
+            result=result,
+            control=control,
+            on_skip=skipped.append
+        )
+    finally:
+        if reporter:
+            await reporter.stop()
+        ack_writes.append(asyncio.ensure_future(run_db(ack_broadcast_recipients, job_id, acks[:])))
+        if skipped:
+            ack_writes.append(asyncio.ensure_future(run_db(release_broadcast_recipients, job_id, skipped)))
+        await asyncio.gather(*ack_writes)
+    
+    if control.cancelled:
+        await run_db(finish_broadcast_job, job_id, 'cancelled')
+    elif not control.stopping:
+        await run_db(finish_broadcast_job, job_id)
+    return result
+
+def get_content_preview(message, limit: int = 100):
+    if message.text:
+        return message.text[:limit]
+    elif message.caption:
+        return message.caption[:limit]
+    return "Media message"
+
+def describe_broadcast_target(job: dict) -> Optional[str]:
+    """Human-readable audience of a job (None for all users)"""
+    if job['target_type'] == 'country':
+        return COUNTRIES.get(job['target_id'], job['target_id'])
+    if job['target_type'] == 'segment':
+        return describe_segment(json.loads(job['target_id']))
+    return None
+
+def get_broadcast_job_keyboard(job_id: int, paused: bool = False):
+    """Controls shown under a running broadcast"""
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("▶️ Resume", callback_data=f"job_resume_{job_id}") if paused
+            else InlineKeyboardButton("⏸ Pause", callback_data=f"job_pause_{job_id}"),
+            InlineKeyboardButton("🛑 Cancel", callback_data=f"job_cancel_{job_id}")
+        ],
+        [InlineKeyboardButton("🔄 Refresh", callback_data=f"job_view_{job_id}")],
+        [InlineKeyboardButton("📦 All Broadcast Jobs", callback_data="bcast_jobs")]
+    ])
+
+def format_broadcast_job(job: dict, control: Optional[BroadcastControl] = None):
+    """Status text for a broadcast job, using live counters while it is running"""
+    total = job['total_count'] or 0
+    successful, failed = job['sent_count'] or 0, job['failed_count'] or 0
+    if control and control.result:
+        successful, failed = control.result.successful, control.result.failed
+    processed = successful + failed
+    percentage = (processed / total * 100) if total else 0
+    
+    status = job['status']
+    if control:
+        status = 'paused' if control.paused else 'running'
+    
+    target = describe_broadcast_target(job) or 'All users'
+    
+    return (
+        f"📦 **BROADCAST #{job['id']}**\n\n"
+        f"🎯 Target: {target}\n"
+        + ("🌙 Delivery: local daytime, per country\n" if job['staggered'] else "") +
+        f"📌 Status: {BROADCAST_STATUS_LABELS.get(status, status)}\n"
+        f"📤 Progress: {processed}/{total} ({percentage:.1f}%)\n"
+        f"✅ Sent: {successful}\n"
+        f"❌ Failed: {failed}\n"
+        f"🕒 Created: {job['sent_at']}"
+    )
+
+BROADCAST_STATUS_LABELS = {
+    'running': '▶️ Running',
+    'paused': '⏸ Paused',
+    'completed': '✅ Completed',
+    'cancelled': '🛑 Cancelled'
+}
+
+async def execute_broadcast_job(bot, job_id: int, progress_msg=None, control: Optional[BroadcastControl] = None):
+    """Run a broadcast job, keeping `progress_msg` (if any) updated and finishing with the report"""
+    job = await run_db(get_broadcast_job, job_id)
+    total = job['total_count'] or 0
+    audience = describe_broadcast_target(job)
+    audience_line = None
+    if job['target_type'] == 'country':
+        audience_line = f"📍 Country: {audience}\n"
+    elif job['target_type'] == 'segment':
+        audience_line = f"🎯 Segment: {audience}\n"
+    control = control or BroadcastControl()
+    # A staggered job sends on its recipients' schedule, not as fast as it can: its ETA is
+    # the last recipient's send time, not the remaining count over the current rate
+    last_due = None
+    if job['staggered']:
+        last_due = await run_db(get_last_due_recipient, job_id)
+        last_due = datetime.strptime(last_due, '%Y-%m-%d %H:%M:%S') if last_due else None
+    
+    def render_progress(result: BroadcastResult, rate: float, eta: Optional[float]):
+        if job['staggered']:
+            eta = max(0.0, (last_due - datetime.utcnow()).total_seconds()) if last_due else None
+        percentage = (result.processed / total * 100) if total else 0
+        text = (
+            (f"📤 Broadcast #{job_id} to {audience}...\n" if audience else f"📤 Broadcast #{job_id}...\n") +
+            f"{result.processed}/{total} ({percentage:.1f}%)\n"
+            f"✅ {result.successful} successful · ❌ {result.failed} failed\n"
+        )
+        if control.paused:
+            text += "⏸ Paused"
+        else:
+            text += f"⚡ {rate:.1f} msgs/s · ⏳ ETA {format_duration(eta) if eta is not None else '—'}"
+        return text, get_broadcast_job_keyboard(job_id, control.paused)
+    
+    reporter = ProgressReporter(progress_msg, render_progress, control) if progress_msg else None
+    result = await run_broadcast_job(bot, job_id, reporter=reporter, control=control)
+    
+    if not progress_msg or control.stopping:
+        return
+    
+    if control.cancelled:
+        report = "🛑 **BROADCAST CANCELLED**\n\n"
+    elif job['target_type'] == 'country':
+        report = "✅ **COUNTRY BROADCAST COMPLETED**\n\n"
+    elif job['target_type'] == 'segment':
+        report = "✅ **SEGMENT BROADCAST COMPLETED**\n\n"
+    else:
+        report = "✅ **BROADCAST COMPLETED**\n\n"
+    if audience_line:
+        report += audience_line
+    
+    report += (
+        f"📊 **Results:**\n"
+        f"• Total users: {total}\n"
+        f"• Successfully sent: {result.successful}\n"
+        f"• Failed: {result.failed}\n"
+        f"• Success rate: {(result.successful / total * 100) if total else 0:.1f}%\n\n"
+        f"📝 Broadcast #{job_id} saved in database."
+    )
+    
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="back_to_admin")]
+    ])
+    
+    try:
+        await progress_msg.edit_text(report, reply_markup=keyboard)
+    except TelegramError as e:
+        logger.warning(f"Could not post report for broadcast #{job_id}: {e}")
+
+class BroadcastManager:
+    """Runs broadcast jobs as background tasks and lets admins control them by job ID"""
+    
+    def __init__(self):
+        self.active: Dict[int, tuple] = {}  # job_id -> (task, control)
+    
+    def submit(self, bot, job_id: int, progress_msg=None, paused: bool = False) -> BroadcastControl:
+        control = BroadcastControl(paused=paused)
+        task = asyncio.create_task(self.execute(bot, job_id, progress_msg, control))
+        self.active[job_id] = (task, control)
+        return control
+    
+    async def execute(self, bot, job_id: int, progress_msg, control: BroadcastControl):
+        try:
+            await execute_broadcast_job(bot, job_id, progress_msg, control)
+        except Exception as e:
+            logger.error(f"Broadcast #{job_id} crashed: {e}")
+        finally:
+            self.active.pop(job_id, None)
+    
+    def control(self, job_id: int) -> Optional[BroadcastControl]:
+        entry = self.active.get(job_id)
+        return entry[1] if entry else None
+    
+    async def pause(self, job_id: int) -> bool:
+        control = self.control(job_id)
+        if not control or control.halted:
+            return False
+        control.pause()
+        await run_db(set_broadcast_job_status, job_id, 'paused')
+        return True
+    
+    async def resume(self, job_id: int) -> bool:
+        control = self.control(job_id)
+        if not control or control.halted:
+            return False
+        control.resume()
+        await run_db(set_broadcast_job_status, job_id, 'running')
+        return True
+    
+    async def cancel(self, job_id: int) -> bool:
+        control = self.control(job_id)
+        if not control or control.halted:
+            return False
+        control.cancel()
+        return True
+    
+    async def shutdown(self):
+        """Stop all jobs at the next recipient; they stay resumable for the next start"""
+        for task, control in list(self.active.values()):
+            control.stop()
+        await asyncio.gather(*(task for task, _ in list(self.active.values())), return_exceptions=True)
+
+BROADCAST_MANAGER = BroadcastManager()
+
+class BroadcastScheduler:
+    """Fire scheduled broadcasts on time.
+    
+    SQLite holds the schedules; the process keeps a heap of (next_run_at, schedule_id)
+    and sleeps until the earliest entry. The heap is rebuilt from the database on start,
+    so schedules survive restarts. Stale entries (cancelled or rescheduled) are ignored
+    when they come due.
+    """
+    
+    def __init__(self):
+        self.heap: List[tuple] = []
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.application: Optional[Application] = None
+    
+    def add(self, schedule_id: int, run_at: datetime):
+        heapq.heappush(self.heap, (run_at, schedule_id))
+        if self.wakeup:
+            self.wakeup.set()
+    
+    async def start(self, application: Application):
+        self.application = application
+        self.wakeup = asyncio.Event()  # bind to the running loop
+        for schedule_id, next_run_at in await run_db(get_active_schedules):
+            self.add(schedule_id, datetime.strptime(next_run_at, '%Y-%m-%d %H:%M:%S'))
+        if self.heap:
+            print(f"⏰ {len(self.heap)} scheduled broadcast(s) loaded")
+        self.task = asyncio.create_task(self.run())
+    
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            now = datetime.utcnow()
+            while self.heap and self.heap[0][0] <= now:
+                run_at, schedule_id = heapq.heappop(self.heap)
+                await self.fire(schedule_id, run_at)
+            
+            timeout = (self.heap[0][0] - now).total_seconds() if self.heap else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def fire(self, schedule_id: int, run_at: datetime):
+        try:
+            fired = await run_db(fire_scheduled_broadcast, schedule_id, run_at.strftime('%Y-%m-%d %H:%M:%S'))
+        except Exception as e:
+            logger.error(f"Scheduled broadcast #{schedule_id} could not start: {e}")
+            return
+        if fired is None:
+            return
+        
+        schedule, job_id, total, next_run_at = fired
+        if next_run_at:
+            self.add(schedule_id, next_run_at)
+        print(f"⏰ Scheduled broadcast #{schedule_id} fired: job #{job_id}, {total} recipients")
+        
+        bot = self.application.bot
+        text = f"⏰ Scheduled broadcast #{schedule_id} started as job #{job_id}\n0/{total} (0%)"
+        if next_run_at:
+            text += f"\nNext run: {utc_to_local(next_run_at):%Y-%m-%d %H:%M} ({SCHEDULER_TIMEZONE.key})"
+        
+        if total == 0:
+            await run_db(finish_broadcast_job, job_id)
+            text = f"⏰ Scheduled broadcast #{schedule_id}: no users matched, nothing sent."
+        try:
+            progress_msg = await bot.send_message(
+                chat_id=schedule['admin_id'],
+                text=text,
+                reply_markup=get_broadcast_job_keyboard(job_id) if total else None
+            )
+        except TelegramError as e:
+            logger.warning(f"Could not notify admin about scheduled broadcast #{schedule_id}: {e}")
+            progress_msg = None
+        
+        if total:
+            BROADCAST_MANAGER.submit(bot, job_id, progress_msg)
+    
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+BROADCAST_SCHEDULER = BroadcastScheduler()
+
+async def resume_broadcast_jobs(application: Application):
+    """Continue broadcast jobs that were interrupted by a restart (paused ones stay paused)"""
+    for job_id, status in await run_db(get_unfinished_broadcast_jobs):
+        await run_db(recover_broadcast_job, job_id)
+        job = await run_db(get_broadcast_job, job_id)
+        done = job['sent_count'] + job['failed_count']
+        print(f"♻️ Resuming broadcast #{job_id} ({done}/{job['total_count']} done, {status})")
+        
+        try:
+            progress_msg = await application.bot.send_message(
+                chat_id=job['admin_id'],
+                text=f"♻️ Resuming broadcast #{job_id} after restart...\n{done}/{job['total_count']} already processed",
+                reply_markup=get_broadcast_job_keyboard(job_id, status == 'paused')
+            )
+        except TelegramError as e:
+            logger.error(f"Could not notify admin about resumed broadcast #{job_id}: {e}")
+            progress_msg = None
+        
+        BROADCAST_MANAGER.submit(application.bot, job_id, progress_msg, paused=(status == 'paused'))
+
 # ========== HANDLERS ==========
+@instrumented
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     user_name = update.effective_user.full_name
@@ -388,27 +2645,30 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if user_id in ADMIN_IDS:
         await update.message.reply_text(
             f"👑 Welcome To Admin Panel {user_name}!\nUse click /admin to get access for admin panel.",
-            reply_markup=get_main_menu_keyboard()
+            reply_markup=MAIN_MENU_KEYBOARD
         )
         return ConversationHandler.END
     
-    existing_user = get_user(user_id)
+    existing_user = await load_user(user_id)
     if existing_user:
+        if existing_user.get('delivery_status', 'ok') != 'ok':
+            await run_db(reactivate_user, user_id)
         await update.message.reply_text(
             f"👋 Welcome back {user_name}!\nUse the menu below:",
-            reply_markup=get_main_menu_keyboard()
+            reply_markup=MAIN_MENU_KEYBOARD
         )
         return ConversationHandler.END
     
     await update.message.reply_text(
         f"👋 Hello {user_name}!\n\nWelcome to **Affiliate Support Bot**!\n\n"
         "To access our affiliate program, please share your phone number:",
-        reply_markup=get_phone_keyboard()
+        reply_markup=PHONE_KEYBOARD
     )
     
-    save_user_state(user_id, 'phone')
+    STATE_STORE.save(user_id, 'phone')
     return PHONE
 
+@instrumented
 async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
@@ -418,20 +2678,21 @@ async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         print(f"📱 Contact received: {name} - {phone}")
         
-        save_user_state(user_id, 'language', f"{name}|{phone}")
+        STATE_STORE.save(user_id, 'language', f"{name}|{phone}")
         
         await update.message.reply_text(
             "✅ Phone number verified!\n\nPlease select your preferred language:",
-            reply_markup=get_language_keyboard()
+            reply_markup=LANGUAGE_KEYBOARD
         )
         return LANGUAGE
     
     await update.message.reply_text(
         "⚠️ Please use the 'Share Contact' button to continue.",
-        reply_markup=get_phone_keyboard()
+        reply_markup=PHONE_KEYBOARD
     )
     return PHONE
 
+@instrumented
 async def handle_language_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -439,36 +2700,48 @@ async def handle_language_selection(update: Update, context: ContextTypes.DEFAUL
     user_id = update.effective_user.id
     language_code = query.data.replace('lang_', '')
     
-    state = get_user_state(user_id)
+    state = STATE_STORE.get(user_id)
     if not state:
         await query.edit_message_text("Session expired. Please send /start again.")
         return ConversationHandler.END
     
     name, phone = state['data'].split('|')
-    save_user_state(user_id, 'country', f"{name}|{phone}|{language_code}")
+    STATE_STORE.save(user_id, 'country', f"{name}|{phone}|{language_code}")
     
     await query.edit_message_text(
         f"✅ Language selected: {LANGUAGES[language_code]}\n\nNow select your country:",
-        reply_markup=get_country_keyboard()
+        reply_markup=COUNTRY_KEYBOARD
     )
     return COUNTRY
 
+@instrumented
 async def handle_country_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
-    
     user_id = update.effective_user.id
     country_code = query.data.replace('country_', '')
     
-    state = get_user_state(user_id)
+    state = STATE_STORE.get(user_id)
     if not state:
+        await query.answer()
         await query.edit_message_text("Session expired. Please send /start again.")
         return ConversationHandler.END
     
     name, phone, language_code = state['data'].split('|')
     
-    save_user(user_id, name, phone, language_code, country_code)
-    clear_user_state(user_id)
+    # Forget the state before save_user deletes its snapshot row, so no later flush writes
+    # it back. One commit (user, stats, state snapshot) while the callback is being answered.
+    STATE_STORE.discard(user_id)
+    answered, saved = await asyncio.gather(
+        query.answer(), run_db(save_user, user_id, name, phone, language_code, country_code),
+        return_exceptions=True
+    )
+    if isinstance(saved, BaseException):
+        # Nothing was saved: keep the state so the user can pick the country again
+        STATE_STORE.save(user_id, state['state'], state['data'])
+        raise saved
+    if isinstance(answered, BaseException):
+        # Only the button spinner is affected; the user is registered and still gets confirmed
+        logger.warning(f"Failed to answer country selection for {user_id}: {answered}")
     
     offer = COUNTRY_OFFERS.get(country_code, "Welcome to our affiliate program!")
     
@@ -481,12 +2754,13 @@ async def handle_country_selection(update: Update, context: ContextTypes.DEFAULT
         f"{offer}\n\n👇 Use the menu below to get started:"
     )
     
-    await notify_admins(context.application, user_id, name, phone, language_code, country_code)
+    notify_admins(user_id, name, phone, language_code, country_code)
     await show_main_menu(update, context)
     
     return ConversationHandler.END
 
-async def notify_admins(application, user_id: int, name: str, phone: str, language: str, country: str):
+def notify_admins(user_id: int, name: str, phone: str, language: str, country: str):
+    """Queue the new-registration notice; ADMIN_NOTIFIER delivers it in the background"""
     message = (
         "🆕 **NEW USER REGISTERED**\n\n"
         f"👤 Name: {name}\n"
@@ -497,19 +2771,10 @@ async def notify_admins(application, user_id: int, name: str, phone: str, langua
         f"⏰ Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
     )
     
-    for admin_id in ADMIN_IDS:
-        try:
-            await application.bot.send_message(
-                chat_id=admin_id,
-                text=message,
-                parse_mode='Markdown'
-            )
-            print(f"✅ Notified admin {admin_id} about new user")
-        except Exception as e:
-            print(f"❌ Failed to notify admin {admin_id}: {e}")
+    ADMIN_NOTIFIER.submit(message, parse_mode='Markdown')
 
 async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = get_main_menu_keyboard()
+    keyboard = MAIN_MENU_KEYBOARD
     
     if update.callback_query:
         await update.callback_query.message.reply_text(
@@ -522,29 +2787,17 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=keyboard
         )
 
+@instrumented
 async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
     user_id = update.effective_user.id
     
-    update_user_activity(user_id)
+    ACTIVITY_BUFFER.touch(user_id)
     
     if text == "📞 Contact Local Manager":
-        user = get_user(user_id)
+        user = await load_user(user_id)
         if user:
-            country = user.get('country', 'ENG')
-            country_name = COUNTRIES.get(country, 'Your Country')
-            
-            # Get the country-specific manager username
-            manager_username = COUNTRY_MANAGERS.get(country, '@Default_Manager')
-            
-            await update.message.reply_text(
-                f"📞 **Contact Local Manager**\n\n"
-                f"📍 Region: {country_name}\n"
-                f"👤 Manager: {manager_username}\n\n"
-                f"Please contact our local manager directly on Telegram:\n"
-                f"👉 {manager_username}\n\n"
-                f"*Note: Click the username above to start chatting*"
-            )
+            await update.message.reply_text(manager_contact_text(user.get('country', 'ENG')))
         else:
             await update.message.reply_text("Please register first with /start")
     
@@ -556,41 +2809,17 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def show_program_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user = get_user(user_id)
+    user = await load_user(user_id)
     
     if user:
-        country = user.get('country', 'ENG')
-        offer = COUNTRY_OFFERS.get(country, COUNTRY_OFFERS['ENG'])
-        
-        # Get the country-specific manager username
-        manager_username = COUNTRY_MANAGERS.get(country, '@Default_Manager')
-        
-        await update.message.reply_text(
-            f"📊 **AFFILIATE PROGRAM DETAILS**\n\n"
-            f"{offer}\n\n"
-            f"💡 **General Features:**\n"
-            f"• Real-time tracking dashboard\n"
-            f"• Marketing materials provided\n"
-            f"• Dedicated support team\n"
-            f"• Weekly training sessions\n"
-            f"• Performance bonuses\n\n"
-            f"📞 **Contact your local manager:**\n"
-            f"{manager_username}"
-        )
+        await update.message.reply_text(program_details_text(user.get('country', 'ENG')))
     else:
-        await update.message.reply_text(
-            "📊 **AFFILIATE PROGRAM**\n\n"
-            "Join our global affiliate network!\n\n"
-            "• Commission: upto 50%\n"
-            "• Weekly payments\n"
-            "• Marketing tools provided\n"
-            "• 24/7 support\n\n"
-            "Register with /start to see country-specific offers!"
-        )
+        await update.message.reply_text(GUEST_PROGRAM_TEXT)
 
+@instrumented
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    clear_user_state(user_id)
+    STATE_STORE.clear(user_id)
     
     if context.user_data.get('admin_mode'):
         context.user_data.clear()
@@ -599,6 +2828,7 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 # ========== ADMIN HANDLERS ==========
+@instrumented
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
@@ -609,17 +2839,53 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
     context.user_data['admin_mode'] = True
     
-    total_users = get_total_users()
+    total_users = await run_db(get_total_users)
     
     await update.message.reply_text(
         f"👑 **ADMIN PANEL**\n\n"
         f"Welcome, Admin {user_id}!\n"
         f"Total Users: {total_users}\n\n"
         f"Select an option:",
-        reply_markup=get_admin_keyboard()
+        reply_markup=ADMIN_KEYBOARD
     )
     return ConversationHandler.END
 
+@instrumented
+async def broadcast_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show or change broadcast concurrency/rate: /broadcast_settings [concurrency] [rate]"""
+    user_id = update.effective_user.id
+
+    if user_id not in ADMIN_IDS:
+        await update.message.reply_text("❌ Access denied. You are not an admin.")
+        return
+
+    if context.args:
+        try:
+            concurrency = int(context.args[0])
+            rate = float(context.args[1]) if len(context.args) > 1 else BROADCAST_SETTINGS['rate']
+            if not 1 <= concurrency <= 100 or not math.isfinite(rate) or not 1 <= rate <= 30:
+                raise ValueError
+        except ValueError:
+            await update.message.reply_text(
+                "❌ Usage: /broadcast_settings <concurrency 1-100> <rate 1-30 msgs/sec>\n"
+                "Example: /broadcast_settings 20 25"
+            )
+            return
+
+        BROADCAST_SETTINGS['concurrency'] = concurrency
+        BROADCAST_SETTINGS['rate'] = rate
+        BROADCAST_LIMITER.set_rate(rate)
+
+    await update.message.reply_text(
+        f"⚙️ **BROADCAST SETTINGS**\n\n"
+        f"👷 Concurrency: {BROADCAST_SETTINGS['concurrency']} workers\n"
+        f"🚦 Rate: {BROADCAST_SETTINGS['rate']} msgs/sec\n"
+        f"🔁 Flood retries: {BROADCAST_SETTINGS['max_retries']}\n"
+        f"📝 Progress updates: every {BROADCAST_SETTINGS['progress_interval']:g}s\n\n"
+        f"Change with: /broadcast_settings <concurrency> <rate>"
+    )
+
+@instrumented
 async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle admin callback queries"""
     query = update.callback_query
@@ -658,38 +2924,45 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
     
     elif query.data == "view_users_select":
         # Show user list with pagination
-        users = get_all_users()
-        total_users = len(users)
+        total_users = await run_db(get_total_users)
         
         if total_users == 0:
             await query.edit_message_text("📋 No users registered yet.")
             return
         
+        page_users, has_next = await run_db(get_users_page, USERS_PER_PAGE)
+        
         await query.edit_message_text(
             f"📋 **SELECT USER TO MESSAGE**\n\n"
             f"Total Users: {total_users}\n"
             f"Click on any user below to send them a direct message:",
-            reply_markup=get_user_list_keyboard(page=0)
+            reply_markup=get_user_list_keyboard(0, page_users, has_next, total_users)
         )
     
     elif query.data.startswith("user_page_"):
         # Handle pagination for user list
-        page = int(query.data.replace('user_page_', ''))
-        users = get_all_users()
-        total_users = len(users)
+        page, direction, cursor = parse_user_page_callback(query.data)
+        total_users = await run_db(get_total_users)
+        page_users, has_more = await run_db(get_users_page, USERS_PER_PAGE, cursor, direction)
+        
+        if not page_users:
+            # The list changed under us; start again from the newest users
+            page = 0
+            page_users, has_more = await run_db(get_users_page, USERS_PER_PAGE)
+            direction = 'n'
         
         await query.edit_message_text(
             f"📋 **SELECT USER TO MESSAGE**\n\n"
             f"Total Users: {total_users}\n"
-            f"Page: {page + 1}/{(total_users-1)//10 + 1}\n"
+            f"Page: {page + 1}/{(total_users-1)//USERS_PER_PAGE + 1}\n"
             f"Click on any user below to send them a direct message:",
-            reply_markup=get_user_list_keyboard(page=page)
+            reply_markup=get_user_list_keyboard(page, page_users, has_more if direction == 'n' else True, total_users)
         )
     
     elif query.data.startswith("select_user_"):
         # User selected from list
         selected_user_id = int(query.data.replace('select_user_', ''))
-        selected_user = get_user(selected_user_id)
+        selected_user = await load_user(selected_user_id)
         
         if not selected_user:
             await query.answer("❌ User not found!", show_alert=True)
@@ -723,7 +2996,7 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
         await query.edit_message_text(
             "🌍 **SEND MESSAGE BY COUNTRY**\n\n"
             "Select the country you want to send message to:",
-            reply_markup=get_country_selection_keyboard()
+            reply_markup=COUNTRY_SELECTION_KEYBOARD
         )
     
     elif query.data.startswith("bcast_country_"):
@@ -735,8 +3008,7 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
         context.user_data['awaiting_country'] = False
         context.user_data['awaiting_message'] = True
         
-        users_in_country = get_users_by_country(country_code)
-        user_count = len(users_in_country)
+        user_count = await run_db(count_audience, 'country', country_code)
         
         await query.edit_message_text(
             f"✅ Country selected: {country_name}\n"
@@ -751,26 +3023,34 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
         )
     
     elif query.data == "view_stats":
-        total = get_total_users()
-        users = get_all_users()
-        
-        country_stats = {}
-        for user in users:
-            country = user.get('country', 'Unknown')
-            country_stats[country] = country_stats.get(country, 0) + 1
+        country_stats = await run_db(get_country_stats)
+        total = sum(count for _, count in country_stats)
         
         stats_text = "📊 **USER STATISTICS**\n\n"
         stats_text += f"👥 Total Users: {total}\n"
         
         if total > 0:
             stats_text += "🌍 **Users by Country:**\n"
-            for country, count in sorted(country_stats.items(), key=lambda x: x[1], reverse=True):
-                country_name = COUNTRIES.get(country, country)
+            for country, count in country_stats:
+                country_name = COUNTRIES.get(country, country or 'Unknown')
                 percentage = (count / total) * 100
                 stats_text += f"• {country_name}: {count} ({percentage:.1f}%)\n"
         else:
             stats_text += "\nNo users registered yet."
         
+        undeliverable = await run_db(get_undeliverable_counts)
+        if undeliverable:
+            stats_text += (
+                f"\n🚫 Unreachable (skipped by broadcasts): {sum(undeliverable.values())} "
+                f"({undeliverable.get('blocked', 0)} blocked, {undeliverable.get('not_found', 0)} chat not found)\n"
+            )
+        
+        cache = USER_CACHE.stats()
+        stats_text += (
+            f"\n⚡ Profile cache: {cache['hits']} hits / {cache['misses']} misses "
+            f"({cache['hit_rate']:.1f}%), {cache['size']} cached"
+        )
+        
         keyboard = InlineKeyboardMarkup([
             [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="back_to_admin")]
         ])
@@ -778,13 +3058,15 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
         await query.edit_message_text(stats_text, reply_markup=keyboard)
     
     elif query.data == "view_users":
-        users = get_all_users()
-        if not users:
+        total_users = await run_db(get_total_users)
+        if not total_users:
             await query.edit_message_text("📋 No users registered yet.")
             return
         
+        users, _ = await run_db(get_users_page, 10)
+        
         message = "📋 **REGISTERED USERS**\n\n"
-        for i, user in enumerate(users[:10], 1):
+        for i, user in enumerate(users, 1):
             country = COUNTRIES.get(user.get('country', 'Unknown'), user.get('country', 'Unknown'))
             reg_date = datetime.strptime(user['registered_at'], '%Y-%m-%d %H:%M:%S').strftime('%d/%m/%Y')
             message += f"{i}. **{user['name']}**\n"
@@ -793,8 +3075,8 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
             message += f"   📱 {user.get('phone', 'N/A')}\n"
             message += f"   📅 Registered: {reg_date}\n\n"
         
-        if len(users) > 10:
-            message += f"📄 ... and {len(users)-10} more users"
+        if total_users > 10:
+            message += f"📄 ... and {total_users-10} more users"
         
         keyboard = InlineKeyboardMarkup([
             [InlineKeyboardButton("📋 View User List (Select by Name)", callback_data="view_users_select")],
@@ -803,22 +3085,170 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
         
         await query.edit_message_text(message, reply_markup=keyboard)
     
-    elif query.data == "close_admin":
-        context.user_data.clear()
-        await query.edit_message_text("✅ Admin panel closed.")
-        await show_main_menu(update, context)
+    elif query.data == "close_admin":
+        context.user_data.clear()
+        await query.edit_message_text("✅ Admin panel closed.")
+        await show_main_menu(update, context)
+    
+    elif query.data == "back_to_admin":
+        total_users = await run_db(get_total_users)
+        
+        await query.edit_message_text(
+            f"👑 **ADMIN PANEL**\n\n"
+            f"Welcome, Admin {user_id}!\n"
+            f"Total Users: {total_users}\n\n"
+            f"Select an option:",
+            reply_markup=ADMIN_KEYBOARD
+        )
+
+def broadcast_target(user_data: dict) -> tuple:
+    """(target_type, target_id, message_type) of the broadcast being composed"""
+    broadcast_type = user_data.get('broadcast_type')
+    if broadcast_type == 'country':
+        return 'country', user_data['selected_country'], 'country_broadcast'
+    if broadcast_type == 'segment':
+        return 'segment', json.dumps(user_data.get('segment') or {}, sort_keys=True), 'segment_broadcast'
+    return 'all', 'all', 'broadcast'
+
+async def segment_builder_text(segment: dict):
+    """Builder screen text and the live audience size"""
+    audience_size = await run_db(count_segment, segment)
+    registered = 'Any time'
+    if segment.get('registered_days'):
+        registered = f"within {segment['registered_days']} days"
+    elif segment.get('registered_from') or segment.get('registered_to'):
+        registered = f"{segment.get('registered_from') or '…'} → {segment.get('registered_to') or '…'}"
+    
+    text = (
+        f"🎯 **SEGMENT BROADCAST**\n\n"
+        f"🌍 Countries: {', '.join(COUNTRIES.get(c, c) for c in segment.get('countries', [])) or 'Any'}\n"
+        f"🗣 Languages: {', '.join(LANGUAGES.get(l, l) for l in segment.get('languages', [])) or 'Any'}\n"
+        f"📅 Registered: {registered}\n"
+        f"⏱ Last active: {'within ' + str(segment['active_days']) + ' days' if segment.get('active_days') else 'Any time'}\n\n"
+        f"👥 Matching users: {audience_size}"
+    )
+    return text, audience_size
+
+@instrumented
+async def handle_segment_builder(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Combine audience filters for a segment broadcast"""
+    query = update.callback_query
+    
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        await query.answer("❌ Access denied.")
+        return
+    
+    segment = context.user_data.setdefault('segment', {})
+    data = query.data
+    
+    if data == "seg_countries" or data.startswith("seg_tc_"):
+        if data.startswith("seg_tc_"):
+            code = data.replace('seg_tc_', '')
+            selected = segment.setdefault('countries', [])
+            if code in selected:
+                selected.remove(code)
+            else:
+                selected.append(code)
+        await query.answer()
+        await query.edit_message_text(
+            "🌍 Select one or more countries (none = any):",
+            reply_markup=get_segment_toggle_keyboard('seg_tc_', COUNTRIES, segment.get('countries', []))
+        )
+        return
+    
+    if data == "seg_languages" or data.startswith("seg_tl_"):
+        if data.startswith("seg_tl_"):
+            code = data.replace('seg_tl_', '')
+            selected = segment.setdefault('languages', [])
+            if code in selected:
+                selected.remove(code)
+            else:
+                selected.append(code)
+        await query.answer()
+        await query.edit_message_text(
+            "🗣 Select one or more languages (none = any):",
+            reply_markup=get_segment_toggle_keyboard('seg_tl_', LANGUAGES, segment.get('languages', []))
+        )
+        return
+    
+    if data == "seg_registered":
+        await query.answer()
+        await query.edit_message_text("📅 Users registered:", reply_markup=get_segment_registered_keyboard())
+        return
     
-    elif query.data == "back_to_admin":
-        total_users = get_total_users()
+    if data == "seg_reg_custom":
+        await query.answer()
+        context.user_data['awaiting_segment_dates'] = True
+        await query.edit_message_text(
+            "✏️ Send the registration date range as two dates:\n"
+            "`YYYY-MM-DD YYYY-MM-DD`\n\n"
+            "Use `-` for an open end, e.g. `2026-01-01 -`\n\n"
+            "To cancel, send /cancel"
+        )
+        return
+    
+    if data == "seg_active":
+        await query.answer()
+        await query.edit_message_text("⏱ Users last active:", reply_markup=get_segment_active_keyboard())
+        return
+    
+    if data.startswith("seg_reg_"):
+        value = data.replace('seg_reg_', '')
+        segment.pop('registered_from', None)
+        segment.pop('registered_to', None)
+        segment.pop('registered_days', None)
+        if value != 'any':
+            segment['registered_days'] = int(value)
+    elif data.startswith("seg_act_"):
+        value = data.replace('seg_act_', '')
+        segment.pop('active_days', None)
+        if value != 'any':
+            segment['active_days'] = int(value)
+    elif data == "seg_reset":
+        segment.clear()
+    elif data == "seg_next":
+        audience_size = await run_db(count_segment, segment)
+        if audience_size == 0:
+            await query.answer("❌ No users match this segment.", show_alert=True)
+            return
+        await query.answer()
         
+        context.user_data['awaiting_message'] = True
+        context.user_data['broadcast_type'] = 'segment'
         await query.edit_message_text(
-            f"👑 **ADMIN PANEL**\n\n"
-            f"Welcome, Admin {user_id}!\n"
-            f"Total Users: {total_users}\n\n"
-            f"Select an option:",
-            reply_markup=get_admin_keyboard()
+            f"✅ Segment: {describe_segment(segment)}\n"
+            f"👥 Matching users: {audience_size}\n\n"
+            "Now send the message you want to broadcast to this segment:\n\n"
+            "You can send:\n"
+            "• Text message\n"
+            "• Photo with caption\n"
+            "• Video with caption\n"
+            "• Document\n\n"
+            "To cancel, send /cancel"
         )
+        return
+    
+    await query.answer()
+    text, audience_size = await segment_builder_text(segment)
+    await query.edit_message_text(text, reply_markup=get_segment_keyboard(audience_size))
 
+def parse_segment_dates(text: str) -> tuple:
+    """'YYYY-MM-DD YYYY-MM-DD' ('-' for an open end) -> (from, to); raises ValueError"""
+    parts = text.split()
+    if len(parts) != 2:
+        raise ValueError
+    dates = []
+    for part in parts:
+        if part == '-':
+            dates.append(None)
+        else:
+            dates.append(datetime.strptime(part, '%Y-%m-%d').strftime('%Y-%m-%d'))
+    if dates[0] and dates[1] and dates[0] > dates[1]:
+        raise ValueError
+    return dates[0], dates[1]
+
+@instrumented
 async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle ALL admin messages - COMPLETELY FIXED VERSION"""
     user_id = update.effective_user.id
@@ -830,6 +3260,11 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
     if update.message.text and update.message.text.startswith('/'):
         return
     
+    # Admins get the main menu too (handle_main_menu does not see admin chats)
+    if update.message.text in MAIN_MENU_TEXTS:
+        await handle_main_menu(update, context)
+        return
+    
     # Handle user ID input for specific user
     if context.user_data.get('awaiting_user_id'):
         try:
@@ -854,7 +3289,7 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
                 return
             
             target_user_id = int(digits_only)
-            user = get_user(target_user_id)
+            user = await load_user(target_user_id)
             
             if not user:
                 await update.message.reply_text(
@@ -891,14 +3326,80 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
             )
             return
     
+    # Handle the time of a scheduled broadcast
+    if context.user_data.get('awaiting_schedule'):
+        try:
+            next_run_at, schedule = parse_schedule_input(update.message.text or '')
+        except ValueError as e:
+            await update.message.reply_text(
+                f"❌ Could not read that schedule ({e}).\n"
+                f"Send `YYYY-MM-DD HH:MM` or a cron expression like `0 3 * * 1`.\n\n"
+                f"To cancel, send /cancel"
+            )
+            return
+        
+        broadcast_message = context.user_data['broadcast_message']
+        target_type, target_id, message_type = broadcast_target(context.user_data)
+        schedule_id = await run_db(
+            create_scheduled_broadcast,
+            admin_id=user_id,
+            target_type=target_type,
+            target_id=target_id,
+            message_type=message_type,
+            content=get_content_preview(broadcast_message),
+            from_chat_id=broadcast_message.chat_id,
+            message_id=broadcast_message.message_id,
+            media=extract_broadcast_media(broadcast_message),
+            schedule=schedule,
+            next_run_at=next_run_at
+        )
+        BROADCAST_SCHEDULER.add(schedule_id, next_run_at)
+        
+        await update.message.reply_text(
+            f"✅ **BROADCAST SCHEDULED** (#{schedule_id})\n\n"
+            f"🎯 Target: {describe_broadcast_target({'target_type': target_type, 'target_id': target_id}) or 'All users'}\n"
+            f"⏰ {'Repeats: `' + schedule + '`' if schedule else 'Once'}\n"
+            f"▶️ First run: {utc_to_local(next_run_at):%Y-%m-%d %H:%M} ({SCHEDULER_TIMEZONE.key})",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("⏰ Scheduled Broadcasts", callback_data="sched_list")],
+                [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="back_to_admin")]
+            ])
+        )
+        context.user_data.clear()
+        return
+    
+    # Handle custom registration range of a segment
+    if context.user_data.get('awaiting_segment_dates'):
+        try:
+            registered_from, registered_to = parse_segment_dates(update.message.text or '')
+        except ValueError:
+            await update.message.reply_text(
+                "❌ Please send two dates like `2026-01-01 2026-03-31` (use `-` for an open end).\n\n"
+                "To cancel, send /cancel"
+            )
+            return
+        
+        context.user_data['awaiting_segment_dates'] = False
+        segment = context.user_data.setdefault('segment', {})
+        segment.pop('registered_from', None)
+        segment.pop('registered_to', None)
+        segment.pop('registered_days', None)
+        if registered_from:
+            segment['registered_from'] = registered_from
+        if registered_to:
+            segment['registered_to'] = registered_to
+        
+        text, audience_size = await segment_builder_text(segment)
+        await update.message.reply_text(text, reply_markup=get_segment_keyboard(audience_size))
+        return
+    
     # Handle message input for broadcast
     if context.user_data.get('awaiting_message'):
         broadcast_type = context.user_data.get('broadcast_type')
         
         if broadcast_type == 'all':
             # Broadcast to all users
-            users = get_all_users()
-            total_users = len(users)
+            total_users = await run_db(count_audience, 'all')
             
             if total_users == 0:
                 await update.message.reply_text("❌ No users to broadcast to.")
@@ -1009,8 +3510,7 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
                 context.user_data.clear()
                 return
             
-            users = get_users_by_country(country_code)
-            total_users = len(users)
+            total_users = await run_db(count_audience, 'country', country_code)
             
             if total_users == 0:
                 await update.message.reply_text(
@@ -1046,11 +3546,33 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
                 reply_markup=get_country_broadcast_confirm_keyboard()
             )
         
+        elif broadcast_type == 'segment':
+            segment = context.user_data.get('segment') or {}
+            total_users = await run_db(count_segment, segment)
+            
+            if total_users == 0:
+                await update.message.reply_text("❌ No users match this segment anymore.")
+                context.user_data.clear()
+                return
+            
+            context.user_data['broadcast_message'] = update.message
+            
+            await update.message.reply_text(
+                f"⚠️ **CONFIRM SEGMENT BROADCAST**\n\n"
+                f"🎯 {describe_segment(segment)}\n\n"
+                f"Send this message to {total_users} users?\n\n"
+                f"**Message Preview:**\n"
+                f"{get_content_preview(update.message, 200)}...\n\n"
+                f"This action cannot be undone!",
+                reply_markup=get_segment_broadcast_confirm_keyboard()
+            )
+        
         return
     
     # If no special state, show admin panel
     await admin_panel(update, context)
 
+@instrumented
 async def handle_broadcast_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle broadcast confirmation"""
     query = update.callback_query
@@ -1063,73 +3585,35 @@ async def handle_broadcast_confirmation(update: Update, context: ContextTypes.DE
     if query.data == "confirm_send":
         # Broadcast to all users
         broadcast_message = context.user_data.get('broadcast_message')
-        users = get_all_users()
         
-        if not broadcast_message or not users:
+        if not broadcast_message:
             await query.edit_message_text("❌ Broadcast data not found.")
             return
         
-        total = len(users)
-        successful = 0
-        failed = 0
-        
-        progress_msg = await query.message.reply_text(f"📤 Starting broadcast...\n0/{total} (0%)")
-        
-        for i, user in enumerate(users, 1):
-            try:
-                await context.bot.copy_message(
-                    chat_id=user['user_id'],
-                    from_chat_id=broadcast_message.chat_id,
-                    message_id=broadcast_message.message_id
-                )
-                successful += 1
-                
-                if i % 5 == 0 or i == total:
-                    percentage = (i / total) * 100
-                    await progress_msg.edit_text(
-                        f"📤 Broadcasting...\n"
-                        f"{i}/{total} ({percentage:.1f}%)\n"
-                        f"✅ {successful} successful"
-                    )
-                    
-            except Exception as e:
-                failed += 1
-                logger.error(f"Failed to send to user {user['user_id']}: {e}")
-        
-        content_preview = ""
-        if broadcast_message.text:
-            content_preview = broadcast_message.text[:100]
-        elif broadcast_message.caption:
-            content_preview = broadcast_message.caption[:100]
-        else:
-            content_preview = "Media message"
-            
-        save_broadcast(
+        job_id, total = await run_db(
+            create_broadcast_job,
             admin_id=user_id,
             target_type='all',
             target_id='all',
             message_type='broadcast',
-            content=content_preview,
-            sent_count=successful,
-            failed_count=failed
+            content=get_content_preview(broadcast_message),
+            from_chat_id=broadcast_message.chat_id,
+            message_id=broadcast_message.message_id,
+            media=extract_broadcast_media(broadcast_message)
         )
         
-        report = (
-            f"✅ **BROADCAST COMPLETED**\n\n"
-            f"📊 **Results:**\n"
-            f"• Total users: {total}\n"
-            f"• Successfully sent: {successful}\n"
-            f"• Failed: {failed}\n"
-            f"• Success rate: {(successful/total*100):.1f}%\n\n"
-            f"📝 Message preview saved in database."
-        )
+        if total == 0:
+            await run_db(finish_broadcast_job, job_id)
+            await query.edit_message_text("❌ Broadcast data not found.")
+            return
         
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="back_to_admin")]
-        ])
+        progress_msg = await query.edit_message_text(
+            f"📤 Broadcast #{job_id} started in the background...\n0/{total} (0%)\n\n"
+            f"Job ID: #{job_id} — manage it from 📦 Broadcast Jobs in the admin panel.",
+            reply_markup=get_broadcast_job_keyboard(job_id)
+        )
         
-        await progress_msg.edit_text(report, reply_markup=keyboard)
-        await query.message.delete()
+        BROADCAST_MANAGER.submit(context.bot, job_id, progress_msg)
         
         context.user_data.clear()
     
@@ -1158,7 +3642,8 @@ async def handle_broadcast_confirmation(update: Update, context: ContextTypes.DE
             else:
                 content_preview = "Media message"
                 
-            save_broadcast(
+            await run_db(
+                save_broadcast,
                 admin_id=user_id,
                 target_type='specific',
                 target_id=str(target_user_id),
@@ -1175,6 +3660,9 @@ async def handle_broadcast_confirmation(update: Update, context: ContextTypes.DE
             )
             
         except Exception as e:
+            undeliverable = classify_delivery_error(e)
+            if undeliverable:
+                await run_db(set_user_undeliverable, target_user_id, undeliverable)
             await query.edit_message_text(
                 f"❌ **FAILED TO SEND MESSAGE**\n\n"
                 f"Error: {str(e)}\n\n"
@@ -1208,7 +3696,8 @@ async def handle_broadcast_confirmation(update: Update, context: ContextTypes.DE
             else:
                 content_preview = "Media message"
                 
-            save_broadcast(
+            await run_db(
+                save_broadcast,
                 admin_id=user_id,
                 target_type='specific',
                 target_id=str(selected_user_id),
@@ -1225,6 +3714,9 @@ async def handle_broadcast_confirmation(update: Update, context: ContextTypes.DE
             )
             
         except Exception as e:
+            undeliverable = classify_delivery_error(e)
+            if undeliverable:
+                await run_db(set_user_undeliverable, selected_user_id, undeliverable)
             await query.edit_message_text(
                 f"❌ **FAILED TO SEND MESSAGE**\n\n"
                 f"Error: {str(e)}\n\n"
@@ -1243,84 +3735,273 @@ async def handle_broadcast_confirmation(update: Update, context: ContextTypes.DE
             await query.edit_message_text("❌ Country data not found.")
             return
         
-        users = get_users_by_country(country_code)
+        job_id, total = await run_db(
+            create_broadcast_job,
+            admin_id=user_id,
+            target_type='country',
+            target_id=country_code,
+            message_type='country_broadcast',
+            content=get_content_preview(broadcast_message),
+            from_chat_id=broadcast_message.chat_id,
+            message_id=broadcast_message.message_id,
+            media=extract_broadcast_media(broadcast_message)
+        )
         
-        if not users:
+        if total == 0:
+            await run_db(finish_broadcast_job, job_id)
             await query.edit_message_text(f"❌ No users found in {country_name}.")
             return
         
-        total = len(users)
-        successful = 0
-        failed = 0
-        
-        progress_msg = await query.message.reply_text(
-            f"📤 Starting broadcast to {country_name}...\n0/{total} (0%)"
+        progress_msg = await query.edit_message_text(
+            f"📤 Broadcast #{job_id} to {country_name} started in the background...\n0/{total} (0%)\n\n"
+            f"Job ID: #{job_id} — manage it from 📦 Broadcast Jobs in the admin panel.",
+            reply_markup=get_broadcast_job_keyboard(job_id)
         )
         
-        for i, user in enumerate(users, 1):
-            try:
-                await context.bot.copy_message(
-                    chat_id=user['user_id'],
-                    from_chat_id=broadcast_message.chat_id,
-                    message_id=broadcast_message.message_id
-                )
-                successful += 1
-                
-                if i % 5 == 0 or i == total:
-                    percentage = (i / total) * 100
-                    await progress_msg.edit_text(
-                        f"📤 Broadcasting to {country_name}...\n"
-                        f"{i}/{total} ({percentage:.1f}%)\n"
-                        f"✅ {successful} successful"
-                    )
-                    
-            except Exception as e:
-                failed += 1
-                logger.error(f"Failed to send to user {user['user_id']} in {country_name}: {e}")
-        
-        content_preview = ""
-        if broadcast_message.text:
-            content_preview = broadcast_message.text[:100]
-        elif broadcast_message.caption:
-            content_preview = broadcast_message.caption[:100]
-        else:
-            content_preview = "Media message"
-            
-        save_broadcast(
+        BROADCAST_MANAGER.submit(context.bot, job_id, progress_msg)
+        
+        context.user_data.clear()
+    
+    elif query.data == "confirm_segment":
+        # Send to a filtered segment
+        broadcast_message = context.user_data.get('broadcast_message')
+        segment = context.user_data.get('segment')
+        
+        if not broadcast_message or segment is None:
+            await query.edit_message_text("❌ Segment data not found.")
+            return
+        
+        job_id, total = await run_db(
+            create_broadcast_job,
             admin_id=user_id,
-            target_type='country',
-            target_id=country_code,
-            message_type='country_broadcast',
-            content=content_preview,
-            sent_count=successful,
-            failed_count=failed
+            target_type='segment',
+            target_id=json.dumps(segment, sort_keys=True),
+            message_type='segment_broadcast',
+            content=get_content_preview(broadcast_message),
+            from_chat_id=broadcast_message.chat_id,
+            message_id=broadcast_message.message_id,
+            media=extract_broadcast_media(broadcast_message)
         )
         
-        report = (
-            f"✅ **COUNTRY BROADCAST COMPLETED**\n\n"
-            f"📍 Country: {country_name}\n"
-            f"📊 **Results:**\n"
-            f"• Total users: {total}\n"
-            f"• Successfully sent: {successful}\n"
-            f"• Failed: {failed}\n"
-            f"• Success rate: {(successful/total*100):.1f}%\n\n"
-            f"📝 Message preview saved in database."
+        if total == 0:
+            await run_db(finish_broadcast_job, job_id)
+            await query.edit_message_text("❌ No users match this segment.")
+            return
+        
+        progress_msg = await query.edit_message_text(
+            f"📤 Broadcast #{job_id} to {describe_segment(segment)} started in the background...\n0/{total} (0%)\n\n"
+            f"Job ID: #{job_id} — manage it from 📦 Broadcast Jobs in the admin panel.",
+            reply_markup=get_broadcast_job_keyboard(job_id)
         )
         
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="back_to_admin")]
-        ])
+        BROADCAST_MANAGER.submit(context.bot, job_id, progress_msg)
         
-        await progress_msg.edit_text(report, reply_markup=keyboard)
-        await query.message.delete()
+        context.user_data.clear()
+    
+    elif query.data == "confirm_staggered":
+        # Any audience, delivered per country inside local daytime hours
+        broadcast_message = context.user_data.get('broadcast_message')
+        
+        if not broadcast_message:
+            await query.edit_message_text("❌ Broadcast data not found.")
+            return
+        
+        target_type, target_id, message_type = broadcast_target(context.user_data)
+        job_id, total = await run_db(
+            create_broadcast_job,
+            admin_id=user_id,
+            target_type=target_type,
+            target_id=target_id,
+            message_type=message_type,
+            content=get_content_preview(broadcast_message),
+            from_chat_id=broadcast_message.chat_id,
+            message_id=broadcast_message.message_id,
+            media=extract_broadcast_media(broadcast_message),
+            staggered=True
+        )
+        
+        if total == 0:
+            await run_db(finish_broadcast_job, job_id)
+            await query.edit_message_text("❌ No users to broadcast to.")
+            return
+        
+        start_hour, end_hour = DELIVERY_WINDOW
+        progress_msg = await query.edit_message_text(
+            f"🌙 Broadcast #{job_id} scheduled for local daytime delivery...\n0/{total} (0%)\n\n"
+            f"Each country receives it between {start_hour:02d}:00 and {end_hour:02d}:00 local time, "
+            f"spread over {DELIVERY_SPREAD_MINUTES} minutes.\n"
+            f"Job ID: #{job_id} — manage it from 📦 Broadcast Jobs in the admin panel.",
+            reply_markup=get_broadcast_job_keyboard(job_id)
+        )
+        
+        BROADCAST_MANAGER.submit(context.bot, job_id, progress_msg)
         
         context.user_data.clear()
     
-    elif query.data in ["cancel_send", "cancel_specific", "cancel_selected_user", "cancel_country"]:
+    elif query.data == "schedule_broadcast":
+        if not context.user_data.get('broadcast_message'):
+            await query.edit_message_text("❌ Broadcast data not found.")
+            return
+        
+        context.user_data['awaiting_schedule'] = True
+        await query.edit_message_text(
+            f"⏰ **SCHEDULE BROADCAST**\n\n"
+            f"Send the time for a one-off broadcast:\n"
+            f"`YYYY-MM-DD HH:MM` (e.g. `2026-11-01 03:00`)\n\n"
+            f"or a cron schedule for a recurring one (minute hour day month weekday):\n"
+            f"`0 3 * * 1` — every Monday at 03:00\n"
+            f"`30 2 1 * *` — 02:30 on the 1st of every month\n\n"
+            f"🕒 Timezone: {SCHEDULER_TIMEZONE.key}\n"
+            f"⚠️ Keep your original message: it is copied when the broadcast runs.\n\n"
+            f"To cancel, send /cancel"
+        )
+    
+    elif query.data in ["cancel_send", "cancel_specific", "cancel_selected_user", "cancel_country", "cancel_segment"]:
         await query.edit_message_text("❌ Operation cancelled.")
         context.user_data.clear()
         await admin_panel(update, context)
 
+@instrumented
+async def handle_broadcast_job_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List broadcast jobs and pause/resume/cancel running ones"""
+    query = update.callback_query
+    
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        await query.answer("❌ Access denied.")
+        return
+    
+    if query.data == "bcast_jobs":
+        await query.answer()
+        jobs = await run_db(get_recent_broadcast_jobs, 10)
+        
+        buttons = []
+        for job in jobs:
+            control = BROADCAST_MANAGER.control(job['id'])
+            status = 'paused' if control and control.paused else job['status']
+            label = BROADCAST_STATUS_LABELS.get(status, status).split(' ', 1)[0]
+            target = {'country': job['target_id'], 'segment': 'SEGMENT'}.get(job['target_type'], 'ALL')
+            buttons.append([InlineKeyboardButton(
+                f"{label} #{job['id']} · {target} · {job['total_count']} users",
+                callback_data=f"job_view_{job['id']}"
+            )])
+        buttons.append([InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="back_to_admin")])
+        
+        text = "📦 **BROADCAST JOBS**\n\nSelect a job to see its status:" if jobs else "📦 No broadcast jobs yet."
+        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(buttons))
+        return
+    
+    _, action, job_id = query.data.split('_')
+    job_id = int(job_id)
+    
+    if action == 'pause':
+        done = await BROADCAST_MANAGER.pause(job_id)
+        await query.answer(f"⏸ Broadcast #{job_id} paused" if done else "Job is not running")
+    elif action == 'resume':
+        done = await BROADCAST_MANAGER.resume(job_id)
+        await query.answer(f"▶️ Broadcast #{job_id} resumed" if done else "Job is not running")
+    elif action == 'cancel':
+        done = await BROADCAST_MANAGER.cancel(job_id)
+        await query.answer(f"🛑 Cancelling broadcast #{job_id}..." if done else "Job is not running")
+        if done:
+            # The job posts its final report on this message once the workers stop
+            return
+    else:
+        await query.answer()
+    
+    job = await run_db(get_broadcast_job, job_id)
+    if not job:
+        await query.edit_message_text("❌ Broadcast job not found.")
+        return
+    
+    control = BROADCAST_MANAGER.control(job_id)
+    if control and not control.halted:
+        keyboard = get_broadcast_job_keyboard(job_id, control.paused)
+    else:
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("📦 All Broadcast Jobs", callback_data="bcast_jobs")],
+            [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="back_to_admin")]
+        ])
+    
+    try:
+        await query.edit_message_text(format_broadcast_job(job, control), reply_markup=keyboard)
+    except BadRequest as e:
+        if 'not modified' not in str(e):
+            raise
+
+@instrumented
+async def handle_schedule_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List scheduled broadcasts and cancel them"""
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        await query.edit_message_text("❌ Access denied.")
+        return
+    
+    action = query.data
+    if action.startswith("sched_cancel_"):
+        await run_db(cancel_scheduled_broadcast, int(action.replace('sched_cancel_', '')))
+        action = "sched_list"
+    
+    if action == "sched_list":
+        schedules = await run_db(get_scheduled_broadcasts, 10)
+        buttons = []
+        for schedule in schedules:
+            run_at = utc_to_local(datetime.strptime(schedule['next_run_at'], '%Y-%m-%d %H:%M:%S'))
+            buttons.append([InlineKeyboardButton(
+                f"{'🔁' if schedule['schedule'] else '1️⃣'} #{schedule['id']} · {run_at:%d/%m %H:%M}",
+                callback_data=f"sched_view_{schedule['id']}"
+            )])
+        buttons.append([InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="back_to_admin")])
+        
+        text = (
+            f"⏰ **SCHEDULED BROADCASTS** ({SCHEDULER_TIMEZONE.key})\n\nSelect one to see details:"
+            if schedules else
+            "⏰ No scheduled broadcasts.\n\nUse \"⏰ Schedule Instead\" when confirming a broadcast."
+        )
+        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(buttons))
+        return
+    
+    schedule_id = int(action.replace('sched_view_', ''))
+    schedule = await run_db(get_scheduled_broadcast, schedule_id)
+    if not schedule:
+        await query.edit_message_text("❌ Scheduled broadcast not found.")
+        return
+    
+    run_at = utc_to_local(datetime.strptime(schedule['next_run_at'], '%Y-%m-%d %H:%M:%S'))
+    buttons = []
+    if schedule['status'] == 'active':
+        buttons.append([InlineKeyboardButton("🗑 Cancel Schedule", callback_data=f"sched_cancel_{schedule_id}")])
+    buttons.append([InlineKeyboardButton("⏰ All Scheduled Broadcasts", callback_data="sched_list")])
+    
+    await query.edit_message_text(
+        f"⏰ **SCHEDULED BROADCAST #{schedule_id}**\n\n"
+        f"🎯 Target: {describe_broadcast_target(schedule) or 'All users'}\n"
+        f"🔁 Repeats: {schedule['schedule'] or 'no (one-off)'}\n"
+        f"▶️ Next run: {run_at:%Y-%m-%d %H:%M} ({SCHEDULER_TIMEZONE.key})\n"
+        f"📊 Runs so far: {schedule['run_count']}"
+        + (f" (last: job #{schedule['last_job_id']})" if schedule['last_job_id'] else "") + "\n"
+        f"📝 Message: {schedule['content']}",
+        reply_markup=InlineKeyboardMarkup(buttons)
+    )
+
+@instrumented
+async def handle_my_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Track users blocking and unblocking the bot in private chats"""
+    member_update = update.my_chat_member
+    if member_update.chat.type != Chat.PRIVATE:
+        return
+    
+    user_id = member_update.chat.id
+    status = member_update.new_chat_member.status
+    if status == ChatMember.BANNED:
+        print(f"🚫 User {user_id} blocked the bot")
+        await run_db(set_user_undeliverable, user_id, 'blocked')
+    elif status == ChatMember.MEMBER:
+        await run_db(reactivate_user, user_id)
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.error(f"Error: {context.error}")
     # Print full error details
@@ -1336,22 +4017,286 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         pass
 
+# ========== UPDATE PROCESSING ==========
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently while keeping each user's updates strictly ordered.
+    
+    The registration conversation (PHONE -> LANGUAGE -> COUNTRY) and the admin flows keep
+    state between updates, so two updates from the same user must never overlap. Each user
+    gets a FIFO lock; updates from different users only share the global concurrency limit.
+    
+    The limit is applied *after* the user's lock is taken, so a user with a backlog (e.g. an
+    admin tapping while a long handler runs) never occupies slots other users could use.
+    The base class semaphore bounds the updates admitted at all (`max_pending_updates`,
+    running or waiting for their user's lock), which also bounds the per-user lock table;
+    a user's lock is dropped as soon as none of their updates hold or wait for it.
+    """
+    
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: Optional[int] = None):
+        super().__init__(max(max_pending_updates or max_concurrent_updates * 8, max_concurrent_updates))
+        self.slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self.user_locks: Dict[int, asyncio.Lock] = {}
+        self.user_waiting: Dict[int, int] = {}
+    
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = None
+        if isinstance(update, Update):
+            if update.effective_user:
+                key = update.effective_user.id
+            elif update.effective_chat:
+                key = update.effective_chat.id
+        
+        if key is None:
+            async with self.slots:
+                await coroutine
+            return
+        
+        lock = self.user_locks.get(key)
+        if lock is None:
+            lock = self.user_locks[key] = asyncio.Lock()
+        self.user_waiting[key] = self.user_waiting.get(key, 0) + 1
+        try:
+            async with lock:
+                async with self.slots:
+                    await coroutine
+        finally:
+            self.user_waiting[key] -= 1
+            if not self.user_waiting[key]:
+                # Last pending update for this user: drop the lock so the dicts stay small
+                del self.user_waiting[key]
+                del self.user_locks[key]
+    
+    async def initialize(self) -> None:
+        pass
+    
+    async def shutdown(self) -> None:
+        pass
+
+# ========== HTTP SERVER ==========
+class HTTPRequest:
+    def __init__(self, method: str, path: str, headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.path = path
+        self.headers = headers  # lower-cased names
+        self.body = body
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+                429: 'Too Many Requests', 431: 'Request Header Fields Too Large'}
+HTTP_MAX_BODY = 1024 * 1024
+HTTP_MAX_HEADERS = 100               # header lines per request
+HTTP_MAX_HEADER_BYTES = 16 * 1024    # request line plus headers
+HTTP_READ_TIMEOUT = 10               # seconds to receive one request's head and body
+HTTP_IDLE_TIMEOUT = 60               # seconds a keep-alive connection may wait for the next request
+
+class HTTPError(Exception):
+    def __init__(self, status: int):
+        super().__init__(HTTP_REASONS[status])
+        self.status = status
+
+async def read_request_head(reader: asyncio.StreamReader, request_line: bytes) -> tuple:
+    """(method, path, headers) of a request; raises HTTPError on malformed or oversized heads"""
+    try:
+        method, path, _ = request_line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise HTTPError(400)
+    
+    headers = {}
+    head_bytes = len(request_line)
+    while True:
+        try:
+            line = await reader.readline()
+        except ValueError:
+            # One line longer than the stream limit
+            raise HTTPError(431)
+        if line in (b'\r\n', b'\n', b''):
+            return method, path, headers
+        head_bytes += len(line)
+        if len(headers) >= HTTP_MAX_HEADERS or head_bytes > HTTP_MAX_HEADER_BYTES:
+            raise HTTPError(431)
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+async def serve_http(host: str, port: int, handler: Callable[[HTTPRequest], Awaitable[tuple]]):
+    """Minimal HTTP/1.1 server on asyncio streams (keep-alive, Content-Length bodies only).
+    
+    `handler` returns (status, content_type, body_bytes). Enough for the Telegram webhook
+    and internal endpoints without pulling a web framework into the deployment. It faces
+    the internet in webhook mode, so every read has a deadline and request heads are
+    capped: slow or stalled clients are disconnected instead of holding a connection.
+    """
+    async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), HTTP_IDLE_TIMEOUT)
+                if not request_line:
+                    break
+                
+                keep_alive = False
+                try:
+                    async with asyncio.timeout(HTTP_READ_TIMEOUT):
+                        method, path, headers = await read_request_head(reader, request_line)
+                        length = int(headers.get('content-length') or 0)
+                        if length > HTTP_MAX_BODY:
+                            raise HTTPError(413)
+                        request_body = await reader.readexactly(length) if length else b''
+                except HTTPError as e:
+                    status, content_type, body = e.status, 'text/plain', HTTP_REASONS[e.status].encode()
+                except ValueError:
+                    # Non-numeric Content-Length
+                    status, content_type, body = 400, 'text/plain', b'Bad Request'
+                else:
+                    status, content_type, body = await handler(HTTPRequest(method, path, headers, request_body))
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTP_REASONS.get(status, 'OK')}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body
+                )
+                await asyncio.wait_for(writer.drain(), HTTP_READ_TIMEOUT)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ValueError):
+            # Stalled clients, dropped connections and request lines over the stream limit
+            pass
+        except Exception as e:
+            logger.error(f"HTTP connection error: {e}")
+        finally:
+            writer.close()
+    
+    # The stream limit caps a single line, so one huge header cannot be buffered whole
+    return await asyncio.start_server(handle_connection, host, port, limit=HTTP_MAX_HEADER_BYTES)
+
+# ========== WEBHOOK ==========
+def webhook_request_handler(application: Application):
+    """Verify, decode and enqueue Telegram webhook updates"""
+    async def handle(request: HTTPRequest):
+        if request.path == '/' and request.method == 'GET':
+            return 200, 'text/plain', b'OK'  # load balancer health check
+        if request.path != WEBHOOK_PATH:
+            return 404, 'text/plain', b'Not Found'
+        if request.method != 'POST':
+            return 405, 'text/plain', b'Method Not Allowed'
+        
+        if WEBHOOK_SECRET:
+            token = request.headers.get('x-telegram-bot-api-secret-token', '')
+            if not hmac.compare_digest(token, WEBHOOK_SECRET):
+                logger.warning("Rejected webhook request with invalid secret token")
+                return 403, 'text/plain', b'Forbidden'
+        
+        try:
+            update = Update.de_json(json.loads(request.body), application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Rejected malformed webhook update: {e}")
+            return 400, 'text/plain', b'Bad Request'
+        
+        await application.update_queue.put(update)
+        return 200, 'text/plain', b'OK'
+    
+    return handle
+
+async def run_webhook(application: Application):
+    """Run the bot behind the embedded webhook server until SIGINT/SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows
+    
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    
+    if WEBHOOK_URL:
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True
+        )
+        print(f"🌐 Webhook registered: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+    
+    if not WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET is empty: anyone who finds the webhook URL can post forged updates")
+    
+    await application.start()
+    server = await serve_http(WEBHOOK_LISTEN, WEBHOOK_PORT, webhook_request_handler(application))
+    print(f"🌐 Webhook server listening on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    
+    try:
+        await stop.wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
 # ========== MAIN FUNCTION ==========
-def main():
-    print("=" * 50)
-    print("🤖 AFFILIATE SUPPORT BOT - STARTING")
-    print("=" * 50)
-    print(f"🔑 Token: {TOKEN[:10]}...")
-    print(f"👑 Admin IDs: {ADMIN_IDS}")
-    print(f"💾 Database: {DB_PATH}")
-    print("=" * 50)
+async def post_init(application: Application):
+    if METRICS_PORT:
+        # Metrics are optional: a busy port must not keep the bot from starting
+        try:
+            application.bot_data['metrics_server'] = await serve_http(METRICS_LISTEN, METRICS_PORT, metrics_request_handler)
+            print(f"📈 Metrics on http://{METRICS_LISTEN}:{METRICS_PORT}/metrics")
+        except OSError as e:
+            logger.error(f"Metrics endpoint disabled, cannot listen on {METRICS_LISTEN}:{METRICS_PORT}: {e}")
+    ACTIVITY_BUFFER.start()
+    await STATE_STORE.start()
+    ADMIN_NOTIFIER.start(application.bot)
+    await resume_broadcast_jobs(application)
+    await BROADCAST_SCHEDULER.start(application)
+
+async def post_stop(application: Application):
+    # Runs before application.shutdown() closes the bot's HTTP client, so jobs stop
+    # cleanly at the next recipient instead of failing on a closed connection
+    await BROADCAST_SCHEDULER.stop()
+    await BROADCAST_MANAGER.shutdown()
+    # Queued admin notices still need the client too
+    await ADMIN_NOTIFIER.stop()
+
+async def post_shutdown(application: Application):
+    await ACTIVITY_BUFFER.stop()
+    await STATE_STORE.stop()
     
-    init_db()
+    DB_READERS.shutdown(wait=True)
+    await run_db(db.close)
+    DB_WRITER.shutdown(wait=True)
     
-    application = Application.builder().token(TOKEN).build()
+    metrics_server = application.bot_data.pop('metrics_server', None)
+    if metrics_server:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+
+def build_application(request: Optional[BaseRequest] = None) -> Application:
+    """Create the Application with all handlers registered (`request` overrides the HTTP client)"""
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .request(request or InstrumentedRequest(connection_pool_size=256))
+        .get_updates_request(InstrumentedRequest())
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('start', start)],
+        # The callback entry points pick up signups whose state outlived the process
+        # (STATE_BACKEND=sqlite); without a stored state they answer "Session expired"
+        entry_points=[
+            CommandHandler('start', start),
+            CallbackQueryHandler(handle_language_selection, pattern='^lang_'),
+            CallbackQueryHandler(handle_country_selection, pattern='^country_')
+        ],
         states={
             PHONE: [MessageHandler(filters.CONTACT, handle_contact)],
             LANGUAGE: [CallbackQueryHandler(handle_language_selection, pattern='^lang_')],
@@ -1363,13 +4308,19 @@ def main():
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler('admin', admin_panel))
     application.add_handler(CommandHandler('cancel', cancel))
+    application.add_handler(CommandHandler('broadcast_settings', broadcast_settings))
+    application.add_handler(ChatMemberHandler(handle_my_chat_member, ChatMemberHandler.MY_CHAT_MEMBER))
     
     # Admin callback handlers
     application.add_handler(CallbackQueryHandler(admin_callback_handler, pattern='^(broadcast_all|send_specific|broadcast_country|view_stats|view_users|view_users_select|close_admin|back_to_admin|bcast_country_.*|user_page_.*|select_user_.*)$'))
-    application.add_handler(CallbackQueryHandler(handle_broadcast_confirmation, pattern='^(confirm_send|confirm_specific|confirm_country|cancel_send|cancel_specific|cancel_country|confirm_selected_user_.*|cancel_selected_user)$'))
+    application.add_handler(CallbackQueryHandler(handle_segment_builder, pattern='^seg_'))
+    application.add_handler(CallbackQueryHandler(handle_schedule_action, pattern=r'^(sched_list|sched_(view|cancel)_\d+)$'))
+    application.add_handler(CallbackQueryHandler(handle_broadcast_job_action, pattern=r'^(bcast_jobs|job_(view|pause|resume|cancel)_\d+)$'))
+    application.add_handler(CallbackQueryHandler(handle_broadcast_confirmation, pattern='^(confirm_send|confirm_specific|confirm_country|confirm_segment|confirm_staggered|schedule_broadcast|cancel_send|cancel_specific|cancel_country|cancel_segment|confirm_selected_user_.*|cancel_selected_user)$'))
     
-    # Message handlers for users
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_main_menu))
+    # Message handlers for users; admin text goes to handle_admin_message, which
+    # would otherwise never see the schedule, segment date or broadcast text input
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & ~filters.User(ADMIN_IDS), handle_main_menu))
     
     # Handler for admin messages
     application.add_handler(MessageHandler(
@@ -1378,14 +4329,31 @@ def main():
     ))
     
     application.add_error_handler(error_handler)
+    return application
+
+def main():
+    print("=" * 50)
+    print("🤖 AFFILIATE SUPPORT BOT - STARTING")
+    print("=" * 50)
+    print(f"🔑 Token: {TOKEN[:10]}...")
+    print(f"👑 Admin IDs: {ADMIN_IDS}")
+    print(f"💾 Database: {DB_PATH}")
+    print(f"📡 Mode: {BOT_MODE} (max {MAX_CONCURRENT_UPDATES} concurrent, {MAX_PENDING_UPDATES} pending updates)")
+    print("=" * 50)
+    
+    init_db()
+    application = build_application()
     
-    print("🔄 Starting bot polling...")
+    print("🔄 Starting bot webhook..." if BOT_MODE == 'webhook' else "🔄 Starting bot polling...")
     print("✅ Bot is RUNNING!")
     print("📱 Test with: /start")
     print("👑 Admin panel: /admin")
     print("=" * 50 + "\n")
     
-    application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+    if BOT_MODE == 'webhook':
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,94 @@
+"""Shared fixtures: a throwaway database seeded like the benchmarks' and in-process Bot API calls."""
+import asyncio
+import contextlib
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import main  # noqa: E402
+from telegram import Update  # noqa: E402
+from broadcast_load import build_database  # noqa: E402
+from update_replay import StubRequest  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """main.db pointed at a fresh database with 100 registered users, with empty caches"""
+    monkeypatch.setattr(main, 'db', main.db)
+    monkeypatch.setattr(main, 'USER_CACHE', main.UserCache(main.USER_CACHE.max_size, main.USER_CACHE.ttl))
+    monkeypatch.setattr(main, 'STATE_STORE', main.create_state_store())
+    build_database(str(tmp_path / 'test.db'), 100)
+    yield main.db
+    main.db.close()
+
+
+class RecordingRequest(StubRequest):
+    """StubRequest that also keeps every (api method, parameters) the bot sent"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs):
+        self.calls.append((url.rsplit('/', 1)[-1], request_data.json_parameters if request_data else {}))
+        return await super().do_request(url, method, request_data, *args, **kwargs)
+
+
+class BotHarness:
+    """The real Application on its own event loop, fed synthetic updates one at a time"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.request = RecordingRequest()
+        self.application = main.build_application(self.request)
+
+    def run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def play(self, *payloads):
+        for payload in payloads:
+            self.run(self.application.process_update(Update.de_json(payload, self.application.bot)))
+
+    def sent(self, api_method: str) -> list:
+        return [params for name, params in self.request.calls if name == api_method]
+
+    def start(self):
+        self.run(self.application.initialize())
+        self.run(self.application.post_init(self.application))
+
+    def stop(self):
+        self.run(self.application.post_stop(self.application))
+        self.run(self.application.shutdown())
+        self.run(self.application.post_shutdown(self.application))
+        self.loop.close()
+
+
+@pytest.fixture
+def bot(database, monkeypatch):
+    """A started BotHarness on the test database; handlers' console output is discarded.
+
+    post_shutdown shuts the DB threads down and the background services are bound to one
+    event loop, so every test gets its own.
+    """
+    monkeypatch.setattr(main, 'DB_WRITER', ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer'))
+    monkeypatch.setattr(main, 'DB_READERS', ThreadPoolExecutor(max_workers=2, thread_name_prefix='db-reader'))
+    monkeypatch.setattr(main, 'ACTIVITY_BUFFER', main.ActivityBuffer(
+        main.ACTIVITY_FLUSH_INTERVAL, main.ACTIVITY_FLUSH_SIZE, main.ACTIVITY_BUFFER_MAX
+    ))
+    monkeypatch.setattr(main, 'ADMIN_NOTIFIER', main.AdminNotifier())
+    monkeypatch.setattr(main, 'BROADCAST_LIMITER', main.RateLimiter(
+        main.BROADCAST_SETTINGS['rate'], main.BROADCAST_SETTINGS['per_chat_interval']
+    ))
+    monkeypatch.setattr(main, 'BROADCAST_MANAGER', main.BroadcastManager())
+    monkeypatch.setattr(main, 'BROADCAST_SCHEDULER', main.BroadcastScheduler())
+    harness = BotHarness()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        harness.start()
+        yield harness
+        harness.stop()
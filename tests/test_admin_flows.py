@@ -0,0 +1,92 @@
+"""The admin panel's multi-step flows, driven through the real handler graph.
+
+Routing mistakes between the admin text states and the main menu show up here as
+wrong database rows or replies rather than as fast benchmark numbers.
+"""
+import json
+
+import main
+from broadcast_load import callback_update, command_update, message_update
+
+ADMIN_ID = main.ADMIN_IDS[0]
+
+
+def start_scheduling(bot, text: str):
+    bot.play(
+        command_update(ADMIN_ID, '/admin'),
+        callback_update(ADMIN_ID, 'broadcast_all'),
+        message_update(ADMIN_ID, text=text),
+        callback_update(ADMIN_ID, 'schedule_broadcast'),
+    )
+
+
+def latest_schedule():
+    return main.db.fetchone(
+        'SELECT target_type, content, schedule, status FROM scheduled_broadcasts ORDER BY id DESC LIMIT 1'
+    )
+
+
+def test_cron_schedule_typed_as_admin_text(bot):
+    start_scheduling(bot, 'Weekly update')
+    bot.play(message_update(ADMIN_ID, text='0 3 * * 1'))
+
+    assert tuple(latest_schedule()) == ('all', 'Weekly update', '0 3 * * 1', 'active')
+
+
+def test_malformed_date_reports_the_date_error(bot):
+    start_scheduling(bot, 'Launch')
+    bot.play(message_update(ADMIN_ID, text='2026-13-01 10:00'))
+
+    assert 'not a valid date and time' in bot.sent('sendMessage')[-1]['text']
+    assert latest_schedule() is None
+
+    # Still waiting for a schedule, so the admin can simply try again
+    bot.play(message_update(ADMIN_ID, text='0 9 * * *'))
+    assert tuple(latest_schedule()) == ('all', 'Launch', '0 9 * * *', 'active')
+
+
+def confirm_segment(bot, *steps):
+    bot.play(
+        callback_update(ADMIN_ID, 'seg_menu'),
+        callback_update(ADMIN_ID, 'seg_registered'),
+        *steps,
+        callback_update(ADMIN_ID, 'seg_next'),
+        message_update(ADMIN_ID, text='Segment test'),
+        callback_update(ADMIN_ID, 'confirm_segment'),
+    )
+    target_id, total = main.db.fetchone(
+        "SELECT target_id, total_count FROM broadcasts WHERE target_type = 'segment' ORDER BY id DESC LIMIT 1"
+    )
+    return json.loads(target_id), total
+
+
+def test_custom_date_segment_typed_as_admin_text(bot):
+    with main.db.transaction() as cursor:
+        cursor.execute("UPDATE users SET registered_at = '2025-01-15 12:00:00' WHERE user_id <= 40")
+
+    segment, total = confirm_segment(
+        bot,
+        callback_update(ADMIN_ID, 'seg_reg_custom'),
+        message_update(ADMIN_ID, text='2025-01-01 2025-01-31'),
+    )
+
+    assert segment == {'registered_from': '2025-01-01', 'registered_to': '2025-01-31'}
+    assert total == 40
+
+
+def test_registered_preset_stays_relative(bot):
+    with main.db.transaction() as cursor:
+        cursor.execute("UPDATE users SET registered_at = datetime('now', '-30 days') WHERE user_id <= 40")
+
+    segment, total = confirm_segment(bot, callback_update(ADMIN_ID, 'seg_reg_7'))
+
+    assert segment == {'registered_days': 7}
+    assert total == 60
+
+
+def test_admin_still_gets_the_main_menu(bot):
+    bot.play(message_update(ADMIN_ID, text='ℹ️ About Program'))
+
+    api_method, params = bot.request.calls[-1]
+    assert api_method == 'sendMessage'
+    assert 'PROGRAM' in params['text']
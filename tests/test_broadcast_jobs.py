@@ -0,0 +1,45 @@
+import asyncio
+import json
+
+import main
+
+
+class RecordingMessage:
+    """Stands in for the admin's progress message and keeps every text it is edited to"""
+
+    def __init__(self):
+        self.texts = []
+
+    async def edit_text(self, text, reply_markup=None):
+        self.texts.append(text)
+
+
+class RenderOnStart:
+    """ProgressReporter that renders one progress line as soon as the job starts"""
+
+    def __init__(self, message, render, control=None):
+        self.message = message
+        self.render = render
+
+    def start(self, result):
+        self.message.texts.append(self.render(result, 0.0, None)[0])
+
+    async def stop(self):
+        pass
+
+
+def test_empty_segment_job_reports_without_dividing_by_zero(database, monkeypatch):
+    segment = json.dumps({'registered_from': '2099-01-01'})
+    job_id, total = main.create_broadcast_job(
+        main.ADMIN_IDS[0], 'segment', segment, 'broadcast', 'Nobody', main.ADMIN_IDS[0], 1
+    )
+    assert total == 0
+
+    monkeypatch.setattr(main, 'ProgressReporter', RenderOnStart)
+    message = RecordingMessage()
+    asyncio.run(main.execute_broadcast_job(None, job_id, message))
+
+    progress, report = message.texts
+    assert '0/0 (0.0%)' in progress
+    assert 'Success rate: 0.0%' in report
+    assert main.get_broadcast_job(job_id)['status'] == 'completed'
@@ -0,0 +1,41 @@
+"""POST recorded Telegram updates to a locally running webhook server.
+
+Each file may hold one update object or a JSON list of updates. Useful for
+exercising BOT_MODE=webhook without Telegram in the loop.
+
+Usage:
+    BOT_MODE=webhook PORT=8443 WEBHOOK_SECRET=s3cret python main.py
+    python tools/post_updates.py --secret s3cret tools/updates/start.json
+"""
+import argparse
+import http.client
+import json
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+', help='JSON files with recorded updates')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--path', default='/telegram')
+    parser.add_argument('--secret', default='', help='value for X-Telegram-Bot-Api-Secret-Token')
+    args = parser.parse_args()
+
+    conn = http.client.HTTPConnection(args.host, args.port, timeout=10)
+    headers = {'Content-Type': 'application/json'}
+    if args.secret:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = args.secret
+
+    for path in args.files:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        for update in data if isinstance(data, list) else [data]:
+            conn.request('POST', args.path, body=json.dumps(update).encode('utf-8'), headers=headers)
+            response = conn.getresponse()
+            print(f"{path} update {update.get('update_id')}: {response.status} {response.read().decode()}")
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()